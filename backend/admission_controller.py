@@ -0,0 +1,130 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from collections import deque
+from typing import Dict, Any, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class AdmissionController:
+    """
+    Global admission control in front of the inference pool. At most
+    `capacity` frames are in inference at once; the rest wait in per-exam
+    priority queues that are served round-robin, so one large exam cannot
+    starve another. Within an exam, higher-risk sessions go first. Frames
+    that wait longer than the deadline are shed instead of analyzed late.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.max_waiting = int(os.getenv("ADMISSION_MAX_QUEUE", "500"))
+        self.deadline = float(os.getenv("ADMISSION_FRAME_DEADLINE_SECONDS", "3.0"))
+
+        self._active = 0
+        self._waiting = 0
+        self._seq = itertools.count()
+        self._queues: Dict[Any, List] = {}   # {exam_id: heap of (-priority, seq, enqueued_at, future)}
+        self._rotation: deque = deque()      # exam_ids with waiting frames, in round-robin order
+        self._counters: Dict[Any, Dict[str, int]] = {}
+
+    async def acquire(self, exam_id: Any, priority: float = 0.0) -> bool:
+        """
+        Wait for an inference slot. Returns False if the frame was shed
+        (queue full or deadline passed) - the caller must then skip it.
+        Every True must be paired with release().
+        """
+        if self._active < self.capacity and self._waiting == 0:
+            self._active += 1
+            self._count(exam_id, "admitted")
+            return True
+
+        if self._waiting >= self.max_waiting:
+            self._count(exam_id, "shed_overload")
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        if exam_id not in self._queues:
+            self._queues[exam_id] = []
+            self._rotation.append(exam_id)
+        heapq.heappush(self._queues[exam_id], (-priority, next(self._seq), time.monotonic(), future))
+        self._waiting += 1
+
+        try:
+            # _dispatch only runs when a slot frees up, so the deadline is enforced here too
+            return await asyncio.wait_for(asyncio.shield(future), self.deadline)
+        except asyncio.TimeoutError:
+            if future.done():
+                # Granted in the same tick the timer fired - the slot is ours
+                return future.result()
+            future.set_result(False)
+            self._remove(exam_id, future)
+            self._count(exam_id, "shed_stale")
+            return False
+        except asyncio.CancelledError:
+            # The handler went away after being granted a slot - give it back
+            if future.done() and not future.cancelled() and future.result():
+                self.release()
+            elif not future.done():
+                future.cancel()
+                self._remove(exam_id, future)
+            raise
+
+    def _remove(self, exam_id: Any, future: asyncio.Future):
+        """Drop a waiter that gave up before _dispatch reached it"""
+        queue = self._queues.get(exam_id)
+        if not queue:
+            return
+        for position, entry in enumerate(queue):
+            if entry[3] is future:
+                queue[position] = queue[-1]
+                queue.pop()
+                heapq.heapify(queue)
+                self._waiting -= 1
+                break
+        if not queue:
+            del self._queues[exam_id]
+            self._rotation.remove(exam_id)
+
+    def release(self):
+        self._active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self._active < self.capacity and self._rotation:
+            exam_id = self._rotation.popleft()
+            queue = self._queues[exam_id]
+            _, _, enqueued_at, future = heapq.heappop(queue)
+            self._waiting -= 1
+
+            if queue:
+                self._rotation.append(exam_id)
+            else:
+                del self._queues[exam_id]
+
+            if future.done():
+                continue
+            if now - enqueued_at > self.deadline:
+                self._count(exam_id, "shed_stale")
+                future.set_result(False)
+                continue
+
+            self._active += 1
+            self._count(exam_id, "admitted")
+            future.set_result(True)
+
+    def _count(self, exam_id: Any, outcome: str):
+        counters = self._counters.setdefault(exam_id, {"admitted": 0, "shed_stale": 0, "shed_overload": 0})
+        counters[outcome] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "active": self._active,
+            "waiting": self._waiting,
+            "deadline_seconds": self.deadline,
+            "per_exam": {str(exam_id): dict(counters) for exam_id, counters in self._counters.items()},
+        }
@@ -1,17 +1,448 @@
 import os
-import base64
+import re
+import time
 import json
-from typing import Dict, Any, Optional, Tuple
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, List
 from openai import OpenAI
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
+import cv2
+from image_utils import Frame, dhash, hamming_distance, decode_grayscale, to_base64
+from frame_normalizer import FrameNormalizer
+from inference_router import OllamaRouter
+from metrics import INFERENCE_LATENCY, VERDICT_CACHE_HITS, VERDICT_CACHE_MISSES
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+VALID_ALERT_TYPES = ["looking_away", "multiple_people", "phone_detected",
+                     "reading_from_material", "suspicious_activity", "none"]
+
+class VerdictCache:
+    """
+    Per-session cache of model verdicts keyed by a perceptual hash of the
+    webcam frame. A frame within `max_distance` bits of a cached hash reuses
+    that verdict until it expires. Sessions and entries are evicted LRU.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("VERDICT_CACHE_ENABLED", "true").lower() == "true"
+        self.max_distance = int(os.getenv("VERDICT_CACHE_MAX_DISTANCE", "5"))
+        self.ttl = float(os.getenv("VERDICT_CACHE_TTL_SECONDS", "20"))
+        self.max_sessions = int(os.getenv("VERDICT_CACHE_MAX_SESSIONS", "2000"))
+        self.entries_per_session = int(os.getenv("VERDICT_CACHE_ENTRIES_PER_SESSION", "4"))
+
+        self._lock = threading.Lock()
+        # {session_id: OrderedDict{frame_hash: (is_suspicious, analysis, stored_at)}}
+        self._sessions: "OrderedDict[int, OrderedDict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, session_id: int, frame_hash: int) -> Optional[Tuple[bool, Dict[str, Any]]]:
+        now = time.time()
+        with self._lock:
+            entries = self._sessions.get(session_id)
+            if entries is None:
+                self.misses += 1
+                VERDICT_CACHE_MISSES.inc()
+                return None
+            self._sessions.move_to_end(session_id)
+
+            best_hash, best_distance = None, None
+            for cached_hash, (_, _, stored_at) in list(entries.items()):
+                if now - stored_at > self.ttl:
+                    del entries[cached_hash]
+                    continue
+                distance = hamming_distance(cached_hash, frame_hash)
+                if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                    best_hash, best_distance = cached_hash, distance
+
+            if best_hash is None:
+                self.misses += 1
+                VERDICT_CACHE_MISSES.inc()
+                return None
+
+            entries.move_to_end(best_hash)
+            self.hits += 1
+            VERDICT_CACHE_HITS.inc()
+            is_suspicious, analysis, _ = entries[best_hash]
+            return is_suspicious, dict(analysis)
+
+    def put(self, session_id: int, frame_hash: int, is_suspicious: bool, analysis: Dict[str, Any]):
+        with self._lock:
+            entries = self._sessions.get(session_id)
+            if entries is None:
+                entries = self._sessions[session_id] = OrderedDict()
+            self._sessions.move_to_end(session_id)
+
+            entries[frame_hash] = (is_suspicious, dict(analysis), time.time())
+            entries.move_to_end(frame_hash)
+            while len(entries) > self.entries_per_session:
+                entries.popitem(last=False)
+                self.evictions += 1
+
+            while len(self._sessions) > self.max_sessions:
+                _, dropped = self._sessions.popitem(last=False)
+                self.evictions += len(dropped)
+
+    def forget(self, session_id: int):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "sessions": len(self._sessions),
+                "max_distance": self.max_distance,
+                "ttl_seconds": self.ttl,
+            }
+
+class FaceCountTier:
+    """
+    Fast local tier of the detection cascade. OpenCV's bundled Haar cascades
+    count faces in a few milliseconds; clear-cut frames (nobody there, more
+    than one person, one well-centred face) are decided here and only the
+    ambiguous ones are escalated to the vision model.
+
+    The cascade misses faces often enough (lighting, a hand over the face)
+    that a single empty frame proves little: a session is only called
+    absent locally after FACE_TIER_ABSENT_STREAK consecutive empty frames,
+    and the vision model decides the ones before. Suspicious verdicts below
+    the alert confidence threshold are escalated as well.
+    """
+
+    def __init__(self, confidence_threshold: float):
+        self.enabled = os.getenv("FACE_TIER_ENABLED", "true").lower() == "true"
+        self.detect_width = int(os.getenv("FACE_TIER_DETECT_WIDTH", "320"))
+        # A face narrower than this fraction of the frame is too far away to call "clear"
+        self.min_face_ratio = float(os.getenv("FACE_TIER_MIN_FACE_RATIO", "0.12"))
+        # Max offset of the face centre from the frame centre, as a fraction of frame size
+        self.max_center_offset = float(os.getenv("FACE_TIER_MAX_CENTER_OFFSET", "0.25"))
+        self.absent_streak = max(1, int(os.getenv("FACE_TIER_ABSENT_STREAK", "3")))
+        self.confidence_threshold = confidence_threshold
+
+        self._local = threading.local()  # CascadeClassifier instances are not shared across threads
+        self._lock = threading.Lock()
+        self._counts = {"absent": 0, "multiple_people": 0, "clear": 0, "escalated": 0}
+        self._misses: Dict[int, int] = {}  # {session_id: consecutive frames without a face}
+
+    def _classifiers(self):
+        if not hasattr(self._local, "frontal"):
+            self._local.frontal = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+            self._local.profile = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_profileface.xml")
+        return self._local.frontal, self._local.profile
+
+    def classify(self, webcam_image: Frame, session_id: Optional[int] = None) -> Optional[Tuple[bool, Dict[str, Any]]]:
+        """
+        Decide a frame from its face count.
+        Returns (is_suspicious, analysis_data) for clear cases, None to escalate.
+        Without a session_id there is no miss streak, so empty frames always escalate.
+        """
+        if not self.enabled:
+            return None
+
+        gray = decode_grayscale(webcam_image, width=self.detect_width)
+        if gray is None:
+            return None
+
+        frontal, profile = self._classifiers()
+        gray = cv2.equalizeHist(gray)
+        faces = frontal.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(24, 24))
+
+        misses = self._count_miss(session_id, len(faces) == 0)
+        if len(faces) >= 2:
+            return self._decide("multiple_people", True, {
+                "is_suspicious": True,
+                "confidence": 0.9,
+                "detected_issues": [f"{len(faces)} faces detected in frame"],
+                "severity": 4,
+                "description": "Multiple people visible in the webcam frame",
+                "alert_type": "multiple_people"
+            })
+
+        if len(faces) == 0:
+            # A turned head is missed by the frontal cascade, so check for a profile before calling it absent
+            if len(profile.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(24, 24))) > 0:
+                self._count_miss(session_id, False)
+                return self._escalate()
+            if misses < self.absent_streak:
+                return self._escalate()
+            return self._decide("absent", True, {
+                "is_suspicious": True,
+                "confidence": 0.8,
+                "detected_issues": [f"No face detected in {misses} consecutive frames"],
+                "severity": 3,
+                "description": "Student not visible in the webcam frame",
+                "alert_type": "suspicious_activity"
+            })
+
+        x, y, w, h = faces[0]
+        frame_h, frame_w = gray.shape[:2]
+        offset_x = abs((x + w / 2) / frame_w - 0.5)
+        offset_y = abs((y + h / 2) / frame_h - 0.5)
+        if w / frame_w >= self.min_face_ratio and offset_x <= self.max_center_offset and offset_y <= self.max_center_offset:
+            return self._decide("clear", False, {
+                "is_suspicious": False,
+                "confidence": 0.9,
+                "detected_issues": [],
+                "severity": 1,
+                "description": "Single student centred and facing the camera",
+                "alert_type": "none"
+            })
+
+        return self._escalate()
+
+    def _count_miss(self, session_id: Optional[int], missed: bool) -> int:
+        """Update the session's run of empty frames; returns its length"""
+        if session_id is None:
+            return 0
+        with self._lock:
+            if not missed:
+                self._misses.pop(session_id, None)
+                return 0
+            self._misses[session_id] = self._misses.get(session_id, 0) + 1
+            return self._misses[session_id]
+
+    def forget(self, session_id: int):
+        with self._lock:
+            self._misses.pop(session_id, None)
+
+    def _decide(self, outcome: str, is_suspicious: bool, analysis: Dict[str, Any]) -> Optional[Tuple[bool, Dict[str, Any]]]:
+        # Same bar as the model's verdicts; below it the model gets to look
+        if is_suspicious and analysis["confidence"] < self.confidence_threshold:
+            return self._escalate()
+        with self._lock:
+            self._counts[outcome] += 1
+        return is_suspicious, analysis
+
+    def _escalate(self) -> None:
+        with self._lock:
+            self._counts["escalated"] += 1
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"enabled": self.enabled, **self._counts}
+
+class StreamingVerdictParser:
+    """
+    Incremental scanner over a streamed JSON verdict. feed() returns True
+    once generation can stop: either the top-level object has closed, or
+    the model has already committed to is_suspicious=false with at least
+    `early_stop_confidence`.
+    """
+
+    _CLEAR_PATTERN = re.compile(r'"is_suspicious"\s*:\s*false')
+    _CONFIDENCE_PATTERN = re.compile(r'"confidence"\s*:\s*([0-9]*\.?[0-9]+)\s*[,}\s]')
+
+    def __init__(self, early_stop_confidence: float):
+        self.early_stop_confidence = early_stop_confidence
+        self.outcome = "exhausted"  # "object_closed" | "early_clear" | "exhausted"
+        self._text = []
+        self._depth = 0
+        self._started = False
+        self._in_string = False
+        self._escaped = False
+        self._early_confidence: Optional[float] = None
+
+    def feed(self, fragment: str) -> bool:
+        self._text.append(fragment)
+        for char in fragment:
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+                self._started = True
+            elif char == "}" and self._started:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.outcome = "object_closed"
+                    return True
+
+        text = self.text
+        if self._CLEAR_PATTERN.search(text):
+            match = self._CONFIDENCE_PATTERN.search(text)
+            if match and float(match.group(1)) >= self.early_stop_confidence:
+                self._early_confidence = float(match.group(1))
+                self.outcome = "early_clear"
+                return True
+        return False
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far, as generated"""
+        return "".join(self._text)
+
+    def content(self) -> str:
+        """The verdict as a complete JSON document"""
+        if self.outcome == "early_clear":
+            return json.dumps({
+                "is_suspicious": False,
+                "confidence": self._early_confidence,
+                "detected_issues": [],
+                "severity": 1,
+                "description": "No violation detected",
+                "alert_type": "none"
+            })
+        return self.text
+
+class OllamaLifecycle:
+    """
+    Startup/lifecycle management for the Ollama backend: a pooled HTTP
+    session shared by all inference calls, a warm-up generation on every
+    node before the app reports ready, keep_alive pinning so the model stays
+    resident, and a re-warm after idle periods. Requests that paid a model
+    load are tracked separately from steady-state latency.
+    """
+
+    def __init__(self, router: OllamaRouter, model: str):
+        self.router = router
+        self.model = model
+        # Duration string ("30m") or seconds; -1 keeps the model loaded indefinitely
+        self.keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+        self.rewarm_idle_seconds = float(os.getenv("OLLAMA_REWARM_IDLE_SECONDS", "600"))
+        # A response whose load_duration exceeds this paid a cold model load
+        self.cold_load_seconds = 0.5
+
+        pool_size = int(os.getenv("INFERENCE_MAX_WORKERS", "4")) * 2
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(1, len(router.endpoints)), pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.ready = False
+        self._lock = threading.Lock()
+        self._last_used: Dict[str, float] = {}
+        self._cold_latencies: List[float] = []
+        self._steady_latencies: List[float] = []
+        self._early_stop_latencies: List[float] = []
+        self._warmups = 0
+        self._unwarmed: List[str] = [endpoint.url for endpoint in router.endpoints]
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Warm every node in the background, then keep them warm"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="ollama-lifecycle", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        # Nodes that have never loaded the model are retried on every pass until they do
+        cold = {endpoint.url for endpoint in self.router.endpoints}
+        interval = 5.0
+        while True:
+            cold = {url for url in cold if not self.warm_up(url)}
+            self._unwarmed = sorted(cold)
+            if not self.ready and len(cold) < len(self.router.endpoints):
+                self.ready = True
+                logger.info("Ollama model warmed up", extra={
+                    "model": self.model, "nodes": len(self.router.endpoints) - len(cold)
+                })
+            if cold:
+                logger.warning("Ollama warm-up pending on %d node(s)", len(cold), extra={"endpoints": self._unwarmed})
+            else:
+                interval = min(60.0, self.rewarm_idle_seconds)
+
+            if self._stop.wait(interval):
+                return
+            now = time.time()
+            for endpoint in self.router.endpoints:
+                if endpoint.url not in cold and endpoint.healthy \
+                        and now - self._last_used.get(endpoint.url, 0) >= self.rewarm_idle_seconds:
+                    self.warm_up(endpoint.url)
+
+    def warm_up(self, url: str) -> bool:
+        """Load the model on a node with an empty generation"""
+        start_time = time.time()
+        try:
+            response = self.session.post(
+                f"{url}/api/generate",
+                json={"model": self.model, "prompt": "", "stream": False, "keep_alive": self.keep_alive},
+                timeout=120  # A cold load of an 8B vision model can take a while
+            )
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logger.warning("Ollama warm-up failed: %s", e, extra={"endpoint": url})
+            return False
+
+        with self._lock:
+            self._warmups += 1
+            self._last_used[url] = time.time()
+        logger.info("Ollama warm-up completed", extra={"endpoint": url, "latency_s": round(time.time() - start_time, 3)})
+        return True
+
+    def record_early_stop(self, url: str, latency: float):
+        """A stream closed before its final chunk - no load_duration, so neither cold nor steady"""
+        with self._lock:
+            self._last_used[url] = time.time()
+            self._early_stop_latencies.append(latency)
+            if len(self._early_stop_latencies) > 1000:
+                del self._early_stop_latencies[:500]
+
+    def record(self, url: str, result: Dict[str, Any], latency: float):
+        """Classify a completed request as cold or steady-state"""
+        cold = result.get("load_duration", 0) / 1e9 > self.cold_load_seconds
+        with self._lock:
+            self._last_used[url] = time.time()
+            samples = self._cold_latencies if cold else self._steady_latencies
+            samples.append(latency)
+            if len(samples) > 1000:
+                del samples[:500]
+
+    def get_stats(self) -> Dict[str, Any]:
+        def summary(samples: List[float]) -> Dict[str, Any]:
+            if not samples:
+                return {"count": 0}
+            ordered = sorted(samples)
+            return {
+                "count": len(ordered),
+                "p50": round(ordered[len(ordered) // 2], 3),
+                "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+                "max": round(ordered[-1], 3),
+            }
+
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "keep_alive": self.keep_alive,
+                "warmups": self._warmups,
+                "unwarmed_nodes": list(self._unwarmed),
+                "cold_latency": summary(self._cold_latencies),
+                "steady_latency": summary(self._steady_latencies),
+                "early_stop_latency": summary(self._early_stop_latencies),
+            }
+
 class AIProctorService:
     def __init__(self):
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
         self.ollama_url = os.getenv("OLLAMA_URL", "http://localhost:11434")
+        # Comma-separated list of inference nodes; falls back to the single OLLAMA_URL
+        self.ollama_urls = [url.strip() for url in os.getenv("OLLAMA_URLS", self.ollama_url).split(",") if url.strip()]
         self.ollama_model = os.getenv("OLLAMA_MODEL", "qwen3-vl:8b")
         self.use_ollama = os.getenv("USE_OLLAMA", "true").lower() == "true"
         self.confidence_threshold = float(os.getenv("ALERT_CONFIDENCE_THRESHOLD", "0.7"))
@@ -19,19 +450,84 @@ class AIProctorService:
         if self.openai_api_key and not self.use_ollama:
             self.client = OpenAI(api_key=self.openai_api_key)
 
-    def analyze_frame(self, webcam_image_base64: str, screen_image_base64: Optional[str] = None) -> Tuple[bool, Dict[str, Any]]:
+        self.verdict_cache = VerdictCache()
+        self.face_tier = FaceCountTier(self.confidence_threshold)
+        self.frame_normalizer = FrameNormalizer()
+        # Single-frame requests; batches get 2s more per frame
+        self.request_timeout = float(os.getenv("OLLAMA_REQUEST_TIMEOUT_SECONDS", "5"))
+        self.router = OllamaRouter(self.ollama_urls, self.request_timeout)
+        self.lifecycle = OllamaLifecycle(self.router, self.ollama_model)
+
+        # Streamed responses stop as soon as the verdict is known
+        self.stream_responses = os.getenv("OLLAMA_STREAM", "true").lower() == "true"
+        self.early_stop_confidence = float(os.getenv("OLLAMA_EARLY_STOP_CONFIDENCE", "0.85"))
+        self._stream_lock = threading.Lock()
+        self._stream_outcomes: Dict[str, int] = {}
+        self._time_to_verdict: List[float] = []
+        self._total_generation: List[float] = []
+        self._early_stops = 0
+
+    @property
+    def supports_batching(self) -> bool:
+        """Only the Ollama path can analyze several frames in one request"""
+        return self.use_ollama
+
+    def analyze_frame(self, webcam_image: Frame, screen_image: Optional[Frame] = None,
+                      session_id: Optional[int] = None) -> Tuple[bool, Dict[str, Any]]:
         """
         Analyze webcam and screen frames for cheating behavior
         Returns: (is_suspicious, analysis_data)
         """
+        # Screen captures need the vision model, so only webcam-only frames are resolved locally
+        frame_hash = None
+        if not screen_image:
+            frame_hash, local = self._resolve_locally(session_id, webcam_image)
+            if local:
+                return local
+
+        # Only the backends see the downscaled copy; local tiers above work on the original
+        webcam_image = self.frame_normalizer.for_inference(webcam_image)
+        if screen_image:
+            screen_image = self.frame_normalizer.for_inference(screen_image)
+
         if self.use_ollama:
-            return self._analyze_with_ollama(webcam_image_base64, screen_image_base64)
+            result = self._analyze_with_ollama(webcam_image, screen_image)
         elif self.openai_api_key:
-            return self._analyze_with_openai(webcam_image_base64, screen_image_base64)
+            result = self._analyze_with_openai(webcam_image, screen_image)
         else:
             raise ValueError("No AI service configured. Enable USE_OLLAMA=true or set OPENAI_API_KEY")
 
-    def _analyze_with_openai(self, webcam_image_base64: str, screen_image_base64: Optional[str] = None) -> Tuple[bool, Dict[str, Any]]:
+        self._store_cached(session_id, frame_hash, result)
+        return result
+
+    def _resolve_locally(self, session_id: Optional[int], webcam_image: Frame) -> Tuple[Optional[int], Optional[Tuple[bool, Dict[str, Any]]]]:
+        """
+        Run the cheap tiers of the cascade: verdict cache, then face count.
+        Returns (frame_hash, result); result is None if the model must decide.
+        """
+        frame_hash = None
+        if session_id is not None and self.verdict_cache.enabled:
+            frame_hash = dhash(webcam_image)
+            if frame_hash is not None:
+                cached = self.verdict_cache.get(session_id, frame_hash)
+                if cached:
+                    return frame_hash, cached
+
+        return frame_hash, self.face_tier.classify(webcam_image, session_id)
+
+    def _store_cached(self, session_id: Optional[int], frame_hash: Optional[int], result: Tuple[bool, Dict[str, Any]]):
+        is_suspicious, analysis = result
+        # Never cache failures - the next frame should get a real answer
+        if frame_hash is None or "error" in analysis:
+            return
+        self.verdict_cache.put(session_id, frame_hash, is_suspicious, analysis)
+
+    def forget_session(self, session_id: int):
+        """Drop cached state for a session that has left"""
+        self.verdict_cache.forget(session_id)
+        self.face_tier.forget(session_id)
+
+    def _analyze_with_openai(self, webcam_image: Frame, screen_image: Optional[Frame] = None) -> Tuple[bool, Dict[str, Any]]:
         """Use OpenAI GPT-4 Vision for analysis"""
 
         prompt = """You are an AI exam proctor. Analyze the webcam image for CLEAR and OBVIOUS signs of cheating during an online exam.
@@ -73,7 +569,7 @@ Be LENIENT. Only flag with high confidence (>0.85) when you are certain of a vio
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{webcam_image_base64}"
+                            "url": f"data:image/jpeg;base64,{to_base64(webcam_image)}"
                         }
                     }
                 ]
@@ -81,23 +577,25 @@ Be LENIENT. Only flag with high confidence (>0.85) when you are certain of a vio
         ]
 
         # Add screen capture if available
-        if screen_image_base64:
+        if screen_image:
             screen_prompt = "\nAlso analyze the screen capture for suspicious activities like switching tabs, opening unauthorized applications, or searching for answers."
             messages[0]["content"].insert(1, {"type": "text", "text": screen_prompt})
             messages[0]["content"].append({
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/jpeg;base64,{screen_image_base64}"
+                    "url": f"data:image/jpeg;base64,{to_base64(screen_image)}"
                 }
             })
 
         try:
+            start_time = time.time()
             response = self.client.chat.completions.create(
                 model="gpt-4o",
                 messages=messages,
                 max_tokens=500,
                 temperature=0.3,
             )
+            INFERENCE_LATENCY.observe(time.time() - start_time, backend="openai", endpoint="api.openai.com")
 
             # Parse the JSON response
             content = response.choices[0].message.content
@@ -115,14 +613,14 @@ Be LENIENT. Only flag with high confidence (>0.85) when you are certain of a vio
             return is_suspicious, analysis
 
         except Exception as e:
-            print(f"Error in OpenAI analysis: {e}")
+            logger.error("Error in OpenAI analysis: %s", e)
             return False, {
                 "error": str(e),
                 "is_suspicious": False,
                 "confidence": 0.0
             }
 
-    def _analyze_with_ollama(self, webcam_image_base64: str, screen_image_base64: Optional[str] = None) -> Tuple[bool, Dict[str, Any]]:
+    def _analyze_with_ollama(self, webcam_image: Frame, screen_image: Optional[Frame] = None) -> Tuple[bool, Dict[str, Any]]:
         """Use Ollama (local Qwen3-VL 8B) for analysis"""
 
         prompt = """AI Exam Proctor: Analyze webcam for violations. Respond ONLY with JSON.
@@ -146,14 +644,14 @@ JSON OUTPUT:
 alert_type: "looking_away"|"multiple_people"|"phone_detected"|"reading_from_material"|"suspicious_activity"|"none"
 Flag is_suspicious=true only if 85%+ confident of violation."""
 
-        if screen_image_base64:
+        if screen_image:
             prompt += "\n\nAlso analyze the screen capture for suspicious activities like switching tabs, opening unauthorized applications, or searching for answers."
 
         # Ollama API format - OPTIMIZED FOR SPEED (real-time monitoring every 0.5s)
         payload = {
             "model": self.ollama_model,
             "prompt": prompt,
-            "images": [webcam_image_base64],
+            "images": [to_base64(webcam_image)],
             "stream": False,
             "format": "json",
             "options": {
@@ -169,117 +667,351 @@ Flag is_suspicious=true only if 85%+ confident of violation."""
         }
 
         # Add screen image if available
-        if screen_image_base64:
-            payload["images"].append(screen_image_base64)
+        if screen_image:
+            payload["images"].append(to_base64(screen_image))
 
         try:
-            import time
-            start_time = time.time()
-
-            response = requests.post(
-                f"{self.ollama_url}/api/generate",
-                json=payload,
-                timeout=5  # Reduced from 30s - we need fast responses for real-time monitoring
-            )
-            response.raise_for_status()
-
-            result = response.json()
-
-            inference_time = time.time() - start_time
-            print(f"[Ollama Performance] Inference completed in {inference_time:.2f}s")
+            # Reduced from 30s - we need fast responses for real-time monitoring
+            if self.stream_responses:
+                result, inference_time, endpoint_url = self._stream_generate(payload, timeout=self.request_timeout)
+            else:
+                result, inference_time, endpoint_url = self._post_generate(payload, timeout=self.request_timeout)
 
             # Qwen3 models may return JSON in "thinking" field instead of "response" field
             content = result.get("response", "") or result.get("thinking", "")
 
-            print(f"[Ollama Debug] Raw response from Ollama:")
-            print(f"[Ollama Debug] Response field: {result.get('response', 'empty')[:200]}")
-            print(f"[Ollama Debug] Thinking field: {result.get('thinking', 'empty')[:200]}")
-            print(f"[Ollama Debug] Using content: {content[:500]}...")  # Print first 500 chars
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Raw Ollama response", extra={
+                    "response_field": result.get("response", "")[:200],
+                    "thinking_field": result.get("thinking", "")[:200],
+                })
 
-            # Try to parse JSON with enhanced cleaning
-            content = content.strip()
+            analysis = self._normalize_analysis(self._parse_json_content(content))
 
-            # Remove common markdown artifacts
-            if content.startswith("```json"):
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif content.startswith("```"):
-                content = content.split("```")[1].split("```")[0].strip()
-
-            # Remove any leading/trailing text outside JSON
-            if "{" in content and "}" in content:
-                start_idx = content.find("{")
-                end_idx = content.rfind("}") + 1
-                content = content[start_idx:end_idx]
-
-            # Parse JSON
-            try:
-                analysis = json.loads(content)
-                print(f"[Ollama Debug] Successfully parsed JSON")
-            except json.JSONDecodeError as json_err:
-                print(f"[Ollama Debug] JSON parsing failed: {json_err}")
-                print(f"[Ollama Debug] Content that failed to parse: {content[:300]}")
-                # If JSON parsing fails, try to extract JSON object from text
-                import re
-                json_match = re.search(r'\{(?:[^{}]|(?:\{[^{}]*\}))*\}', content, re.DOTALL)
-                if json_match:
-                    print(f"[Ollama Debug] Attempting to extract JSON from text")
-                    try:
-                        analysis = json.loads(json_match.group(0))
-                    except json.JSONDecodeError:
-                        print(f"[Ollama Debug] Extracted JSON also failed to parse")
-                        raise ValueError("Could not parse JSON from response")
-                else:
-                    print(f"[Ollama Debug] Could not find JSON object in response")
-                    raise ValueError("Could not parse JSON from response")
-
-            # Validate and normalize the response with strict schema enforcement
-            valid_alert_types = ["looking_away", "multiple_people", "phone_detected",
-                               "reading_from_material", "suspicious_activity", "none"]
-
-            alert_type = analysis.get("alert_type", "none")
-            if alert_type not in valid_alert_types:
-                print(f"[Ollama Debug] Invalid alert_type '{alert_type}', defaulting to 'none'")
-                alert_type = "none"
-
-            # Ensure detected_issues is a list
-            detected_issues = analysis.get("detected_issues", [])
-            if not isinstance(detected_issues, list):
-                detected_issues = [str(detected_issues)] if detected_issues else []
-
-            analysis = {
-                "is_suspicious": bool(analysis.get("is_suspicious", False)),
-                "confidence": max(0.0, min(1.0, float(analysis.get("confidence", 0.5)))),  # Clamp to 0-1
-                "detected_issues": detected_issues,
-                "severity": max(1, min(5, int(analysis.get("severity", 1)))),  # Clamp to 1-5
-                "description": str(analysis.get("description", "Analysis completed"))[:500],  # Limit length
-                "alert_type": alert_type
-            }
-
-            print(f"[Ollama Debug] Validated analysis: is_suspicious={analysis['is_suspicious']}, "
-                  f"confidence={analysis['confidence']:.2f}, alert_type={analysis['alert_type']}")
+            logger.info("Ollama inference completed", extra={
+                "category": "inference",
+                "endpoint": endpoint_url,
+                "latency_s": round(inference_time, 3),
+                "is_suspicious": analysis["is_suspicious"],
+                "confidence": analysis["confidence"],
+                "alert_type": analysis["alert_type"],
+            })
 
             is_suspicious = analysis["is_suspicious"] and analysis["confidence"] >= self.confidence_threshold
 
             return is_suspicious, analysis
 
         except requests.exceptions.RequestException as e:
-            print(f"[Ollama Error] Error connecting to Ollama: {e}")
-            print(f"[Ollama Error] Make sure Ollama is running with: ollama serve")
-            print(f"[Ollama Error] And that {self.ollama_model} is installed: ollama pull {self.ollama_model}")
-            print(f"[Ollama Error] Check available models with: ollama list")
+            logger.error(
+                "Error connecting to Ollama: %s. Make sure Ollama is running (ollama serve) "
+                "and that %s is installed (ollama pull %s)", e, self.ollama_model, self.ollama_model
+            )
             return False, {
                 "error": f"Connection error: {str(e)}",
                 "is_suspicious": False,
                 "confidence": 0.0
             }
         except Exception as e:
-            print(f"Error in Ollama analysis: {e}")
+            logger.error("Error in Ollama analysis: %s", e)
             return False, {
                 "error": str(e),
                 "is_suspicious": False,
                 "confidence": 0.0
             }
 
+    def _post_generate(self, payload: Dict[str, Any], timeout: float) -> Tuple[Dict[str, Any], float, str]:
+        """
+        Send a /api/generate request to the least-loaded healthy Ollama node.
+        Returns: (response_json, inference_seconds, endpoint_url)
+        """
+        endpoint = self.router.acquire()
+        start_time = time.time()
+        ok = False
+        payload = {**payload, "keep_alive": self.lifecycle.keep_alive}
+        try:
+            response = self.lifecycle.session.post(f"{endpoint.url}/api/generate", json=payload, timeout=timeout)
+            response.raise_for_status()
+            result = response.json()
+            ok = True
+            latency = time.time() - start_time
+            self.lifecycle.record(endpoint.url, result, latency)
+            INFERENCE_LATENCY.observe(latency, backend="ollama", endpoint=endpoint.url)
+            return result, latency, endpoint.url
+        finally:
+            self.router.release(endpoint, time.time() - start_time, ok, timeout)
+
+    def _stream_generate(self, payload: Dict[str, Any], timeout: float) -> Tuple[Dict[str, Any], float, str]:
+        """
+        Streaming variant of _post_generate. The response is parsed as it
+        arrives and the stream is closed (which aborts generation in Ollama)
+        as soon as the JSON object is complete, or as soon as a confident
+        "no violation" verdict has been seen - whatever the model would
+        still generate after it is not waited for. Thinking-mode models that
+        put the verdict in the "thinking" field are scanned the same way
+        until the first "response" token arrives.
+
+        `timeout` is a wall-clock limit for the whole stream, not just for
+        each read. Only Ollama's final "done" chunk carries load and total
+        durations; streams closed before it are recorded as stopped early
+        rather than classified as cold or steady.
+        Returns: (result, seconds_to_verdict, endpoint_url) where result has the
+        same "response"/"thinking" fields as a non-streamed reply.
+        """
+        endpoint = self.router.acquire()
+        start_time = time.time()
+        deadline = start_time + timeout
+        ok = False
+        parser = StreamingVerdictParser(self.early_stop_confidence)
+        thinking_parser = StreamingVerdictParser(self.early_stop_confidence)
+        verdict_parser = parser
+        final_chunk: Dict[str, Any] = {}
+
+        payload = {**payload, "stream": True, "keep_alive": self.lifecycle.keep_alive}
+        try:
+            with self.lifecycle.session.post(f"{endpoint.url}/api/generate", json=payload,
+                                             timeout=timeout, stream=True) as response:
+                response.raise_for_status()
+                verdict_at: Optional[float] = None
+                for line in response.iter_lines():
+                    if time.time() > deadline:
+                        raise requests.exceptions.Timeout(f"Ollama stream exceeded {timeout}s")
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if parser.feed(chunk.get("response", "")):
+                        verdict_at = time.time()
+                    # Only while the model has answered nothing outside its thinking
+                    elif not parser.text.strip() and thinking_parser.feed(chunk.get("thinking", "")):
+                        verdict_parser = thinking_parser
+                        verdict_at = time.time()
+                    if chunk.get("done"):
+                        final_chunk = chunk
+                        break
+                    # Leaving the with-block closes the response, which aborts the rest of the generation
+                    if verdict_at is not None:
+                        break
+
+            time_to_verdict = (verdict_at or time.time()) - start_time
+            ok = True
+        finally:
+            self.router.release(endpoint, time.time() - start_time, ok, timeout)
+
+        INFERENCE_LATENCY.observe(time_to_verdict, backend="ollama_stream", endpoint=endpoint.url)
+        if final_chunk:
+            self.lifecycle.record(endpoint.url, final_chunk, time_to_verdict)
+            self._record_stream(verdict_parser.outcome, time_to_verdict, final_chunk.get("total_duration", 0) / 1e9)
+        else:
+            self.lifecycle.record_early_stop(endpoint.url, time_to_verdict)
+            self._record_stream(verdict_parser.outcome, time_to_verdict, None)
+
+        thinking = thinking_parser.content() if verdict_parser is thinking_parser else thinking_parser.text
+        return {
+            "response": parser.content(),
+            "thinking": thinking,
+        }, time_to_verdict, endpoint.url
+
+    def _record_stream(self, outcome: str, time_to_verdict: float, total_time: Optional[float]):
+        """total_time is None for streams closed before Ollama reported it"""
+        with self._stream_lock:
+            self._stream_outcomes[outcome] = self._stream_outcomes.get(outcome, 0) + 1
+            self._time_to_verdict.append(time_to_verdict)
+            if total_time is None:
+                self._early_stops += 1
+            else:
+                self._total_generation.append(total_time)
+            for samples in (self._time_to_verdict, self._total_generation):
+                if len(samples) > 1000:
+                    del samples[:500]
+
+    def get_streaming_stats(self) -> Dict[str, Any]:
+        def mean(samples: List[float]) -> Optional[float]:
+            return round(sum(samples) / len(samples), 3) if samples else None
+
+        with self._stream_lock:
+            return {
+                "enabled": self.stream_responses,
+                "outcomes": dict(self._stream_outcomes),
+                "early_stops": self._early_stops,
+                "avg_time_to_verdict": mean(self._time_to_verdict),
+                # Streams read to the end only; early-stopped ones never report a total
+                "avg_total_generation": mean(self._total_generation),
+            }
+
+    def _parse_json_content(self, content: str) -> Any:
+        """Extract and parse the JSON payload from raw model output"""
+        # Try to parse JSON with enhanced cleaning
+        content = content.strip()
+
+        # Remove common markdown artifacts
+        if content.startswith("```json"):
+            content = content.split("```json")[1].split("```")[0].strip()
+        elif content.startswith("```"):
+            content = content.split("```")[1].split("```")[0].strip()
+
+        # Remove any leading/trailing text outside JSON
+        if "{" in content and "}" in content:
+            start_idx = content.find("{")
+            end_idx = content.rfind("}") + 1
+            content = content[start_idx:end_idx]
+
+        # Parse JSON
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError as json_err:
+            logger.debug("JSON parsing failed: %s", json_err, extra={"content": content[:300]})
+            # If JSON parsing fails, try to extract JSON object from text
+            json_match = re.search(r'\{(?:[^{}]|(?:\{[^{}]*\}))*\}', content, re.DOTALL)
+            if json_match:
+                try:
+                    return json.loads(json_match.group(0))
+                except json.JSONDecodeError:
+                    logger.warning("Could not parse JSON from model response")
+                    raise ValueError("Could not parse JSON from response")
+            else:
+                logger.warning("No JSON object found in model response")
+                raise ValueError("Could not parse JSON from response")
+
+    def _normalize_analysis(self, analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """Validate and normalize a model verdict with strict schema enforcement"""
+        alert_type = analysis.get("alert_type", "none")
+        if alert_type not in VALID_ALERT_TYPES:
+            logger.debug("Invalid alert_type %r, defaulting to 'none'", alert_type)
+            alert_type = "none"
+
+        # Ensure detected_issues is a list
+        detected_issues = analysis.get("detected_issues", [])
+        if not isinstance(detected_issues, list):
+            detected_issues = [str(detected_issues)] if detected_issues else []
+
+        return {
+            "is_suspicious": bool(analysis.get("is_suspicious", False)),
+            "confidence": max(0.0, min(1.0, float(analysis.get("confidence", 0.5)))),  # Clamp to 0-1
+            "detected_issues": detected_issues,
+            "severity": max(1, min(5, int(analysis.get("severity", 1)))),  # Clamp to 1-5
+            "description": str(analysis.get("description", "Analysis completed"))[:500],  # Limit length
+            "alert_type": alert_type
+        }
+
+    def analyze_frames_batch(self, webcam_images: List[Frame],
+                             session_ids: Optional[List[Optional[int]]] = None) -> List[Optional[Tuple[bool, Dict[str, Any]]]]:
+        """
+        Analyze webcam frames from several sessions in a single inference call.
+        Returns one (is_suspicious, analysis_data) tuple per frame, in input order.
+        None marks a frame the batch answer did not cover; the caller re-analyzes
+        it with analyze_frame() on its own worker.
+        """
+        if session_ids is None:
+            session_ids = [None] * len(webcam_images)
+
+        if len(webcam_images) == 1 or not self.supports_batching:
+            return [self.analyze_frame(image, session_id=session_id)
+                    for image, session_id in zip(webcam_images, session_ids)]
+
+        results: List[Optional[Tuple[bool, Dict[str, Any]]]] = [None] * len(webcam_images)
+        misses = []  # (index, frame_hash)
+        for index, (image, session_id) in enumerate(zip(webcam_images, session_ids)):
+            frame_hash, local = self._resolve_locally(session_id, image)
+            if local:
+                results[index] = local
+            else:
+                misses.append((index, frame_hash))
+
+        if misses:
+            images = [self.frame_normalizer.for_inference(webcam_images[index]) for index, _ in misses]
+            if len(images) == 1:
+                fresh = [self._analyze_with_ollama(images[0])]
+            else:
+                fresh = self._analyze_batch_with_ollama(images)
+
+            for (index, frame_hash), result in zip(misses, fresh):
+                if result is not None:
+                    self._store_cached(session_ids[index], frame_hash, result)
+                results[index] = result
+
+        return results
+
+    def _analyze_batch_with_ollama(self, webcam_images: List[Frame]) -> List[Optional[Tuple[bool, Dict[str, Any]]]]:
+        """
+        Send a batch of webcam frames to Ollama as one multi-image request.
+        If Ollama cannot be reached every frame gets an error verdict at once;
+        if the answer is malformed or short every frame is None, to be retried
+        individually by the caller rather than serially on this worker.
+        """
+        count = len(webcam_images)
+
+        prompt = f"""AI Exam Proctor: You are given {count} webcam images, each from a DIFFERENT student. Analyze each image independently for violations. Respond ONLY with JSON.
+
+REQUIRED SETUP: Full face visible, seated at desk, facing camera.
+
+FLAG AS VIOLATIONS (severity 3-5):
+- Student not visible/partial visibility/only wall visible
+- Multiple people in frame
+- Phone/device in hand
+- Reading books/notes
+- Talking to someone
+- Making unusual faces/gestures
+
+IGNORE (normal behavior):
+- Brief glances away, looking up, adjusting position, touching face
+
+JSON OUTPUT - exactly {count} results, in the same order as the images:
+{{"results": [{{"image": 1, "is_suspicious": false, "confidence": 0.95, "detected_issues": [], "severity": 1, "description": "Brief observation", "alert_type": "none"}}]}}
+
+alert_type: "looking_away"|"multiple_people"|"phone_detected"|"reading_from_material"|"suspicious_activity"|"none"
+Flag is_suspicious=true only if 85%+ confident of violation."""
+
+        payload = {
+            "model": self.ollama_model,
+            "prompt": prompt,
+            "images": [to_base64(image) for image in webcam_images],
+            "stream": False,
+            "format": "json",
+            "options": {
+                "temperature": 0.2,
+                "top_p": 0.9,
+                "top_k": 20,
+                "num_predict": 64 + 160 * count,    # ~150 chars of JSON per verdict
+                "num_ctx": 1024 + 1024 * count,     # Room for every image's vision tokens
+                "num_gpu": 99,
+                "num_thread": 8,
+                "repeat_penalty": 1.05,
+            }
+        }
+
+        try:
+            # Longer generation for larger batches
+            result, inference_time, endpoint_url = self._post_generate(payload, timeout=self.request_timeout + 2 * count)
+            logger.info("Ollama batch inference completed", extra={
+                "category": "inference",
+                "endpoint": endpoint_url,
+                "batch_size": count,
+                "latency_s": round(inference_time, 3),
+            })
+
+            content = result.get("response", "") or result.get("thinking", "")
+            parsed = self._parse_json_content(content)
+
+            verdicts = parsed.get("results") if isinstance(parsed, dict) else None
+            if not isinstance(verdicts, list) or len(verdicts) != count:
+                raise ValueError(f"Expected {count} results in batch response")
+
+            results = []
+            for verdict in verdicts:
+                analysis = self._normalize_analysis(verdict if isinstance(verdict, dict) else {})
+                is_suspicious = analysis["is_suspicious"] and analysis["confidence"] >= self.confidence_threshold
+                results.append((is_suspicious, analysis))
+            return results
+
+        except requests.exceptions.RequestException as e:
+            # The node timed out or is down - per-frame retries would only wait out the same failure
+            logger.error("Batch request to Ollama failed: %s", e, extra={"batch_size": count})
+            return [(False, {"error": f"Connection error: {str(e)}", "is_suspicious": False, "confidence": 0.0})
+                    for _ in webcam_images]
+        except Exception as e:
+            # A malformed or short batch answer must not lose verdicts - the caller re-runs frames one by one
+            logger.warning("Batch analysis failed (%s), falling back to per-frame analysis", e, extra={"batch_size": count})
+            return [None] * count
+
     def generate_behavior_report(self, monitoring_events: list) -> Dict[str, Any]:
         """Generate a comprehensive behavior analysis report"""
 
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for AIProctorService against a local mock Ollama server
+Run: python benchmark_ai_service.py --sessions 50 --duration 30 --latency-ms 400
+
+No GPU or Ollama install needed: a stand-in HTTP server imitates /api/generate
+and /api/tags with configurable latency, jitter and malformed-JSON rate.
+"""
+
+import os
+import sys
+import json
+import base64
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+VERDICT_CLEAN = {"is_suspicious": False, "confidence": 0.95, "detected_issues": [], "severity": 1,
+                 "description": "Student focused on exam", "alert_type": "none"}
+VERDICT_SUSPICIOUS = {"is_suspicious": True, "confidence": 0.9, "detected_issues": ["phone in hand"], "severity": 4,
+                      "description": "Student holding a phone", "alert_type": "phone_detected"}
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    """Imitates the subset of the Ollama API that AIProctorService uses"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "MockOllama/1.0"
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output readable
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": self.server.model}]})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self.send_error(404)
+            return
+
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        images = payload.get("images") or []
+        self.server.record_request()
+
+        # An empty prompt is a warm-up / model load request
+        if not payload.get("prompt"):
+            self._send_json({"response": "", "done": True, "load_duration": 0})
+            return
+
+        delay = max(0.0, random.gauss(self.server.latency, self.server.jitter))
+        text = self._response_text(len(images), payload)
+
+        if payload.get("stream"):
+            self._send_stream(text, delay)
+        else:
+            time.sleep(delay)
+            self._send_json({"response": text, "done": True, "total_duration": int(delay * 1e9), "load_duration": 0})
+
+    def _response_text(self, image_count: int, payload: dict) -> str:
+        if random.random() < self.server.malformed_rate:
+            return "I think the student is {probably fine, \"confidence\": high"
+
+        def verdict():
+            return VERDICT_SUSPICIOUS if random.random() < self.server.suspicious_rate else VERDICT_CLEAN
+
+        if '"results"' in payload.get("prompt", "") and image_count > 1:
+            return json.dumps({"results": [dict(verdict(), image=i + 1) for i in range(image_count)]})
+        return json.dumps(verdict())
+
+    def _send_json(self, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, text: str, delay: float):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        # Spread generation time over ~8-character tokens, like a real model
+        tokens = [text[i:i + 8] for i in range(0, len(text), 8)] or [""]
+        per_token = delay / len(tokens)
+        try:
+            for index, token in enumerate(tokens):
+                time.sleep(per_token)
+                done = index == len(tokens) - 1
+                chunk = {"response": token, "done": done}
+                if done:
+                    chunk.update({"total_duration": int(delay * 1e9), "load_duration": 0})
+                self._write_chunk((json.dumps(chunk) + "\n").encode())
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading early - exactly what early termination does
+            self.close_connection = True
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+class MockOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency_ms: float = 400, jitter_ms: float = 100,
+                 malformed_rate: float = 0.0, suspicious_rate: float = 0.05, model: str = "qwen3-vl:8b"):
+        super().__init__(("127.0.0.1", port), MockOllamaHandler)
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.malformed_rate = malformed_rate
+        self.suspicious_rate = suspicious_rate
+        self.model = model
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="mock-ollama", daemon=True).start()
+        return self
+
+def synthetic_frames(count: int, width: int = 640, height: int = 480) -> List[str]:
+    """Distinct noisy JPEG frames, base64-encoded like the browser sends them"""
+    frames = []
+    for _ in range(count):
+        image = np.random.randint(0, 255, (height, width, 3), dtype=np.uint8)
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        frames.append(base64.b64encode(encoded.tobytes()).decode("ascii"))
+    return frames
+
+def percentile(samples: List[float], p: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+def run_benchmark(args) -> int:
+    server = MockOllamaServer(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        malformed_rate=args.malformed_rate,
+        suspicious_rate=args.suspicious_rate,
+    ).start()
+
+    # Configure the service before it is constructed - it reads everything from env
+    os.environ["USE_OLLAMA"] = "true"
+    os.environ["OLLAMA_URLS"] = server.url
+    os.environ["OLLAMA_STREAM"] = "true" if args.stream else "false"
+    os.environ["VERDICT_CACHE_ENABLED"] = "true" if args.local_tiers else "false"
+    os.environ["FACE_TIER_ENABLED"] = "true" if args.local_tiers else "false"
+    # One pooled connection per simulated session
+    os.environ["INFERENCE_MAX_WORKERS"] = str(args.sessions)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    from logging_config import setup_logging, shutdown_logging
+    from ai_service import AIProctorService
+
+    setup_logging()
+    service = AIProctorService()
+    frames = synthetic_frames(args.frame_pool)
+
+    latencies: List[float] = []
+    errors = 0
+    suspicious = 0
+    lock = threading.Lock()
+    deadline = time.time() + args.duration
+
+    def session_loop(session_id: int):
+        nonlocal errors, suspicious
+        while time.time() < deadline:
+            frame = random.choice(frames)
+            start = time.perf_counter()
+            is_suspicious, analysis = service.analyze_frame(frame, session_id=session_id)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors += "error" in analysis
+                suspicious += is_suspicious
+            if args.interval > 0:
+                time.sleep(args.interval)
+
+    print(f"Mock Ollama at {server.url} (latency {args.latency_ms}±{args.jitter_ms}ms, "
+          f"malformed {args.malformed_rate:.0%}, stream={args.stream})")
+    print(f"Driving {args.sessions} sessions for {args.duration}s...")
+
+    started = time.time()
+    threads = [threading.Thread(target=session_loop, args=(i,), daemon=True) for i in range(args.sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+
+    total = len(latencies)
+    print("\n" + "=" * 60)
+    print("Benchmark Results")
+    print("=" * 60)
+    print(f"Frames analyzed:     {total}")
+    print(f"Backend requests:    {server.requests}")
+    print(f"Throughput:          {total / elapsed:.1f} frames/s")
+    for label, p in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+        value = percentile(latencies, p)
+        print(f"Latency {label}:         {value * 1000:.1f} ms" if value is not None else f"Latency {label}:         n/a")
+    print(f"Error rate:          {errors / total:.2%}" if total else "Error rate:          n/a")
+    print(f"Suspicious verdicts: {suspicious}")
+    if args.local_tiers:
+        print(f"Verdict cache:       {service.verdict_cache.get_stats()}")
+        print(f"Face tier:           {service.face_tier.get_stats()}")
+
+    shutdown_logging()
+    server.shutdown()
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark AIProctorService against a mock Ollama server")
+    parser.add_argument("--sessions", type=int, default=20, help="Concurrent simulated sessions")
+    parser.add_argument("--duration", type=float, default=20, help="Benchmark duration in seconds")
+    parser.add_argument("--interval", type=float, default=0.0, help="Pause between frames per session (s)")
+    parser.add_argument("--latency-ms", type=float, default=400, help="Mean mock inference latency")
+    parser.add_argument("--jitter-ms", type=float, default=100, help="Std deviation of mock latency")
+    parser.add_argument("--malformed-rate", type=float, default=0.02, help="Fraction of malformed JSON responses")
+    parser.add_argument("--suspicious-rate", type=float, default=0.05, help="Fraction of suspicious verdicts")
+    parser.add_argument("--frame-pool", type=int, default=32, help="Number of distinct synthetic frames")
+    parser.add_argument("--stream", action="store_true", help="Use streaming responses with early termination")
+    parser.add_argument("--local-tiers", action="store_true", help="Enable the verdict cache and face-count tier")
+    return run_benchmark(parser.parse_args())
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+from dotenv import load_dotenv
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError, DataError
+
+from metrics import EVENT_SINK_FLUSH_LATENCY, EVENT_SINK_FLUSH_ROWS, EVENT_SINK_DROPPED
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Errors about the rows themselves (unknown session, value out of range); retrying cannot fix them
+ROW_ERRORS = (IntegrityError, DataError)
+
+class EventSink:
+    """
+    Write-behind buffer for MonitoringEvent rows.
+
+    Handlers hand rows to add() and move on; a background task writes them
+    as one multi-row INSERT every EVENT_SINK_FLUSH_MS or once
+    EVENT_SINK_BATCH_SIZE rows are waiting, whichever comes first. The
+    buffer holds at most EVENT_SINK_MAX_BUFFER rows - when it is full, add()
+    waits for the next flush, which bounds memory under an alert storm.
+    Session scores and auto-submit stay in the handlers' own transaction,
+    so they never wait on a batch.
+
+    A batch that still fails after EVENT_SINK_MAX_RETRIES is written to
+    EVENT_SINK_SPOOL_DIR as JSON lines and replayed every
+    EVENT_SINK_REPLAY_SECONDS (and on the next start), so a database
+    outage delays monitoring events instead of losing them.
+    """
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self.flush_interval = float(os.getenv("EVENT_SINK_FLUSH_MS", "250")) / 1000
+        self.batch_size = int(os.getenv("EVENT_SINK_BATCH_SIZE", "200"))
+        self.max_buffer = int(os.getenv("EVENT_SINK_MAX_BUFFER", "5000"))
+        self.max_retries = int(os.getenv("EVENT_SINK_MAX_RETRIES", "3"))
+        self.spool_dir = os.getenv("EVENT_SINK_SPOOL_DIR", "event_spool")
+        self.replay_interval = float(os.getenv("EVENT_SINK_REPLAY_SECONDS", "30"))
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # Evidence uploads that finished while their event may still be buffered (pending -> final)
+        self._resolved: "OrderedDict[str, str]" = OrderedDict()
+        self._resolved_lock = threading.Lock()
+        # Late evidence patches whose UPDATE failed; retried after the next flush
+        self._unpatched: Dict[str, str] = {}
+
+        self._stats = {"flushes": 0, "rows": 0, "spooled": 0, "replayed": 0, "rejected": 0, "dropped": 0,
+                       "last_flush_rows": 0, "last_flush_seconds": 0.0}
+
+    def start(self):
+        """Start the flush task on the running event loop"""
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_buffer)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Write everything still buffered, then stop"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def add(self, row: Dict[str, Any]):
+        """Buffer one MonitoringEvent row (column values, including its timestamp)"""
+        await self._queue.put(row)
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def resolve_evidence(self, pending_url: str, url: str):
+        """Remember a finished evidence upload for rows not written yet (thread-safe)"""
+        with self._resolved_lock:
+            self._resolved[pending_url] = url
+            while len(self._resolved) > self.max_buffer:
+                self._resolved.popitem(last=False)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        next_replay = loop.time()  # Rows spooled before the last shutdown go first
+        while not stopping:
+            if loop.time() >= next_replay:
+                try:
+                    await self._replay_spool()
+                except Exception:
+                    logger.exception("Monitoring event spool replay failed")
+                next_replay = loop.time() + self.replay_interval
+            try:
+                row = await asyncio.wait_for(self._queue.get(), max(0.01, next_replay - loop.time()))
+            except asyncio.TimeoutError:
+                continue
+            if row is None:
+                break
+            batch = [row]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+            await self._flush(batch)
+
+        # Shutdown: write whatever is left in one last batch
+        remaining = []
+        while not self._queue.empty():
+            row = self._queue.get_nowait()
+            if row is not None:
+                remaining.append(row)
+        if remaining:
+            await self._flush(remaining)
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        """Write a batch, or spool it to disk; never raises, so the flush task keeps running"""
+        try:
+            if await self._write(batch):
+                return
+        except Exception:
+            logger.exception("Monitoring event flush failed")
+        await self._spool(batch)
+
+    async def _write(self, batch: List[Dict[str, Any]]) -> bool:
+        """Insert a batch with retries; False if it could not be written"""
+        from models import MonitoringEvent
+        with self._resolved_lock:
+            for row in batch:
+                row["evidence_url"] = self._resolved.get(row.get("evidence_url"), row.get("evidence_url"))
+
+        async def insert_rows(rows: List[Dict[str, Any]]):
+            async with self.session_factory() as db:
+                # One statement; the driver sends the rows as multi-row VALUES batches
+                await db.execute(insert(MonitoringEvent), rows)
+                await db.commit()
+
+        start_time = time.perf_counter()
+        try:
+            if not await self._retry(lambda: insert_rows(batch), f"Monitoring event flush ({len(batch)} rows)"):
+                return False
+        except ROW_ERRORS:
+            # One bad row fails the whole statement; find it so the others still get written
+            logger.warning("Monitoring event batch rejected by a constraint, inserting rows one at a time",
+                           exc_info=True)
+            written, rejected = [], []
+            for position, row in enumerate(batch):
+                try:
+                    if not await self._retry(lambda: insert_rows([row]), "Monitoring event insert"):
+                        # The database went away mid-batch; keep the rows not written yet
+                        await self._spool(batch[position:])
+                        break
+                    written.append(row)
+                except ROW_ERRORS:
+                    rejected.append(row)
+            if rejected:
+                await self._spool(rejected, rejected=True)
+            batch = written
+
+        elapsed = time.perf_counter() - start_time
+        EVENT_SINK_FLUSH_LATENCY.observe(elapsed)
+        EVENT_SINK_FLUSH_ROWS.observe(len(batch))
+        self._stats["flushes"] += 1
+        self._stats["rows"] += len(batch)
+        self._stats["last_flush_rows"] = len(batch)
+        self._stats["last_flush_seconds"] = round(elapsed, 4)
+        logger.debug("Flushed monitoring events", extra={"rows": len(batch), "seconds": round(elapsed, 4)})
+
+        # An upload may have finished between the lookup above and the commit, after its own
+        # UPDATE already ran; those rows are patched here
+        with self._resolved_lock:
+            late = {row["evidence_url"]: self._resolved[row["evidence_url"]]
+                    for row in batch if row.get("evidence_url") in self._resolved}
+        late.update(self._unpatched)
+        if late:
+            async def patch_late():
+                async with self.session_factory() as db:
+                    for pending_url, url in late.items():
+                        await db.execute(
+                            update(MonitoringEvent).where(MonitoringEvent.evidence_url == pending_url).values(evidence_url=url)
+                        )
+                    await db.commit()
+
+            if await self._retry(patch_late, f"Evidence URL patch ({len(late)} references)"):
+                self._unpatched = {}
+            else:
+                self._unpatched = dict(list(late.items())[-self.max_buffer:])
+        return True
+
+    async def _retry(self, operation: Callable[[], Awaitable[None]], description: str) -> bool:
+        for attempt in range(self.max_retries + 1):
+            try:
+                await operation()
+                return True
+            except ROW_ERRORS:
+                raise  # Retrying cannot help; the caller decides what to do with the rows
+            except Exception:
+                if attempt == self.max_retries:
+                    logger.exception("%s failed after %d attempts", description, attempt + 1)
+                    return False
+                logger.warning("%s failed, retrying", description, exc_info=True)
+                await asyncio.sleep(0.1 * (2 ** attempt))
+        return False
+
+    # ---------- disk spool ----------
+
+    async def _spool(self, batch: List[Dict[str, Any]], rejected: bool = False):
+        """
+        Keep a batch the database refused on disk until the replay can write
+        it. Rows rejected by a constraint go to a .bad file instead, which is
+        never replayed, so they cannot hold up the batches behind them.
+        """
+        try:
+            await asyncio.to_thread(self._write_spool, batch, ".bad" if rejected else ".jsonl")
+            if rejected:
+                self._stats["rejected"] += len(batch)
+                logger.error("Set aside %d monitoring events rejected by the database", len(batch))
+            else:
+                self._stats["spooled"] += len(batch)
+                logger.warning("Spooled %d monitoring events to disk", len(batch))
+        except Exception:
+            logger.exception("Could not spool monitoring events, %d lost", len(batch))
+            EVENT_SINK_DROPPED.inc(len(batch))
+            self._stats["dropped"] += len(batch)
+
+    def _write_spool(self, batch: List[Dict[str, Any]], suffix: str):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        # Names sort in spool order, so replay keeps events in time order
+        name = os.path.join(self.spool_dir, f"{time.time_ns():020d}-{uuid.uuid4().hex}")
+        with open(name + ".tmp", "w") as f:
+            for row in batch:
+                f.write(json.dumps(row, default=_encode) + "\n")
+        os.replace(name + ".tmp", name + suffix)
+
+    def _spooled_files(self) -> List[str]:
+        try:
+            return sorted(entry for entry in os.listdir(self.spool_dir) if entry.endswith(".jsonl"))
+        except FileNotFoundError:
+            return []
+
+    def _read_spool(self, path: str) -> List[Dict[str, Any]]:
+        from models import AlertType
+        rows = []
+        with open(path) as f:
+            for line in f:
+                row = json.loads(line)
+                row["event_type"] = AlertType(row["event_type"])
+                row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+                rows.append(row)
+        return rows
+
+    async def _replay_spool(self):
+        """
+        Write spooled batches oldest first. Stops at the first batch that
+        still cannot be written while the database is unavailable; rows it
+        rejects outright are set aside by _write, so they never block replay.
+        """
+        for entry in await asyncio.to_thread(self._spooled_files):
+            path = os.path.join(self.spool_dir, entry)
+            try:
+                rows = await asyncio.to_thread(self._read_spool, path)
+            except (OSError, ValueError, KeyError):
+                logger.exception("Skipping unreadable event spool file", extra={"entry": entry})
+                await asyncio.to_thread(os.replace, path, path + ".bad")
+                continue
+            if not await self._write(rows):
+                return
+            await asyncio.to_thread(os.remove, path)
+            self._stats["replayed"] += len(rows)
+            logger.info("Replayed %d spooled monitoring events", len(rows))
+
+    def spooled_count(self) -> int:
+        """Batches waiting on disk"""
+        try:
+            return sum(1 for entry in os.listdir(self.spool_dir) if entry.endswith(".jsonl"))
+        except OSError:
+            return 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": self.depth(),
+            "max_buffer": self.max_buffer,
+            "batch_size": self.batch_size,
+            "flush_interval_ms": int(self.flush_interval * 1000),
+            "on_disk": self.spooled_count(),
+            **self._stats,
+        }
+
+def _encode(value: Any) -> Any:
+    """JSON for the column values json.dumps cannot write itself"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot spool {type(value).__name__}")
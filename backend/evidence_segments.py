@@ -0,0 +1,231 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, Optional, List, Union
+from dotenv import load_dotenv
+
+from image_utils import Frame, frame_bytes
+from metrics import DB_WRITE_LATENCY
+from storage_service import StorageService, UploadJob, segment_reference, parse_segment_reference
+from storage_backends import StorageError
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+class _Segment:
+    """An evidence segment that is still being written, or is waiting to be uploaded"""
+
+    def __init__(self, session_id: int, key: str, context: Dict[str, Any]):
+        self.session_id = session_id
+        self.key = key
+        self.context = context
+        self.buffer: Union[bytearray, bytes] = bytearray()
+        self.index: List[List[int]] = []
+        self.opened_at = time.time()
+
+class SegmentWriter:
+    """
+    Archives a session's evidence frames into rolling segment objects
+    instead of one storage object per frame.
+
+    Frames are appended to a per-session buffer, and the frame's reference
+    (segment key plus byte offset and length) is known at append time, so
+    MonitoringEvent rows never wait on storage. A segment is handed to the
+    upload queue once it reaches EVIDENCE_SEGMENT_MAX_MB or has been open
+    for EVIDENCE_SEGMENT_MAX_SECONDS; its offset index is recorded in the
+    evidence_segments table when the upload completes. A single frame is
+    then read back with one ranged GET.
+    """
+
+    def __init__(self, storage: StorageService):
+        self.storage = storage
+        self.enabled = os.getenv("EVIDENCE_SEGMENTS_ENABLED", "true").lower() == "true"
+        self.max_bytes = int(float(os.getenv("EVIDENCE_SEGMENT_MAX_MB", "4")) * 1024 * 1024)
+        self.max_seconds = float(os.getenv("EVIDENCE_SEGMENT_MAX_SECONDS", "60"))
+        # Flushed segments stay readable from memory until their upload lands, up to this much
+        self.in_flight_bytes = int(float(os.getenv("EVIDENCE_SEGMENT_IN_FLIGHT_MB", "64")) * 1024 * 1024)
+        self.index_retries = 3
+
+        self._lock = threading.Lock()
+        self._open: Dict[int, _Segment] = {}
+        self._by_key: Dict[str, _Segment] = {}
+        self._in_flight: "OrderedDict[str, _Segment]" = OrderedDict()
+        self._in_flight_size = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._counts = {"frames": 0, "segments": 0, "uploaded": 0}
+
+        storage.completion_handlers["evidence_segment"] = self._on_uploaded
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._flush_loop, name="evidence-segments", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Hand every open segment to the upload queue (call before the queue stops)"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        with self._lock:
+            jobs = [self._flush_locked(session_id) for session_id in list(self._open)]
+        self._submit(jobs)
+
+    # ---------- writing ----------
+
+    def append(self, session_id: int, image: Frame, context: Optional[Dict[str, Any]] = None) -> str:
+        """Append an evidence frame (JPEG) to the session's open segment and return its reference"""
+        data = frame_bytes(image)
+        job = None
+        with self._lock:
+            segment = self._open.get(session_id)
+            if segment is None:
+                timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f")
+                segment = _Segment(session_id, f"evidence/session_{session_id}/segment_{timestamp}.bin",
+                                   dict(context or {}, session_id=session_id))
+                self._open[session_id] = segment
+                self._by_key[segment.key] = segment
+
+            offset = len(segment.buffer)
+            segment.buffer += data
+            segment.index.append([offset, len(data)])
+            self._counts["frames"] += 1
+
+            if len(segment.buffer) >= self.max_bytes:
+                job = self._flush_locked(session_id)
+        self._submit([job])
+        return segment_reference(segment.key, offset, len(data))
+
+    def flush_session(self, session_id: int):
+        """Close the session's open segment, e.g. when the student disconnects"""
+        with self._lock:
+            job = self._flush_locked(session_id)
+        self._submit([job])
+
+    def _flush_loop(self):
+        while not self._stop.wait(1.0):
+            cutoff = time.time() - self.max_seconds
+            with self._lock:
+                jobs = [self._flush_locked(session_id) for session_id, segment in list(self._open.items())
+                        if segment.opened_at <= cutoff]
+            self._submit(jobs)
+
+    def _flush_locked(self, session_id: int) -> Optional[UploadJob]:
+        """Close the session's open segment; the caller submits the returned job once _lock is released"""
+        segment = self._open.pop(session_id, None)
+        if segment is None:
+            return None
+        del self._by_key[segment.key]
+        # The upload body doubles as the in-flight copy that reads are served from
+        segment.buffer = bytes(segment.buffer)
+
+        self._in_flight[segment.key] = segment
+        self._in_flight_size += len(segment.buffer)
+        while self._in_flight_size > self.in_flight_bytes and len(self._in_flight) > 1:
+            # Still queued or spooled; reads fall back to storage once it lands
+            _, evicted = self._in_flight.popitem(last=False)
+            self._in_flight_size -= len(evicted.buffer)
+
+        self._counts["segments"] += 1
+        return UploadJob(
+            segment.key, segment.buffer, "application/octet-stream", kind="evidence_segment",
+            context=dict(segment.context, index=segment.index)
+        )
+
+    def _submit(self, jobs: List[Optional[UploadJob]]):
+        # Outside _lock: a full upload queue spools to disk, which must not stall appends
+        for job in jobs:
+            if job is not None:
+                self.storage.upload_queue.submit(job)
+
+    def _on_uploaded(self, job: UploadJob, url: str):
+        """
+        Record the segment and its offset index (runs on an upload thread).
+        Without this row the segment's frames cannot be read once the
+        in-flight copy is gone, so the write is retried, and if it still
+        fails the error propagates and the upload queue spools the job to
+        be uploaded and recorded again.
+        """
+        from database import SessionLocal
+        from models import EvidenceSegment
+        for attempt in range(self.index_retries + 1):
+            db = SessionLocal()
+            try:
+                commit_start = time.time()
+                segment = db.query(EvidenceSegment).filter(EvidenceSegment.key == job.key).first()
+                if segment is None:
+                    segment = EvidenceSegment(session_id=job.context.get("session_id"), key=job.key)
+                    db.add(segment)
+                segment.storage_url = url
+                segment.size = len(job.body)
+                segment.frame_index = job.context.get("index")
+                db.commit()
+                DB_WRITE_LATENCY.observe(time.time() - commit_start, operation="evidence_segment")
+                break
+            except Exception:
+                db.rollback()
+                if attempt == self.index_retries:
+                    raise
+                logger.warning("Evidence segment index write failed, retrying", exc_info=True, extra={"key": job.key})
+                time.sleep(0.5 * (2 ** attempt))
+            finally:
+                db.close()
+
+        with self._lock:
+            self._counts["uploaded"] += 1
+            segment = self._in_flight.pop(job.key, None)
+            if segment is not None:
+                self._in_flight_size -= len(segment.buffer)
+
+    # ---------- reading ----------
+
+    def read(self, reference: str) -> Optional[bytes]:
+        """
+        Bytes of one archived frame: from memory while its segment is open or
+        uploading, otherwise a ranged read of the stored segment. None if the
+        segment is unknown or not yet stored.
+        """
+        parsed = parse_segment_reference(reference)
+        if parsed is None:
+            return None
+        key, offset, length = parsed
+
+        with self._lock:
+            segment = self._by_key.get(key) or self._in_flight.get(key)
+            if segment is not None:
+                if offset + length > len(segment.buffer):
+                    return None
+                return bytes(segment.buffer[offset:offset + length])
+
+        from database import SessionLocal
+        from models import EvidenceSegment
+        db = SessionLocal()
+        try:
+            stored = db.query(EvidenceSegment).filter(EvidenceSegment.key == key).first()
+        finally:
+            db.close()
+        if stored is None or offset + length > stored.size:
+            return None
+        try:
+            return self.storage.backend.read_range(stored.storage_url, offset, length)
+        except StorageError as e:
+            logger.warning("Evidence segment read failed: %s", e, extra={"key": key})
+            return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "open": len(self._open),
+                "open_bytes": sum(len(segment.buffer) for segment in self._open.values()),
+                "in_flight": len(self._in_flight),
+                "in_flight_bytes": self._in_flight_size,
+                **self._counts,
+            }
@@ -0,0 +1,91 @@
+import os
+import time
+import threading
+from typing import Dict, Any, Tuple
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+from image_utils import Frame, decode_grayscale
+
+load_dotenv()
+
+class FrameQualityGate:
+    """
+    Cheap local pre-filter in front of the vision model. Frames that barely
+    differ from the session's last analyzed frame, or that are too dark,
+    too bright or too blurry to judge, skip inference.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("FRAME_GATE_ENABLED", "true").lower() == "true"
+        # Mean absolute pixel difference (0-255) below which a frame counts as static
+        self.motion_threshold = float(os.getenv("FRAME_GATE_MOTION_THRESHOLD", "4.0"))
+        self.min_brightness = float(os.getenv("FRAME_GATE_MIN_BRIGHTNESS", "25"))
+        self.max_brightness = float(os.getenv("FRAME_GATE_MAX_BRIGHTNESS", "235"))
+        # Variance of the Laplacian below which a frame counts as blurry
+        self.min_sharpness = float(os.getenv("FRAME_GATE_MIN_SHARPNESS", "15"))
+        # Always analyze at least this often, so a covered camera or a frozen
+        # stream is still seen by the model periodically
+        self.max_skip_seconds = float(os.getenv("FRAME_GATE_MAX_SKIP_SECONDS", "30"))
+
+        self._lock = threading.Lock()
+        self._last_frames: Dict[int, Tuple[np.ndarray, float]] = {}  # {session_id: (gray, analyzed_at)}
+        self._counts: Dict[str, int] = {}
+
+    def check(self, session_id: int, webcam_image: Frame) -> Tuple[bool, str]:
+        """
+        Decide whether a frame needs model inference.
+        Returns: (should_analyze, reason)
+        """
+        if not self.enabled:
+            return True, "disabled"
+
+        gray = decode_grayscale(webcam_image)
+        if gray is None:
+            # Let the model path report the problem rather than silently dropping it
+            return self._record(True, "undecodable")
+
+        now = time.time()
+        with self._lock:
+            previous = self._last_frames.get(session_id)
+
+        overdue = previous is None or now - previous[1] >= self.max_skip_seconds
+
+        if not overdue:
+            brightness = float(gray.mean())
+            if brightness < self.min_brightness:
+                return self._record(False, "too_dark")
+            if brightness > self.max_brightness:
+                return self._record(False, "too_bright")
+
+            sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+            if sharpness < self.min_sharpness:
+                return self._record(False, "blurry")
+
+            if previous[0].shape == gray.shape:
+                motion = float(cv2.absdiff(gray, previous[0]).mean())
+                if motion < self.motion_threshold:
+                    return self._record(False, "static")
+
+        with self._lock:
+            self._last_frames[session_id] = (gray, now)
+        return self._record(True, "overdue" if overdue and previous is not None else "changed")
+
+    def forget(self, session_id: int):
+        """Drop the reference frame of a finished session"""
+        with self._lock:
+            self._last_frames.pop(session_id, None)
+
+    def _record(self, should_analyze: bool, reason: str) -> Tuple[bool, str]:
+        with self._lock:
+            self._counts[reason] = self._counts.get(reason, 0) + 1
+        return should_analyze, reason
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "tracked_sessions": len(self._last_frames),
+                "decisions": dict(self._counts),
+            }
@@ -0,0 +1,82 @@
+import os
+import io
+import threading
+from typing import Dict, Any
+from PIL import Image
+from dotenv import load_dotenv
+
+from image_utils import Frame, frame_bytes
+
+load_dotenv()
+
+class FrameNormalizer:
+    """
+    Server-side frame normalization. Browsers send frames at whatever size and
+    quality they like; inference gets a downscaled, fixed-quality JPEG (vision
+    token cost scales with image size) while evidence keeps a higher-quality copy.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("FRAME_NORMALIZE_ENABLED", "true").lower() == "true"
+        self.inference_max_side = int(os.getenv("INFERENCE_IMAGE_MAX_SIDE", "448"))
+        self.inference_quality = int(os.getenv("INFERENCE_IMAGE_QUALITY", "75"))
+        self.evidence_max_side = int(os.getenv("EVIDENCE_IMAGE_MAX_SIDE", "1280"))
+        self.evidence_quality = int(os.getenv("EVIDENCE_IMAGE_QUALITY", "90"))
+
+        self._lock = threading.Lock()
+        self._frames = 0
+        self._bytes_in = 0
+        self._bytes_out = 0
+
+    def for_inference(self, image: Frame) -> memoryview:
+        """Downscale and re-encode a frame for the vision model"""
+        original = frame_bytes(image)
+        if not self.enabled:
+            return original
+
+        normalized = self._reencode(original, self.inference_max_side, self.inference_quality)
+
+        with self._lock:
+            self._frames += 1
+            self._bytes_in += len(original)
+            self._bytes_out += len(normalized)
+        return normalized
+
+    def for_evidence(self, image: Frame) -> memoryview:
+        """Higher-quality copy of a frame for evidence storage"""
+        original = frame_bytes(image)
+        if not self.enabled:
+            return original
+        return self._reencode(original, self.evidence_max_side, self.evidence_quality)
+
+    def _reencode(self, data: memoryview, max_side: int, quality: int) -> memoryview:
+        try:
+            image = Image.open(io.BytesIO(data))
+            # For JPEG sources, let the decoder scale by 1/2, 1/4 or 1/8 before we resize
+            image.draft("RGB", (max_side, max_side))
+            image = image.convert("RGB")
+        except Exception:
+            # Not an image we can read - pass it through and let the model path deal with it
+            return data
+
+        already_fits = max(image.size) <= max_side
+        image.thumbnail((max_side, max_side), Image.BILINEAR)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality)
+        encoded = buffer.getbuffer()
+
+        # An already small, low-quality frame can grow when re-encoded; keep the original then
+        if already_fits and len(encoded) >= len(data):
+            return data
+        return encoded
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "frames": self._frames,
+                "bytes_in": self._bytes_in,
+                "bytes_out": self._bytes_out,
+                "bytes_saved": self._bytes_in - self._bytes_out,
+            }
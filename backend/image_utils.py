@@ -0,0 +1,64 @@
+import base64
+from typing import Optional, Union
+import cv2
+import numpy as np
+
+# A JPEG frame as it moves through the pipeline: raw bytes from a Socket.IO
+# binary attachment (or a view of them), or a base64 string from older clients
+Frame = Union[bytes, bytearray, memoryview, str]
+
+def decode_base64_image(image_base64: str) -> bytes:
+    """Decode a base64 frame, tolerating a data URL prefix"""
+    if image_base64.startswith("data:"):
+        image_base64 = image_base64.split(",", 1)[1]
+    return base64.b64decode(image_base64)
+
+def frame_bytes(frame: Frame) -> memoryview:
+    """Raw JPEG bytes of a frame without copying; base64 strings are decoded once"""
+    if isinstance(frame, str):
+        return memoryview(decode_base64_image(frame))
+    return memoryview(frame)
+
+def to_base64(frame: Frame) -> str:
+    """Base64 text for backends whose APIs only take strings (Ollama, OpenAI)"""
+    if isinstance(frame, str):
+        return frame.split(",", 1)[1] if frame.startswith("data:") else frame
+    return base64.b64encode(frame).decode("ascii")
+
+def decode_grayscale(image: Frame, width: int = 160) -> Optional[np.ndarray]:
+    """
+    Decode a JPEG frame into a small grayscale array for cheap local statistics.
+    Returns None if the frame cannot be decoded.
+    """
+    try:
+        data = np.frombuffer(frame_bytes(image), dtype=np.uint8)
+    except (ValueError, TypeError):
+        return None
+
+    # Let libjpeg downscale while decoding - much cheaper than a full-size decode
+    gray = cv2.imdecode(data, cv2.IMREAD_REDUCED_GRAYSCALE_2)
+    if gray is None or gray.size == 0:
+        return None
+
+    height = max(1, int(gray.shape[0] * width / gray.shape[1]))
+    return cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+
+def dhash(image: Frame, hash_size: int = 8) -> Optional[int]:
+    """
+    Difference hash of a frame: near-identical frames produce hashes that
+    differ in only a few bits. Returns None if the frame cannot be decoded.
+    """
+    gray = decode_grayscale(image)
+    if gray is None:
+        return None
+
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
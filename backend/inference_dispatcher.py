@@ -0,0 +1,182 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Tuple, Callable, List, Set
+from dotenv import load_dotenv
+
+from image_utils import Frame
+
+load_dotenv()
+
+class FrameBatcher:
+    """
+    Collects webcam frames from many sessions over a short window (or until
+    the batch is full) and analyzes them with a single inference request,
+    then resolves each caller's future with its own verdict.
+    """
+
+    def __init__(self, dispatcher: "InferenceDispatcher", max_batch_size: int, window_ms: float):
+        self.dispatcher = dispatcher
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000.0
+
+        self._pending: List[Tuple[Frame, Optional[int], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # The loop only keeps weak references to tasks; hold running batches until they finish
+        self._tasks: Set[asyncio.Task] = set()
+
+        self._batches = 0
+        self._frames = 0
+
+    async def submit(self, webcam_image: Frame, session_id: Optional[int] = None) -> Tuple[bool, Dict[str, Any]]:
+        """Queue a frame for the next batch and wait for its verdict"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((webcam_image, session_id, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: List[Tuple[Frame, Optional[int], asyncio.Future]]):
+        self._batches += 1
+        self._frames += len(batch)
+
+        try:
+            results = await self.dispatcher.run(
+                self.dispatcher.ai_service.analyze_frames_batch,
+                [image for image, _, _ in batch],
+                [session_id for _, session_id, _ in batch]
+            )
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Frames the batch answer did not cover fan out across the worker pool in parallel
+        retries = [(index, image, session_id) for index, ((image, session_id, _), result)
+                   in enumerate(zip(batch, results)) if result is None]
+        if retries:
+            retried = await asyncio.gather(*(
+                self.dispatcher.run(self.dispatcher.ai_service.analyze_frame, image, None, session_id)
+                for _, image, session_id in retries
+            ), return_exceptions=True)
+            for (index, _, _), result in zip(retries, retried):
+                results[index] = result
+
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "window_ms": self.window * 1000.0,
+            "pending": len(self._pending),
+            "batches": self._batches,
+            "avg_batch_size": round(self._frames / self._batches, 2) if self._batches else 0.0,
+        }
+
+class InferenceDispatcher:
+    """
+    Runs blocking AI inference calls on a bounded worker pool so the
+    Socket.IO event loop never waits on a model request.
+    """
+
+    def __init__(self, ai_service, max_workers: Optional[int] = None):
+        self.ai_service = ai_service
+        self.max_workers = max_workers or int(os.getenv("INFERENCE_MAX_WORKERS", "4"))
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="inference"
+        )
+
+        self._lock = threading.Lock()
+        self._submitted = 0   # Accepted by the pool but not yet finished
+        self._running = 0     # Currently executing on a worker thread
+        self._completed = 0
+        self._failed = 0
+
+        # Cross-session micro-batching (INFERENCE_BATCH_SIZE=1 disables it)
+        batch_size = int(os.getenv("INFERENCE_BATCH_SIZE", "1"))
+        batch_window_ms = float(os.getenv("INFERENCE_BATCH_WINDOW_MS", "100"))
+        if batch_size > 1 and ai_service.supports_batching:
+            self.batcher = FrameBatcher(self, batch_size, batch_window_ms)
+        else:
+            self.batcher = None
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Run a blocking callable on the inference pool and await its result"""
+        loop = asyncio.get_running_loop()
+
+        with self._lock:
+            self._submitted += 1
+
+        def _task():
+            with self._lock:
+                self._running += 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+        try:
+            result = await loop.run_in_executor(self.executor, _task)
+            with self._lock:
+                self._completed += 1
+            return result
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._submitted -= 1
+
+    async def analyze_frame(self, webcam_image: Frame, screen_image: Optional[Frame] = None,
+                            session_id: Optional[int] = None) -> Tuple[bool, Dict[str, Any]]:
+        """Async wrapper around AIProctorService.analyze_frame"""
+        # Frames with a screen capture need their own prompt, so they are never batched
+        if self.batcher and not screen_image:
+            return await self.batcher.submit(webcam_image, session_id)
+        return await self.run(self.ai_service.analyze_frame, webcam_image, screen_image, session_id)
+
+    def queue_depth(self) -> int:
+        """Number of calls waiting for a free worker"""
+        with self._lock:
+            return max(0, self._submitted - self._running)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "in_flight": self._running,
+                "queue_depth": max(0, self._submitted - self._running),
+                "completed": self._completed,
+                "failed": self._failed,
+                "batching": self.batcher.get_stats() if self.batcher else None,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
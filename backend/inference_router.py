@@ -0,0 +1,143 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, List, Optional
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+class OllamaEndpoint:
+    """One inference node and its live load/latency statistics"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency_ewma: Optional[float] = None
+        self.latencies: deque = deque(maxlen=500)
+        self.ejected_reason: Optional[str] = None
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile))]
+
+class OllamaRouter:
+    """
+    Routes inference requests across several Ollama nodes by least
+    outstanding requests. Nodes that fail repeatedly or become too slow are
+    ejected; a background probe of /api/tags re-admits them once they answer.
+    """
+
+    def __init__(self, urls: List[str], request_timeout: float = 5.0):
+        self.endpoints = [OllamaEndpoint(url) for url in urls]
+        self.probe_interval = float(os.getenv("OLLAMA_PROBE_INTERVAL_SECONDS", "10"))
+        self.eject_after_failures = int(os.getenv("OLLAMA_EJECT_AFTER_FAILURES", "3"))
+        # A successful request never takes much longer than its timeout, so the threshold has to
+        # sit below it; by default a node is slow once it averages 60% of a single-frame timeout
+        self.request_timeout = request_timeout
+        self.slow_latency = float(os.getenv("OLLAMA_SLOW_LATENCY_SECONDS", str(0.6 * request_timeout)))
+
+        self._lock = threading.Lock()
+        self._probe_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def acquire(self) -> OllamaEndpoint:
+        """Pick the healthy endpoint with the fewest requests in flight"""
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.healthy]
+            if not candidates:
+                # Every node is ejected - keep trying rather than failing every frame
+                candidates = self.endpoints
+            endpoint = min(candidates, key=lambda e: e.outstanding)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint: OllamaEndpoint, latency: float, ok: bool, timeout: Optional[float] = None):
+        """
+        Record a finished request. `timeout` is the one the request ran
+        with: batches get longer ones, and their latency is scaled down to
+        a single-frame request before it counts towards slow ejection.
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            if not ok:
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                if endpoint.healthy and endpoint.consecutive_failures >= self.eject_after_failures:
+                    self._eject(endpoint, f"{endpoint.consecutive_failures} consecutive failures")
+                return
+
+            endpoint.consecutive_failures = 0
+            endpoint.latencies.append(latency)
+            if timeout and timeout > self.request_timeout:
+                latency *= self.request_timeout / timeout
+            endpoint.latency_ewma = latency if endpoint.latency_ewma is None else 0.8 * endpoint.latency_ewma + 0.2 * latency
+            if endpoint.healthy and len(self.endpoints) > 1 and endpoint.latency_ewma > self.slow_latency:
+                self._eject(endpoint, f"average latency {endpoint.latency_ewma:.2f}s")
+
+    def _eject(self, endpoint: OllamaEndpoint, reason: str):
+        endpoint.healthy = False
+        endpoint.ejected_reason = reason
+        logger.warning("Ejected inference node: %s", reason, extra={"endpoint": endpoint.url})
+
+    def start(self):
+        """Start the background health probe"""
+        if self._probe_thread is not None:
+            return
+        self._probe_thread = threading.Thread(target=self._probe_loop, name="ollama-probe", daemon=True)
+        self._probe_thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _probe_loop(self):
+        while not self._stop.wait(self.probe_interval):
+            for endpoint in self.endpoints:
+                self.probe(endpoint)
+
+    def probe(self, endpoint: OllamaEndpoint) -> bool:
+        """Check a node with /api/tags and re-admit it if it answers"""
+        try:
+            response = requests.get(f"{endpoint.url}/api/tags", timeout=2)
+            alive = response.status_code == 200
+        except requests.exceptions.RequestException:
+            alive = False
+
+        with self._lock:
+            if alive and not endpoint.healthy:
+                endpoint.healthy = True
+                endpoint.ejected_reason = None
+                endpoint.consecutive_failures = 0
+                endpoint.latency_ewma = None  # Start fresh; old samples caused the ejection
+                logger.info("Re-admitted inference node", extra={"endpoint": endpoint.url})
+            elif not alive and endpoint.healthy:
+                self._eject(endpoint, "health probe failed")
+        return alive
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "url": e.url,
+                    "healthy": e.healthy,
+                    "ejected_reason": e.ejected_reason,
+                    "outstanding": e.outstanding,
+                    "requests": e.requests,
+                    "failures": e.failures,
+                    "latency_ewma": round(e.latency_ewma, 3) if e.latency_ewma is not None else None,
+                    "latency_p50": e.latency_percentile(0.50),
+                    "latency_p95": e.latency_percentile(0.95),
+                }
+                for e in self.endpoints
+            ]
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+End-to-end Socket.IO load generator for the proctoring backend
+Run: python load_test.py --students 1000 --proctors 5 --duration 120 --spawn --seed
+
+Opens one Socket.IO client per simulated student, joins its exam session and
+streams analyze_frame / tab_switch_detected events at browser-like rates,
+while proctor clients listen in proctor_{exam_id}. With --spawn the backend
+(main:socket_app) is started against a local mock Ollama server, so no GPU is
+needed. Reports server event-loop lag (from /metrics), student-to-proctor
+alert latency and dropped frames.
+
+Requires the asyncio Socket.IO client: pip install "python-socketio[asyncio_client]"
+"""
+
+import os
+import sys
+import time
+import base64
+import random
+import asyncio
+import secrets
+import argparse
+import subprocess
+from datetime import datetime
+from collections import defaultdict, deque
+from typing import Dict, List, Optional, Tuple
+
+import requests
+import socketio
+
+from benchmark_ai_service import MockOllamaServer, synthetic_frames, percentile
+
+LOADTEST_PREFIX = "loadtest"
+
+# ==================== Fixtures ====================
+
+def seed_sessions(students: int) -> Tuple[int, int, List[Tuple[int, int]]]:
+    """
+    Create (or reuse) a load-test teacher, exam, students and exam sessions.
+    Returns (teacher_id, exam_id, [(student_id, session_id), ...]).
+    """
+    from datetime import timedelta
+    from database import SessionLocal, engine, Base
+    from models import User, Exam, ExamEnrollment, ExamSession, UserRole
+    from auth import get_password_hash
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        hashed = get_password_hash("loadtest123")  # bcrypt once, not per student
+
+        teacher = db.query(User).filter(User.username == f"{LOADTEST_PREFIX}_teacher").first()
+        if not teacher:
+            teacher = User(email=f"{LOADTEST_PREFIX}_teacher@example.com", username=f"{LOADTEST_PREFIX}_teacher",
+                           full_name="Load Test Teacher", hashed_password=hashed, role=UserRole.TEACHER)
+            db.add(teacher)
+            db.commit()
+
+        now = datetime.utcnow()
+        exam = Exam(
+            title=f"Load test {now.isoformat(timespec='seconds')}",
+            duration_minutes=600,
+            start_time=now - timedelta(minutes=5),
+            end_time=now + timedelta(hours=10),
+            creator_id=teacher.id,
+            proctoring_enabled=True,
+            cheating_threshold=1_000_000,  # Never auto-submit - keep the load running
+        )
+        db.add(exam)
+        db.commit()
+
+        existing = {u.username: u for u in db.query(User).filter(User.username.like(f"{LOADTEST_PREFIX}_student_%"))}
+        users = []
+        for i in range(students):
+            username = f"{LOADTEST_PREFIX}_student_{i}"
+            user = existing.get(username)
+            if not user:
+                user = User(email=f"{username}@example.com", username=username,
+                            full_name=f"Load Test Student {i}", hashed_password=hashed, role=UserRole.STUDENT)
+                db.add(user)
+            users.append(user)
+        db.flush()
+
+        sessions = []
+        for user in users:
+            db.add(ExamEnrollment(exam_id=exam.id, student_id=user.id))
+            session = ExamSession(exam_id=exam.id, student_id=user.id)
+            db.add(session)
+            sessions.append((user, session))
+        db.commit()
+
+        return teacher.id, exam.id, [(user.id, session.id) for user, session in sessions]
+    finally:
+        db.close()
+
+def spawn_backend(port: int, ollama_url: str) -> subprocess.Popen:
+    """Start main:socket_app in a separate process, pointed at the mock Ollama server"""
+    env = dict(os.environ)
+    env.update({
+        "USE_OLLAMA": "true",
+        "OLLAMA_URLS": ollama_url,
+        "LOG_LEVEL": env.get("LOG_LEVEL", "WARNING"),
+        "SECRET_KEY": os.environ["SECRET_KEY"],
+        # No network storage: evidence goes to the local content-addressed store
+        "STORAGE_BACKEND": env.get("STORAGE_BACKEND", "local"),
+    })
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:socket_app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+
+def wait_until_healthy(url: str, timeout: float = 120) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{url}/api/health", timeout=2).status_code == 200:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+# ==================== Metrics scraping ====================
+
+def scrape_metrics(url: str) -> Dict[Tuple[str, frozenset], float]:
+    """Parse the backend's Prometheus text output into {(name, labels): value}"""
+    samples = {}
+    try:
+        text = requests.get(f"{url}/metrics", timeout=5).text
+    except requests.exceptions.RequestException:
+        return samples
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        series, _, value = line.rpartition(" ")
+        name, _, labels = series.partition("{")
+        pairs = []
+        for item in labels.rstrip("}").split(","):
+            if "=" in item:
+                key, raw = item.split("=", 1)
+                pairs.append((key, raw.strip('"')))
+        samples[(name, frozenset(pairs))] = float(value)
+    return samples
+
+def metric_delta(before: dict, after: dict, name: str, **labels) -> float:
+    key = (name, frozenset((k, str(v)) for k, v in labels.items()))
+    return after.get(key, 0.0) - before.get(key, 0.0)
+
+def histogram_quantile(before: dict, after: dict, name: str, q: float) -> Optional[float]:
+    """Upper bucket bound containing quantile q of the observations made during the run"""
+    buckets = []
+    for (series, labels), value in after.items():
+        if series == f"{name}_bucket":
+            bound = dict(labels)["le"]
+            buckets.append((float("inf") if bound == "+Inf" else float(bound), value - before.get((series, labels), 0.0)))
+    buckets.sort()
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    target = q * buckets[-1][1]
+    for bound, cumulative in buckets:
+        if cumulative >= target:
+            return bound
+    return None
+
+# ==================== Clients ====================
+
+class LoadStats:
+    def __init__(self):
+        self.connected = 0
+        self.connect_failures = 0
+        self.frames_sent = 0
+        self.frames_failed = 0
+        self.tab_switches_sent = 0
+        self.warnings_received = 0
+        self.alerts_received = 0
+        # Student event sent -> proctor notified, by alert kind ("tab_switch" / "frame")
+        self.alert_latencies: Dict[str, List[float]] = defaultdict(list)
+        self.delivery_latencies: List[float] = []  # Server alert timestamp -> proctor notified
+        self.client_loop_lag: List[float] = []
+        # Tab switches always raise an alert; frames only sometimes, so track the latest one
+        self.pending_tab_switches: Dict[int, deque] = defaultdict(lambda: deque(maxlen=50))
+        self.last_frame_sent: Dict[int, float] = {}
+
+async def run_student(url: str, token: str, student_id: int, session_id: int, exam_id: int,
+                      frames: List, args, stats: LoadStats, stop: asyncio.Event):
+    client = socketio.AsyncClient(reconnection=False)
+    interval = {"seconds": args.frame_interval}
+
+    @client.on("sampling_interval")
+    async def on_sampling_interval(data):
+        interval["seconds"] = data.get("interval_ms", 2000) / 1000.0
+
+    @client.on("cheating_warning")
+    async def on_warning(data):
+        stats.warnings_received += 1
+
+    try:
+        await client.connect(f"{url}?token={token}", transports=["websocket"], wait_timeout=30)
+    except Exception:
+        stats.connect_failures += 1
+        return
+    stats.connected += 1
+
+    try:
+        await client.emit("join_exam_session", {"session_id": session_id, "student_id": student_id, "exam_id": exam_id})
+        # Students do not start in lock-step
+        await asyncio.sleep(random.uniform(0, interval["seconds"]))
+        next_tab_switch = time.time() + random.expovariate(1.0 / args.tab_switch_every)
+
+        while not stop.is_set():
+            now = time.time()
+            try:
+                if now >= next_tab_switch:
+                    stats.pending_tab_switches[session_id].append(now)
+                    await client.emit("tab_switch_detected", {"session_id": session_id})
+                    stats.tab_switches_sent += 1
+                    next_tab_switch = now + random.expovariate(1.0 / args.tab_switch_every)
+
+                stats.last_frame_sent[session_id] = now
+                await client.emit("analyze_frame", {"session_id": session_id, "webcam_frame": random.choice(frames)})
+                stats.frames_sent += 1
+            except socketio.exceptions.SocketIOError:
+                stats.frames_failed += 1
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=interval["seconds"])
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await client.disconnect()
+
+async def run_proctor(url: str, token: str, exam_id: int, stats: LoadStats, stop: asyncio.Event):
+    client = socketio.AsyncClient(reconnection=False)
+
+    @client.on("cheating_alert")
+    async def on_alert(data):
+        now = time.time()
+        stats.alerts_received += 1
+        session_id = data.get("session_id")
+        if data.get("event_type") == "tab_switch":
+            pending = stats.pending_tab_switches.get(session_id)
+            if pending:
+                stats.alert_latencies["tab_switch"].append(now - pending.popleft())
+        elif session_id in stats.last_frame_sent:
+            stats.alert_latencies["frame"].append(now - stats.last_frame_sent[session_id])
+        timestamp = data.get("timestamp")
+        if timestamp:
+            sent = (datetime.fromisoformat(timestamp) - datetime(1970, 1, 1)).total_seconds()
+            stats.delivery_latencies.append(max(0.0, now - sent))
+
+    try:
+        await client.connect(f"{url}?token={token}", transports=["websocket"], wait_timeout=30)
+    except Exception:
+        stats.connect_failures += 1
+        return
+    await client.emit("join_proctor_room", {"exam_id": exam_id})
+    await stop.wait()
+    await client.disconnect()
+
+async def monitor_client_loop(stats: LoadStats, stop: asyncio.Event, interval: float = 0.5):
+    """Lag of the generator's own loop - if this is high, the numbers below are suspect"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        stats.client_loop_lag.append(max(0.0, time.perf_counter() - start - interval))
+
+async def run_load(args, url: str, exam_id: int, teacher_id: int, sessions: List[Tuple[int, int]]) -> LoadStats:
+    # Imported late: with --spawn, main() sets the SECRET_KEY the tokens are signed with first
+    from auth import create_access_token
+
+    stats = LoadStats()
+    stop = asyncio.Event()
+    frames = synthetic_frames(args.frame_pool, width=args.frame_width, height=args.frame_height)
+    if args.binary:
+        # Raw JPEG bytes go out as Socket.IO binary attachments, like the current frontend
+        frames = [base64.b64decode(frame) for frame in frames]
+    proctor_token = create_access_token(data={"sub": str(teacher_id)})
+
+    tasks = [asyncio.create_task(monitor_client_loop(stats, stop))]
+    for _ in range(args.proctors):
+        tasks.append(asyncio.create_task(run_proctor(url, proctor_token, exam_id, stats, stop)))
+
+    # Ramp students up gradually instead of a single connection storm
+    ramp_delay = args.ramp / max(1, len(sessions))
+    for student_id, session_id in sessions:
+        token = create_access_token(data={"sub": str(student_id)})
+        tasks.append(asyncio.create_task(run_student(url, token, student_id, session_id, exam_id, frames, args, stats, stop)))
+        await asyncio.sleep(ramp_delay)
+
+    print(f"{stats.connected} students connected ({stats.connect_failures} failures); running for {args.duration}s...")
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return stats
+
+# ==================== Report ====================
+
+def format_ms(value: Optional[float]) -> str:
+    return f"{value * 1000:.1f} ms" if value is not None else "n/a"
+
+def print_report(stats: LoadStats, before: dict, after: dict, elapsed: float):
+    print("\n" + "=" * 60)
+    print("Load Test Results")
+    print("=" * 60)
+    print(f"Students connected:      {stats.connected} ({stats.connect_failures} connect failures)")
+    print(f"Frames sent:             {stats.frames_sent} ({stats.frames_sent / elapsed:.1f}/s, {stats.frames_failed} emit failures)")
+    print(f"Tab switches sent:       {stats.tab_switches_sent}")
+    print(f"Warnings to students:    {stats.warnings_received}")
+    print(f"Alerts to proctors:      {stats.alerts_received}")
+
+    if after:
+        print("\nServer frame outcomes:")
+        for outcome in ("received", "throttled", "gated", "shed", "analyzed", "error"):
+            print(f"  {outcome:<10} {metric_delta(before, after, 'proctor_frames_total', outcome=outcome):.0f}")
+        received = metric_delta(before, after, "proctor_frames_total", outcome="received")
+        lost_in_transit = stats.frames_sent - received
+        dropped = lost_in_transit + metric_delta(before, after, "proctor_frames_total", outcome="shed") \
+            + metric_delta(before, after, "proctor_frames_total", outcome="error")
+        print(f"Dropped frames:          {dropped:.0f} (never received: {lost_in_transit:.0f}, shed + errors after that)")
+
+        count = metric_delta(before, after, "proctor_event_loop_lag_seconds_count")
+        total = metric_delta(before, after, "proctor_event_loop_lag_seconds_sum")
+        print("\nServer event-loop lag:")
+        print(f"  mean       {format_ms(total / count if count else None)}")
+        for label, q in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+            print(f"  {label:<10} <= {format_ms(histogram_quantile(before, after, 'proctor_event_loop_lag_seconds', q))}")
+    else:
+        print("\n/metrics not reachable - server-side numbers unavailable")
+
+    print("\nAlert latency (student event -> proctor):")
+    for kind in ("tab_switch", "frame"):
+        samples = stats.alert_latencies[kind]
+        print(f"  {kind:<10} p50 {format_ms(percentile(samples, 0.50))}, p95 {format_ms(percentile(samples, 0.95))}, "
+              f"p99 {format_ms(percentile(samples, 0.99))} ({len(samples)} alerts)")
+    print(f"Proctor delivery (server emit -> proctor) p95: {format_ms(percentile(stats.delivery_latencies, 0.95))}")
+    print(f"Generator loop lag p99:  {format_ms(percentile(stats.client_loop_lag, 0.99))}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Socket.IO load generator for the proctoring backend")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Backend URL (ignored with --spawn)")
+    parser.add_argument("--spawn", action="store_true", help="Start the backend against a mock Ollama server")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the spawned backend")
+    parser.add_argument("--seed", action="store_true", help="Create real exam sessions in the database")
+    parser.add_argument("--students", type=int, default=500)
+    parser.add_argument("--proctors", type=int, default=3)
+    parser.add_argument("--duration", type=float, default=60, help="Steady-state duration in seconds")
+    parser.add_argument("--ramp", type=float, default=20, help="Seconds over which students connect")
+    parser.add_argument("--frame-interval", type=float, default=2.0, help="Initial frame interval (server may change it)")
+    parser.add_argument("--tab-switch-every", type=float, default=300, help="Mean seconds between tab switches per student")
+    parser.add_argument("--frame-pool", type=int, default=64)
+    parser.add_argument("--binary", action="store_true", help="Send frames as binary attachments instead of base64")
+    parser.add_argument("--frame-width", type=int, default=640)
+    parser.add_argument("--frame-height", type=int, default=480)
+    parser.add_argument("--latency-ms", type=float, default=400, help="Mock inference latency (with --spawn)")
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--suspicious-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    mock = backend = None
+    url = args.url
+    try:
+        if args.spawn:
+            # The backend refuses to start without a key; the spawned one inherits it, so the
+            # tokens signed here verify there
+            os.environ.setdefault("SECRET_KEY", secrets.token_hex(32))
+            mock = MockOllamaServer(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                    suspicious_rate=args.suspicious_rate).start()
+            backend = spawn_backend(args.port, mock.url)
+            url = f"http://127.0.0.1:{args.port}"
+            print(f"Started backend at {url} with mock Ollama at {mock.url}")
+
+        if not wait_until_healthy(url):
+            print(f"❌ Backend at {url} did not become healthy")
+            return 1
+
+        if args.seed:
+            teacher_id, exam_id, sessions = seed_sessions(args.students)
+            print(f"✓ Seeded exam {exam_id} with {len(sessions)} sessions")
+        else:
+            # Synthetic ids: frames flow, but alerts for unknown sessions never reach proctors
+            teacher_id, exam_id = 1, 1
+            sessions = [(1_000_000 + i, 1_000_000 + i) for i in range(args.students)]
+            print("⚠️  Without --seed, sessions do not exist in the database; proctor alerts will be missing")
+
+        before = scrape_metrics(url)
+        started = time.time()
+        stats = asyncio.run(run_load(args, url, exam_id, teacher_id, sessions))
+        elapsed = time.time() - started
+        print_report(stats, before, scrape_metrics(url), elapsed)
+        return 0
+    finally:
+        if backend is not None:
+            backend.terminate()
+            backend.wait(timeout=30)
+        if mock is not None:
+            mock.shutdown()
+
+if __name__ == "__main__":
+    sys.exit(main())
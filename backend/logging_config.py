@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import queue
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Attributes every LogRecord has; anything else was passed via `extra=` and is structured context
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+class StructuredFormatter(logging.Formatter):
+    """
+    One record per line. LOG_FORMAT=json emits JSON objects; the default
+    "text" format emits `time level logger message key=value ...`.
+    Context passed with extra= (session_id, exam_id, ...) becomes fields.
+    """
+
+    def __init__(self, fmt: str = "text"):
+        super().__init__()
+        self.fmt = fmt
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {key: value for key, value in vars(record).items() if key not in _STANDARD_ATTRS}
+        fields.pop("category", None)
+        timestamp = datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds")
+
+        if self.fmt == "json":
+            entry = {
+                "time": timestamp,
+                "level": record.levelname,
+                "logger": record.name,
+                "message": record.getMessage(),
+                **fields,
+            }
+            if record.exc_text:
+                entry["exception"] = record.exc_text
+            return json.dumps(entry, default=str)
+
+        line = f"{timestamp} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+class SamplingFilter(logging.Filter):
+    """
+    Per-category sampling: a record logged with extra={"category": "inference"}
+    is kept once every N times, where N comes from LOG_SAMPLE_RATES
+    (e.g. "inference=20,feedback=10"). Warnings and errors are never sampled.
+    """
+
+    def __init__(self, rates: Dict[str, int]):
+        super().__init__()
+        self.rates = rates
+        self._counters: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        category = getattr(record, "category", None)
+        rate = self.rates.get(category, 1)
+        if rate <= 1:
+            return True
+        count = self._counters.get(category, 0)
+        self._counters[category] = count + 1
+        return count % rate == 0
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a background thread. The calling thread never touches
+    stdout; if the queue is full the record is dropped rather than blocking.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge the arguments here - full formatting happens on the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def parse_sample_rates(value: str) -> Dict[str, int]:
+    rates = {}
+    for item in value.split(","):
+        if "=" in item:
+            category, rate = item.split("=", 1)
+            rates[category.strip()] = max(1, int(rate))
+    return rates
+
+def setup_logging():
+    """Configure leveled, sampled, asynchronous logging for the backend"""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue: queue.Queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", "inference=20,feedback=10"))))
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(StructuredFormatter(os.getenv("LOG_FORMAT", "text").lower()))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+def shutdown_logging():
+    """Flush queued records on shutdown"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
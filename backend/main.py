@@ -1,16 +1,23 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Response, Request, BackgroundTasks, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, FileResponse
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import socketio
+import asyncio
+import logging
+import time
 import os
-from typing import List, Optional
+from typing import List, Optional, Set
 
-from database import engine, get_db, Base
+from logging_config import setup_logging, shutdown_logging
+from database import engine, async_engine, get_db, get_async_db, AsyncSessionLocal, Base, pool_stats
 from models import (
     User, Exam, Question, ExamSession, Answer, Submission,
-    MonitoringEvent, ExamEnrollment, UserRole, AlertType
+    MonitoringEvent, ExamEnrollment, UserRole, AlertType, RecordingKind
 )
 from schemas import (
     UserCreate, UserResponse, UserLogin, Token,
@@ -27,7 +34,22 @@ from auth import (
     get_current_active_user, require_role
 )
 from ai_service import AIProctorService
-from storage_service import StorageService
+from storage_service import StorageService, UploadJob, pending_reference
+from evidence_segments import SegmentWriter
+from event_sink import EventSink
+from storage_backends import LocalBackend, StorageError, verify_signature
+from recording_service import RecordingIngest, RecordingAssembler, RecordingConflict
+from inference_dispatcher import InferenceDispatcher
+from frame_filter import FrameQualityGate
+from sampling_policy import SamplingPolicy
+from admission_controller import AdmissionController
+from image_utils import frame_bytes
+from metrics import (
+    Gauge, FRAMES, FRAME_BYTES, DB_WRITE_LATENCY, EVENT_LOOP_LAG, CONTENT_TYPE, render_metrics
+)
+
+setup_logging()
+logger = logging.getLogger(__name__)
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
@@ -44,7 +66,7 @@ try:
 except (json.JSONDecodeError, ValueError):
     # Fall back to comma-separated string
     origins = [origin.strip() for origin in cors_origins_str.split(",")]
-print(f"Configured CORS origins: {origins}")
+logger.info("Configured CORS origins: %s", origins)
 
 app.add_middleware(
     CORSMiddleware,
@@ -66,16 +88,119 @@ socket_app = socketio.ASGIApp(sio, other_asgi_app=app)
 # Initialize services
 ai_service = AIProctorService()
 storage_service = StorageService()
+recording_ingest = RecordingIngest(storage_service)
+recording_assembler = RecordingAssembler(storage_service)
+segment_writer = SegmentWriter(storage_service)
+event_sink = EventSink(AsyncSessionLocal)
+inference_dispatcher = InferenceDispatcher(ai_service)
+frame_gate = FrameQualityGate()
+sampling_policy = SamplingPolicy()
+# One slot per inference worker (times the batch size, so batches can still fill)
+admission_controller = AdmissionController(
+    capacity=inference_dispatcher.max_workers * (inference_dispatcher.batcher.max_batch_size if inference_dispatcher.batcher else 1)
+)
 
 # Store active exam sessions for real-time monitoring
-active_sessions = {}  # {session_id: {socket_id, student_id, exam_id}}
+active_sessions = {}  # {session_id: {socket_id, student_id, exam_id, cheating_score, last_alert_at}}
 # Track ongoing AI analysis to prevent overwhelming the system
 ongoing_analysis = {}  # {session_id: timestamp}
 # Track good behavior count for positive feedback
 good_behavior_count = {}  # {session_id: count}
+# Connected Socket.IO clients (students and proctors)
+connected_sockets = set()
+# Event loop the app runs on, for callbacks from worker threads
+main_loop: Optional[asyncio.AbstractEventLoop] = None
+# Background task sampling event loop lag (EVENT_LOOP_LAG)
+event_loop_monitor: Optional[asyncio.Task] = None
+# Blocking jobs started from socket handlers; held here so the loop does not drop them mid-run
+background_jobs: Set[asyncio.Task] = set()
+# After an auto-submit the client still uploads its last recording chunks (for up to 15 s)
+# before it calls submit_exam; the server finalizes on its own only once that window is over
+AUTO_SUBMIT_FINALIZE_DELAY = float(os.getenv("RECORDING_AUTO_SUBMIT_FINALIZE_SECONDS", "60"))
+
+# Gauges read at scrape time
+Gauge("proctor_active_sockets", "Connected Socket.IO clients", callback=lambda: len(connected_sockets))
+Gauge("proctor_active_sessions", "Exam sessions with a joined student", callback=lambda: len(active_sessions))
+Gauge("proctor_inference_queue_depth", "Frames waiting for an inference worker",
+      callback=lambda: inference_dispatcher.queue_depth())
+Gauge("proctor_admission_waiting", "Frames waiting for admission to inference",
+      callback=lambda: admission_controller.get_stats()["waiting"])
+Gauge("proctor_upload_queue_depth", "Evidence uploads waiting for an S3 worker",
+      callback=lambda: storage_service.upload_queue.depth())
+Gauge("proctor_upload_spooled", "Evidence uploads spooled to local disk",
+      callback=lambda: storage_service.upload_queue.spooled_count())
+Gauge("proctor_db_pool_checked_out", "Async database connections in use",
+      callback=lambda: pool_stats()["checked_out"])
+Gauge("proctor_db_pool_overflow", "Async database connections open beyond DB_POOL_SIZE",
+      callback=lambda: pool_stats()["overflow"])
+Gauge("proctor_event_sink_buffered", "Monitoring events waiting for the next batched insert",
+      callback=lambda: event_sink.depth())
+Gauge("proctor_event_sink_spooled", "Monitoring event batches spooled to local disk",
+      callback=lambda: event_sink.spooled_count())
 
 # ==================== Socket.IO Events ====================
 
+def run_in_background(func, *args, delay: float = 0.0):
+    """Run a blocking function on a worker thread after `delay` seconds, without waiting for it"""
+    async def job():
+        await asyncio.sleep(delay)
+        await asyncio.to_thread(func, *args)
+
+    task = asyncio.create_task(job())
+    background_jobs.add(task)
+    task.add_done_callback(background_jobs.discard)
+
+def admission_priority(session_id: int) -> float:
+    """Sessions with recent alerts or a high cheating score are analyzed first"""
+    data = active_sessions.get(session_id, {})
+    priority = float(data.get("cheating_score", 0))
+    last_alert_at = data.get("last_alert_at")
+    if last_alert_at and datetime.utcnow().timestamp() - last_alert_at < 120:
+        priority += 100
+    return priority
+
+def record_alert(session_id: int, cheating_score: int):
+    """Keep the in-memory risk used for admission priority in sync with the DB"""
+    if session_id in active_sessions:
+        active_sessions[session_id]["cheating_score"] = cheating_score
+        active_sessions[session_id]["last_alert_at"] = datetime.utcnow().timestamp()
+
+def resolve_evidence(job: UploadJob, url: str):
+    """Replace a pending evidence reference once its upload finished (runs on an upload thread)"""
+    from database import SessionLocal
+    # The event may still be buffered in the sink; it picks the final URL up when it flushes
+    event_sink.resolve_evidence(job.pending_url, url)
+    db = SessionLocal()
+    try:
+        commit_start = time.time()
+        db.query(MonitoringEvent).filter(
+            MonitoringEvent.evidence_url == job.pending_url
+        ).update({MonitoringEvent.evidence_url: url}, synchronize_session=False)
+        db.commit()
+        DB_WRITE_LATENCY.observe(time.time() - commit_start, operation="evidence_url")
+    finally:
+        db.close()
+
+    exam_id = job.context.get("exam_id")
+    if exam_id is not None and main_loop is not None:
+        asyncio.run_coroutine_threadsafe(sio.emit("evidence_ready", {
+            "session_id": job.context.get("session_id"),
+            "pending_url": job.pending_url,
+            "evidence_url": storage_service.presigned_url(url)
+        }, room=f"proctor_{exam_id}"), main_loop)
+
+storage_service.completion_handlers["screenshot"] = resolve_evidence
+
+async def push_sampling_interval(session_id: int, interval: Optional[float]):
+    """Tell the student's client how often to upload frames"""
+    if interval is None:
+        return
+    student_socket = active_sessions.get(session_id, {}).get("socket_id")
+    if student_socket:
+        await sio.emit("sampling_interval", {
+            "interval_ms": int(interval * 1000)
+        }, room=student_socket)
+
 @sio.event
 async def connect(sid, environ, auth):
     """Handle socket connection with JWT authentication"""
@@ -86,7 +211,7 @@ async def connect(sid, environ, auth):
         token = params.get("token")
 
         if not token:
-            print(f"Connection rejected: No token provided")
+            logger.info("Connection rejected: no token provided", extra={"sid": sid})
             return False
 
         # Validate token
@@ -97,27 +222,33 @@ async def connect(sid, environ, auth):
             payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
             user_id = payload.get("sub")
             if not user_id:
-                print(f"Connection rejected: Invalid token payload")
+                logger.info("Connection rejected: invalid token payload", extra={"sid": sid})
                 return False
 
-            print(f"Client connected: {sid} (User ID: {user_id})")
+            logger.info("Client connected", extra={"category": "connection", "sid": sid, "user_id": user_id})
+            connected_sockets.add(sid)
             return True
 
         except JWTError as e:
-            print(f"Connection rejected: JWT validation failed - {e}")
+            logger.info("Connection rejected: JWT validation failed - %s", e, extra={"sid": sid})
             return False
 
     except Exception as e:
-        print(f"Connection error: {e}")
+        logger.exception("Connection error", extra={"sid": sid})
         return False
 
 @sio.event
 async def disconnect(sid):
-    print(f"Client disconnected: {sid}")
+    logger.info("Client disconnected", extra={"category": "connection", "sid": sid})
+    connected_sockets.discard(sid)
     # Remove from active sessions
     for session_id, data in list(active_sessions.items()):
         if data.get("socket_id") == sid:
             del active_sessions[session_id]
+            frame_gate.forget(session_id)
+            ai_service.forget_session(session_id)
+            sampling_policy.forget(session_id)
+            segment_writer.flush_session(session_id)
 
 @sio.event
 async def join_exam_session(sid, data):
@@ -129,40 +260,80 @@ async def join_exam_session(sid, data):
     active_sessions[session_id] = {
         "socket_id": sid,
         "student_id": student_id,
-        "exam_id": exam_id
+        "exam_id": exam_id,
+        "cheating_score": 0,
+        "last_alert_at": None
     }
 
     await sio.emit("session_joined", {"session_id": session_id}, room=sid)
-    print(f"Student {student_id} joined exam session {session_id}")
+    await push_sampling_interval(session_id, sampling_policy.interval_for(session_id))
+    logger.info("Student joined exam session", extra={
+        "session_id": session_id, "exam_id": exam_id, "student_id": student_id
+    })
 
 @sio.event
 async def join_proctor_room(sid, data):
     """Teacher/admin joins proctor room for an exam"""
     exam_id = data.get("exam_id")
     await sio.enter_room(sid, f"proctor_{exam_id}")
-    print(f"Proctor joined room for exam {exam_id}")
+    logger.info("Proctor joined room", extra={"exam_id": exam_id, "sid": sid})
 
 @sio.event
 async def analyze_frame(sid, data):
     """Analyze webcam/screen frame for cheating detection"""
     try:
         session_id = data.get("session_id")
-        webcam_frame = data.get("webcam_frame")  # base64
-        screen_frame = data.get("screen_frame")  # base64 (optional)
+        # JPEG bytes from a binary attachment, or a base64 string from older clients
+        webcam_frame = data.get("webcam_frame")
+        screen_frame = data.get("screen_frame")  # optional
+        FRAMES.inc(outcome="received")
+        if not webcam_frame:
+            FRAMES.inc(outcome="error")
+            return
+        FRAME_BYTES.inc(len(webcam_frame), transport="base64" if isinstance(webcam_frame, str) else "binary")
+
+        # Server-controlled sampling rate: drop frames that arrive before the session is due
+        current_time = datetime.utcnow().timestamp()
+        if not sampling_policy.should_sample(session_id, current_time):
+            FRAMES.inc(outcome="throttled")
+            return
 
         # Throttle: Skip if analysis already in progress for this session
-        current_time = datetime.utcnow().timestamp()
         if session_id in ongoing_analysis:
             last_analysis_time = ongoing_analysis[session_id]
             # If last analysis was less than 2 seconds ago, skip
             if current_time - last_analysis_time < 2.0:
+                FRAMES.inc(outcome="throttled")
                 return  # Skip this frame to avoid overwhelming the AI
 
         # Mark analysis as ongoing
         ongoing_analysis[session_id] = current_time
 
-        # Analyze frame with AI
-        is_suspicious, analysis = ai_service.analyze_frame(webcam_frame, screen_frame)
+        # Decode once; every later stage works on views of the raw JPEG bytes
+        webcam_frame = frame_bytes(webcam_frame)
+        if screen_frame:
+            screen_frame = frame_bytes(screen_frame)
+
+        # Local pre-filter: static or unusable frames never reach the model
+        should_analyze, _ = await asyncio.to_thread(frame_gate.check, session_id, webcam_frame)
+        if not should_analyze:
+            FRAMES.inc(outcome="gated")
+            del ongoing_analysis[session_id]
+            return
+
+        # Admission control: wait for an inference slot, or shed the frame under overload
+        exam_id = active_sessions.get(session_id, {}).get("exam_id")
+        if not await admission_controller.acquire(exam_id, admission_priority(session_id)):
+            FRAMES.inc(outcome="shed")
+            del ongoing_analysis[session_id]
+            return
+
+        # Analyze frame with AI (runs on the inference worker pool, not the event loop)
+        try:
+            is_suspicious, analysis = await inference_dispatcher.analyze_frame(webcam_frame, screen_frame, session_id)
+        finally:
+            admission_controller.release()
+        FRAMES.inc(outcome="error" if "error" in analysis else "analyzed")
 
         # Clear ongoing flag after analysis
         if session_id in ongoing_analysis:
@@ -171,12 +342,17 @@ async def analyze_frame(sid, data):
         if is_suspicious:
             # Reset good behavior count when violation detected
             good_behavior_count[session_id] = 0
+            await push_sampling_interval(session_id, sampling_policy.on_alert(session_id))
         else:
             # Student is behaving well - send positive feedback periodically
             if session_id not in good_behavior_count:
                 good_behavior_count[session_id] = 0
 
             good_behavior_count[session_id] += 1
+            await push_sampling_interval(
+                session_id,
+                sampling_policy.on_good_behavior(session_id, good_behavior_count[session_id])
+            )
 
             # Send positive feedback every 15 good checks (about every 30 seconds)
             if good_behavior_count[session_id] % 15 == 0:
@@ -197,75 +373,112 @@ async def analyze_frame(sid, data):
                         "message": message,
                         "good_behavior_streak": good_behavior_count[session_id]
                     }, room=student_socket)
-                    print(f"✅ Positive feedback sent to student {active_sessions[session_id].get('student_id')}: {message}")
+                    logger.info("Positive feedback sent", extra={
+                        "category": "feedback",
+                        "session_id": session_id,
+                        "student_id": active_sessions[session_id].get("student_id"),
+                        "streak": good_behavior_count[session_id]
+                    })
 
         if is_suspicious:
-            # Create monitoring event in database
-            from database import SessionLocal
-            db = SessionLocal()
+            # Create monitoring event in database (async engine: waiting on Postgres never blocks the loop)
+            db = AsyncSessionLocal()
 
             try:
-                # Upload screenshot to S3
-                evidence_url = storage_service.upload_screenshot(
-                    webcam_frame,
-                    session_id,
-                    analysis.get("alert_type", "suspicious_activity")
-                )
-
                 # Create event
                 alert_type_str = analysis.get("alert_type", "suspicious_activity").upper()
                 # Skip if alert type is NONE (no actual violation detected)
                 if alert_type_str == "NONE":
-                    print(f"[Ollama Debug] Skipping alert with type NONE")
+                    logger.debug("Skipping alert with type NONE", extra={"session_id": session_id})
                     return  # Exit without creating event
 
-                event = MonitoringEvent(
+                # session_id comes from the client; an unknown one would make the batched event
+                # insert (and the evidence segment index) fail for everyone it is written with
+                session = await db.get(ExamSession, session_id)
+                if session is None:
+                    logger.warning("Alert for unknown session dropped", extra={"session_id": session_id})
+                    return
+                auto_submitted = False
+
+                # Full-quality copy, not the downscaled inference frame. It is appended to the
+                # session's evidence segment, whose reference is final immediately; without
+                # segments the screenshot is uploaded after the commit and the event carries a
+                # pending reference that resolve_evidence() replaces
+                evidence_frame = await asyncio.to_thread(ai_service.frame_normalizer.for_evidence, webcam_frame)
+                evidence_key = None
+                if segment_writer.enabled:
+                    evidence_url = segment_writer.append(session_id, evidence_frame, context={"exam_id": exam_id})
+                else:
+                    evidence_key = storage_service.screenshot_key(session_id, analysis.get("alert_type", "suspicious_activity"))
+                    evidence_url = pending_reference(evidence_key)
+
+                # Written by the event sink; only the session update below is committed here
+                event_row = dict(
                     session_id=session_id,
                     event_type=AlertType[alert_type_str],
+                    timestamp=datetime.utcnow(),
                     confidence=analysis.get("confidence", 0.0),
                     description=analysis.get("description", "Suspicious activity detected"),
                     evidence_url=evidence_url,
                     ai_analysis=analysis,
                     severity=analysis.get("severity", 3)
                 )
-                db.add(event)
 
                 # Update session cheating score
-                session = db.query(ExamSession).filter(ExamSession.id == session_id).first()
-                if session:
-                    session.cheating_score += analysis.get("severity", 1)
-                    session.total_alerts += 1
+                session.cheating_score += analysis.get("severity", 1)
+                session.total_alerts += 1
+                record_alert(session_id, session.cheating_score)
 
-                    # Send warning to student
+                # Send warning to student
+                student_socket = active_sessions.get(session_id, {}).get("socket_id")
+                if student_socket:
+                    await sio.emit("cheating_warning", {
+                        "description": analysis.get("description", "Suspicious activity detected"),
+                        "alert_type": analysis.get("alert_type"),
+                        "severity": analysis.get("severity"),
+                        "warning_count": session.total_alerts,
+                        "cheating_score": session.cheating_score,
+                        "threshold": exam.cheating_threshold if 'exam' in locals() else 10
+                    }, room=student_socket)
+                    logger.warning("Cheating warning sent: %s", analysis.get("description"), extra={
+                        "session_id": session_id,
+                        "exam_id": session.exam_id,
+                        "student_id": session.student_id,
+                        "alert_type": analysis.get("alert_type")
+                    })
+
+                # Check if threshold exceeded
+                exam = await db.get(Exam, session.exam_id)
+                if session.cheating_score >= exam.cheating_threshold and not session.is_submitted:
+                    # Auto-submit exam
+                    auto_submitted = True
+                    session.is_submitted = True
+                    session.auto_submitted = True
+                    session.end_time = datetime.utcnow()
+
+                    # Notify student
                     student_socket = active_sessions.get(session_id, {}).get("socket_id")
                     if student_socket:
-                        await sio.emit("cheating_warning", {
-                            "description": analysis.get("description", "Suspicious activity detected"),
-                            "alert_type": analysis.get("alert_type"),
-                            "severity": analysis.get("severity"),
-                            "warning_count": session.total_alerts,
-                            "cheating_score": session.cheating_score,
-                            "threshold": exam.cheating_threshold if 'exam' in locals() else 10
+                        await sio.emit("exam_auto_submitted", {
+                            "reason": "Cheating threshold exceeded",
+                            "cheating_score": session.cheating_score
                         }, room=student_socket)
-                        print(f"⚠️  Warning sent to student {session.student_id}: {analysis.get('description')}")
-
-                    # Check if threshold exceeded
-                    exam = db.query(Exam).filter(Exam.id == session.exam_id).first()
-                    if session.cheating_score >= exam.cheating_threshold and not session.is_submitted:
-                        # Auto-submit exam
-                        session.is_submitted = True
-                        session.auto_submitted = True
-                        session.end_time = datetime.utcnow()
-
-                        # Notify student
-                        student_socket = active_sessions.get(session_id, {}).get("socket_id")
-                        if student_socket:
-                            await sio.emit("exam_auto_submitted", {
-                                "reason": "Cheating threshold exceeded",
-                                "cheating_score": session.cheating_score
-                            }, room=student_socket)
-
-                db.commit()
+
+                commit_start = time.time()
+                await db.commit()
+                DB_WRITE_LATENCY.observe(time.time() - commit_start, operation="alert_session_update")
+                await event_sink.add(event_row)
+
+                if auto_submitted:
+                    # Normally the client's submit_exam finalizes the recordings once its last chunks
+                    # are in; this covers clients that disconnect before submitting
+                    run_in_background(finalize_recordings, session_id, delay=AUTO_SUBMIT_FINALIZE_DELAY)
+
+                if evidence_key is not None:
+                    storage_service.queue_screenshot(evidence_key, evidence_frame, context={
+                        "session_id": session_id,
+                        "exam_id": session.exam_id if session else None,
+                    })
 
                 # Notify proctors
                 await sio.emit("cheating_alert", {
@@ -276,14 +489,14 @@ async def analyze_frame(sid, data):
                     "confidence": analysis.get("confidence"),
                     "severity": analysis.get("severity"),
                     "timestamp": datetime.utcnow().isoformat(),
-                    "evidence_url": evidence_url
+                    "evidence_url": storage_service.presigned_url(evidence_url) or evidence_url
                 }, room=f"proctor_{session.exam_id}")
 
             finally:
-                db.close()
+                await db.close()
 
     except Exception as e:
-        print(f"Error analyzing frame: {e}")
+        logger.exception("Error analyzing frame", extra={"session_id": session_id})
         # Clear ongoing flag even on error
         if session_id in ongoing_analysis:
             del ongoing_analysis[session_id]
@@ -293,38 +506,55 @@ async def tab_switch_detected(sid, data):
     """Handle tab switch detection from client"""
     session_id = data.get("session_id")
 
-    from database import SessionLocal
-    db = SessionLocal()
+    # Sample at the alert rate right after a tab switch
+    good_behavior_count[session_id] = 0
+    await push_sampling_interval(session_id, sampling_policy.on_alert(session_id))
+
+    db = AsyncSessionLocal()
 
     try:
-        event = MonitoringEvent(
+        # Written by the event sink; only the session update below is committed here
+        event_row = dict(
             session_id=session_id,
             event_type=AlertType.TAB_SWITCH,
+            timestamp=datetime.utcnow(),
             confidence=1.0,
             description="Student switched browser tab or window",
+            evidence_url=None,
+            ai_analysis=None,
             severity=2
         )
-        db.add(event)
 
         # Update session
-        session = db.query(ExamSession).filter(ExamSession.id == session_id).first()
-        if session:
-            session.cheating_score += 2
-            session.total_alerts += 1
-
-            # Send warning to student
-            student_socket = active_sessions.get(session_id, {}).get("socket_id")
-            if student_socket:
-                await sio.emit("cheating_warning", {
-                    "description": "Tab switching detected! Stay focused on the exam.",
-                    "alert_type": "tab_switch",
-                    "severity": 2,
-                    "warning_count": session.total_alerts,
-                    "cheating_score": session.cheating_score
-                }, room=student_socket)
-                print(f"⚠️  Tab switch warning sent to student {session.student_id}")
+        session = await db.get(ExamSession, session_id)
+        if session is None:
+            # Unknown id from the client: nothing to attach the event to
+            logger.warning("Tab switch for unknown session dropped", extra={"session_id": session_id})
+            return
+        session.cheating_score += 2
+        session.total_alerts += 1
+        record_alert(session_id, session.cheating_score)
+
+        # Send warning to student
+        student_socket = active_sessions.get(session_id, {}).get("socket_id")
+        if student_socket:
+            await sio.emit("cheating_warning", {
+                "description": "Tab switching detected! Stay focused on the exam.",
+                "alert_type": "tab_switch",
+                "severity": 2,
+                "warning_count": session.total_alerts,
+                "cheating_score": session.cheating_score
+            }, room=student_socket)
+            logger.warning("Tab switch warning sent", extra={
+                "session_id": session_id,
+                "exam_id": session.exam_id,
+                "student_id": session.student_id
+            })
 
-        db.commit()
+        commit_start = time.time()
+        await db.commit()
+        DB_WRITE_LATENCY.observe(time.time() - commit_start, operation="tab_switch_session_update")
+        await event_sink.add(event_row)
 
         # Notify proctors
         await sio.emit("cheating_alert", {
@@ -337,7 +567,7 @@ async def tab_switch_detected(sid, data):
         }, room=f"proctor_{session.exam_id}")
 
     finally:
-        db.close()
+        await db.close()
 
 # ==================== Authentication Routes ====================
 
@@ -630,9 +860,41 @@ def get_exam_session(
 
 # ==================== Submission Routes ====================
 
+def finalize_recordings(session_id: int):
+    """Complete a session's recordings and store their URLs (runs after the submit response)"""
+    from database import SessionLocal
+    urls = {}
+    for kind in RecordingKind:
+        try:
+            urls[kind] = recording_ingest.finalize(session_id, kind.value)
+        except Exception:
+            logger.exception("Could not finalize recording", extra={"session_id": session_id, "kind": kind.value})
+
+    # Clients that uploaded standalone chunk_NNNN.webm fragments get them joined into one file
+    if not urls.get(RecordingKind.WEBCAM):
+        try:
+            urls[RecordingKind.WEBCAM] = recording_assembler.assemble(session_id, RecordingKind.WEBCAM.value)
+        except Exception:
+            logger.exception("Could not assemble recording fragments", extra={"session_id": session_id})
+
+    if not any(urls.values()):
+        return
+    db = SessionLocal()
+    try:
+        session = db.query(ExamSession).filter(ExamSession.id == session_id).first()
+        if session:
+            if urls.get(RecordingKind.WEBCAM):
+                session.video_recording_url = urls[RecordingKind.WEBCAM]
+            if urls.get(RecordingKind.SCREEN):
+                session.screen_recording_url = urls[RecordingKind.SCREEN]
+            db.commit()
+    finally:
+        db.close()
+
 @app.post("/api/submissions", response_model=SubmissionResponse)
 def submit_exam(
     submission_data: SubmissionCreate,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
@@ -645,6 +907,10 @@ def submit_exam(
     if session.student_id != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
 
+    # Recordings are completed after the response; finalizing is idempotent,
+    # so auto-submitted sessions that submit again are covered too
+    background_tasks.add_task(finalize_recordings, session.id)
+
     if session.is_submitted:
         # Check if submission already exists
         existing_submission = db.query(Submission).filter(
@@ -739,20 +1005,146 @@ def get_submission(
 
     return submission
 
+# ==================== Recording Routes ====================
+
+async def get_recording_session(db: AsyncSession, session_id: int, current_user: User) -> ExamSession:
+    """
+    Load and authorize the session, then hand db's pooled connection back:
+    callers go on to stream a request body or talk to storage, and holding
+    a connection through that would drain the pool the socket handlers use.
+    """
+    session = await db.get(ExamSession, session_id)
+    await db.close()  # Loaded attributes stay readable on the detached object
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if current_user.role == UserRole.STUDENT and session.student_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    return session
+
+@app.get("/api/sessions/{session_id}/recordings/{kind}")
+async def get_recording_status(
+    session_id: int,
+    kind: RecordingKind,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Upload progress of a recording; clients resume from next_chunk after a reconnect"""
+    await get_recording_session(db, session_id, current_user)
+    return await asyncio.to_thread(recording_ingest.status, session_id, kind.value)
+
+@app.put("/api/sessions/{session_id}/recordings/{kind}/chunks/{chunk_number}")
+async def upload_recording_chunk(
+    session_id: int,
+    kind: RecordingKind,
+    chunk_number: int,
+    request: Request,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Append one MediaRecorder chunk (raw request body) to a session recording"""
+    session = await get_recording_session(db, session_id, current_user)
+    if session.student_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Only the student can upload their recording")
+
+    # Read the body with a hard cap so one client cannot exhaust memory
+    data = bytearray()
+    async for piece in request.stream():
+        data += piece
+        if len(data) > recording_ingest.max_chunk_bytes:
+            raise HTTPException(status_code=413, detail="Recording chunk too large")
+
+    # When the client started recording this chunk (ms since epoch), for the time index
+    try:
+        recorded_at = float(request.headers["X-Recorded-At"]) / 1000
+    except (KeyError, ValueError):
+        recorded_at = None
+
+    try:
+        return await asyncio.to_thread(
+            recording_ingest.append_chunk, session_id, kind.value, chunk_number, data, recorded_at
+        )
+    except RecordingConflict as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "next_chunk": e.next_chunk})
+
+@app.get("/api/events/{event_id}/clip")
+async def get_event_clip(
+    event_id: int,
+    kind: RecordingKind = RecordingKind.WEBCAM,
+    before: float = Query(10.0, ge=0, le=60),
+    after: float = Query(5.0, ge=0, le=60),
+    current_user: User = Depends(require_role([UserRole.TEACHER, UserRole.ADMIN])),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Short WebM excerpt of a session recording around an event, read via the recording's time index"""
+    event = await db.get(MonitoringEvent, event_id)
+    await db.close()  # Release the pooled connection before the storage read
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    # Event timestamps are naive UTC (datetime.utcnow)
+    moment = event.timestamp.replace(tzinfo=timezone.utc).timestamp()
+    try:
+        data = await asyncio.to_thread(recording_ingest.clip, event.session_id, kind.value, moment, before, after)
+    except RecordingConflict as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "next_chunk": e.next_chunk})
+    except StorageError as e:
+        logger.warning("Could not read recording clip: %s", e, extra={"event_id": event_id})
+        raise HTTPException(status_code=502, detail="Recording storage unavailable")
+    if data is None:
+        raise HTTPException(status_code=404, detail="No recording covers this event")
+    return Response(content=data, media_type="video/webm")
+
+# ==================== Storage Routes ====================
+
+@app.get("/api/storage/{digest}")
+def get_stored_object(digest: str, expires: int, signature: str):
+    """Serve an object from the local storage backend via a signed, expiring URL"""
+    backend = storage_service.backend
+    if not isinstance(backend, LocalBackend):
+        raise HTTPException(status_code=404, detail="Not found")
+    digest = backend.digest_for(LocalBackend.PREFIX + digest)
+    if digest is None or not backend.verify(digest, expires, signature):
+        raise HTTPException(status_code=403, detail="Invalid or expired link")
+    path = backend.path(digest)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Not found")
+    return FileResponse(path, media_type=backend.content_type(digest))
+
+@app.get("/api/evidence/segment")
+async def get_segment_frame(ref: str, expires: int, signature: str):
+    """Serve one evidence frame out of its segment via a signed, expiring URL"""
+    if not verify_signature(ref, expires, signature):
+        raise HTTPException(status_code=403, detail="Invalid or expired link")
+    data = await asyncio.to_thread(segment_writer.read, ref)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return Response(content=data, media_type="image/jpeg", headers={"Cache-Control": "private, max-age=3600"})
+
 # ==================== Monitoring Routes ====================
 
+def event_responses(events: List[MonitoringEvent]) -> List[MonitoringEventResponse]:
+    """Serialize events with openable (presigned, cached) evidence URLs instead of stored references"""
+    return [
+        MonitoringEventResponse.model_validate(event).model_copy(
+            update={"evidence_url": storage_service.presigned_url(event.evidence_url)}
+        )
+        for event in events
+    ]
+
 @app.get("/api/sessions/{session_id}/events", response_model=List[MonitoringEventResponse])
-def get_monitoring_events(
+async def get_monitoring_events(
     session_id: int,
     current_user: User = Depends(require_role([UserRole.TEACHER, UserRole.ADMIN])),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get all monitoring events for a session"""
-    events = db.query(MonitoringEvent).filter(
-        MonitoringEvent.session_id == session_id
-    ).order_by(MonitoringEvent.timestamp.desc()).all()
+    result = await db.execute(
+        select(MonitoringEvent).where(
+            MonitoringEvent.session_id == session_id
+        ).order_by(MonitoringEvent.timestamp.desc())
+    )
+    events = result.scalars().all()
 
-    return events
+    return event_responses(events)
 
 @app.get("/api/sessions/{session_id}/behavior-report", response_model=BehaviorAnalysisReport)
 def get_behavior_report(
@@ -773,7 +1165,7 @@ def get_behavior_report(
 
     return {
         "session_id": session_id,
-        "timeline": events,
+        "timeline": event_responses(events),
         **report
     }
 
@@ -789,14 +1181,14 @@ def list_students(
     return students
 
 @app.get("/api/admin/exams/{exam_id}/sessions", response_model=List[ExamSessionResponse])
-def get_exam_sessions(
+async def get_exam_sessions(
     exam_id: int,
     current_user: User = Depends(require_role([UserRole.TEACHER, UserRole.ADMIN])),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get all sessions for an exam (for proctoring dashboard)"""
-    sessions = db.query(ExamSession).filter(ExamSession.exam_id == exam_id).all()
-    return sessions
+    result = await db.execute(select(ExamSession).where(ExamSession.exam_id == exam_id))
+    return result.scalars().all()
 
 @app.get("/api/admin/live-sessions")
 def get_live_sessions(
@@ -817,9 +1209,83 @@ def get_live_sessions(
 # ==================== Health Check ====================
 
 @app.get("/api/health")
-def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy", "service": "exam-platform-api"}
+def health_check(response: Response):
+    """Health check endpoint (503 while the inference model is still warming up)"""
+    ready = ai_service.lifecycle.ready or not ai_service.use_ollama
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {
+        "status": "healthy" if ready else "warming",
+        "ollama_lifecycle": ai_service.lifecycle.get_stats(),
+        "ollama_streaming": ai_service.get_streaming_stats(),
+        "service": "exam-platform-api",
+        "inference": inference_dispatcher.get_stats(),
+        "admission": admission_controller.get_stats(),
+        "inference_endpoints": ai_service.router.get_stats(),
+        "frame_gate": frame_gate.get_stats(),
+        "verdict_cache": ai_service.verdict_cache.get_stats(),
+        "face_tier": ai_service.face_tier.get_stats(),
+        "frame_normalizer": ai_service.frame_normalizer.get_stats(),
+        "database_pool": pool_stats(),
+        "event_sink": event_sink.get_stats(),
+        "storage": storage_service.get_stats(),
+        "evidence_segments": segment_writer.get_stats()
+    }
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics for the proctoring pipeline"""
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE)
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """Measure how late the event loop wakes up - a direct view of blocking work"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, time.perf_counter() - start - interval))
+
+@app.on_event("startup")
+async def start_event_loop_monitor():
+    global main_loop, event_loop_monitor
+    main_loop = asyncio.get_running_loop()
+    event_loop_monitor = asyncio.create_task(monitor_event_loop_lag())
+
+@app.on_event("shutdown")
+async def stop_event_loop_monitor():
+    if event_loop_monitor is not None:
+        event_loop_monitor.cancel()
+        try:
+            await event_loop_monitor
+        except asyncio.CancelledError:
+            pass
+
+@app.on_event("startup")
+def start_services():
+    """Start background health probes, model warm-up and evidence uploads"""
+    if ai_service.use_ollama:
+        ai_service.router.start()
+        ai_service.lifecycle.start()
+    storage_service.start()
+    segment_writer.start()
+
+@app.on_event("startup")
+async def start_event_sink():
+    event_sink.start()
+
+@app.on_event("shutdown")
+async def close_database_pool():
+    await event_sink.stop()  # Write buffered monitoring events while the pool is still open
+    await async_engine.dispose()
+
+@app.on_event("shutdown")
+def shutdown_services():
+    """Release background workers on shutdown"""
+    ai_service.router.stop()
+    ai_service.lifecycle.stop()
+    inference_dispatcher.shutdown()
+    segment_writer.stop()  # Queue open segments before the upload queue spools what is left
+    storage_service.stop()
+    shutdown_logging()
 
 if __name__ == "__main__":
     import uvicorn
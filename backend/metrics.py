@@ -0,0 +1,197 @@
+import abc
+import threading
+from typing import Dict, Any, List, Tuple, Callable, Optional, Sequence
+
+# Minimal Prometheus text-format metrics. Only what the proctoring pipeline
+# needs: labeled counters, gauges (set directly or read from a callback) and
+# cumulative histograms.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: List["Metric"] = []
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels.items():
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{escaped}"')
+    return "{" + ",".join(parts) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+class Metric(abc.ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: Tuple) -> Dict[str, Any]:
+        return dict(zip(self.labelnames, key))
+
+    @abc.abstractmethod
+    def samples(self) -> List[Tuple[str, Dict[str, Any], float]]:
+        """(sample name, labels, value) for every series of this metric"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in self._values.items()]
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Any]] = None):
+        """
+        `callback`, if given, is read at scrape time. It returns a number, or
+        for labeled gauges a dict mapping label-value tuples to numbers.
+        """
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        if self.callback is not None:
+            value = self.callback()
+            if isinstance(value, dict):
+                return [(self.name, self._labels(tuple(map(str, key))), v) for key, v in value.items()]
+            return [(self.name, {}, value)]
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in self._values.items()]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._counts: Dict[Tuple, List[int]] = {}
+        self._sums: Dict[Tuple, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * len(self.buckets)
+                self._sums[key] = 0.0
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._sums[key] += value
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for key, counts in self._counts.items():
+                labels = self._labels(key)
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    result.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+                result.append((f"{self.name}_count", labels, cumulative))
+                result.append((f"{self.name}_sum", labels, self._sums[key]))
+        return result
+
+def render_metrics() -> str:
+    """All registered metrics in Prometheus text exposition format"""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+# ==================== Pipeline metrics ====================
+
+INFERENCE_LATENCY = Histogram(
+    "proctor_inference_latency_seconds",
+    "Latency of AI inference requests per backend",
+    ["backend", "endpoint"],
+)
+FRAMES = Counter(
+    "proctor_frames_total",
+    "Webcam frames by pipeline outcome (received, throttled, gated, shed, analyzed, error)",
+    ["outcome"],
+)
+FRAME_BYTES = Counter(
+    "proctor_frame_bytes_total",
+    "Webcam frame payload bytes received, by transport (binary, base64)",
+    ["transport"],
+)
+DB_WRITE_LATENCY = Histogram(
+    "proctor_db_write_latency_seconds",
+    "Latency of database writes from the monitoring pipeline",
+    ["operation"],
+)
+DB_POOL_CHECKOUT_LATENCY = Histogram(
+    "proctor_db_pool_checkout_seconds",
+    "Time spent waiting for a pooled database connection",
+    ["engine"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+EVENT_SINK_FLUSH_LATENCY = Histogram(
+    "proctor_event_sink_flush_seconds",
+    "Latency of one batched MonitoringEvent insert",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+EVENT_SINK_FLUSH_ROWS = Histogram(
+    "proctor_event_sink_flush_rows",
+    "MonitoringEvent rows written per flush",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+EVENT_SINK_DROPPED = Counter(
+    "proctor_event_sink_dropped_total",
+    "MonitoringEvent rows lost because they could be neither written nor spooled to disk",
+)
+STORAGE_UPLOAD_LATENCY = Histogram(
+    "proctor_storage_upload_latency_seconds",
+    "Latency of evidence and recording uploads",
+    ["kind"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+VERDICT_CACHE_HITS = Counter(
+    "proctor_verdict_cache_hits_total",
+    "Frames answered from the verdict cache",
+)
+VERDICT_CACHE_MISSES = Counter(
+    "proctor_verdict_cache_misses_total",
+    "Verdict cache lookups that found no reusable verdict",
+)
+EVENT_LOOP_LAG = Histogram(
+    "proctor_event_loop_lag_seconds",
+    "How late the asyncio event loop ran a scheduled wake-up",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
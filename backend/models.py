@@ -23,6 +23,10 @@ class AlertType(str, enum.Enum):
     TAB_SWITCH = "tab_switch"
     SUSPICIOUS_ACTIVITY = "suspicious_activity"
 
+class RecordingKind(str, enum.Enum):
+    WEBCAM = "webcam"
+    SCREEN = "screen"
+
 class User(Base):
     __tablename__ = "users"
 
@@ -167,3 +171,14 @@ class MonitoringEvent(Base):
 
     # Relationships
     session = relationship("ExamSession", back_populates="monitoring_events")
+
+class EvidenceSegment(Base):
+    __tablename__ = "evidence_segments"
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey("exam_sessions.id"), index=True)
+    key = Column(String, unique=True, index=True, nullable=False)  # Object key in segment references
+    storage_url = Column(String, nullable=False)  # Reference returned by the storage backend
+    size = Column(Integer, nullable=False)
+    frame_index = Column(JSON)  # [[offset, length], ...] per frame, in append order
+    created_at = Column(DateTime, default=datetime.utcnow)
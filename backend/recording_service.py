@@ -0,0 +1,407 @@
+import os
+import re
+import json
+import time
+import shutil
+import struct
+import logging
+import tempfile
+import threading
+from contextlib import closing
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple, Union, List
+from dotenv import load_dotenv
+
+from storage_service import StorageService
+from storage_backends import StorageError
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# S3 rejects multipart parts smaller than 5 MiB (except the last one)
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Time index: record N describes chunk N as (start time, byte offset, length)
+INDEX_RECORD = struct.Struct("<dQI")
+# Matroska Cluster element ID; everything before the first one is the WebM header
+WEBM_CLUSTER_ID = b"\x1f\x43\xb6\x75"
+# EBML header magic; only the first chunk of a MediaRecorder stream starts with it
+EBML_MAGIC = b"\x1a\x45\xdf\xa3"
+
+class RecordingConflict(Exception):
+    """A chunk cannot be accepted in the recording's current state"""
+
+    def __init__(self, message: str, next_chunk: int):
+        super().__init__(message)
+        self.next_chunk = next_chunk
+
+class RecordingIngest:
+    """
+    Ingests MediaRecorder chunks for a session's webcam/screen recording.
+
+    Chunks must arrive in order. A repeated chunk is acknowledged without
+    being stored again, and a chunk from the future is rejected with the
+    chunk number the server expects, so a reconnecting client resumes from
+    there. A chunk that starts a new WebM stream (a new MediaRecorder after
+    a page reload) is rejected the same way, since appending it would leave
+    the file unplayable past that point. Chunks are appended to an on-disk
+    spool, and every RECORDING_PART_SIZE_MB of spool is streamed to a
+    multipart upload on the storage backend. Memory per session is bounded by one chunk.
+
+    State lives in a JSON manifest next to the spool, so uploads also
+    resume after a server restart.
+
+    Each chunk's start time and byte range are appended to a fixed-width
+    time index, and the WebM header from chunk 0 is kept, so clip() can cut
+    a short playable excerpt around any moment with a binary search and a
+    single ranged read.
+    """
+
+    def __init__(self, storage: StorageService):
+        self.storage = storage
+        self.root = os.getenv("RECORDING_SPOOL_DIR", "recording_spool")
+        self.part_size = max(MIN_PART_SIZE, int(float(os.getenv("RECORDING_PART_SIZE_MB", "8")) * 1024 * 1024))
+        self.max_chunk_bytes = int(float(os.getenv("RECORDING_MAX_CHUNK_MB", "16")) * 1024 * 1024)
+
+        self._lock = threading.Lock()
+        self._upload_locks: Dict[Tuple[int, str], threading.Lock] = {}
+
+    # ---------- state ----------
+
+    def _paths(self, session_id: int, kind: str) -> Tuple[str, str]:
+        directory = os.path.join(self.root, f"session_{session_id}")
+        return os.path.join(directory, f"{kind}.json"), os.path.join(directory, f"{kind}.webm")
+
+    def _index_path(self, session_id: int, kind: str) -> str:
+        return os.path.join(self.root, f"session_{session_id}", f"{kind}.index")
+
+    def _header_path(self, session_id: int, kind: str) -> str:
+        return os.path.join(self.root, f"session_{session_id}", f"{kind}.header")
+
+    def _upload_lock(self, session_id: int, kind: str) -> threading.Lock:
+        with self._lock:
+            return self._upload_locks.setdefault((session_id, kind), threading.Lock())
+
+    def _load(self, session_id: int, kind: str) -> Dict[str, Any]:
+        manifest_path, spool_path = self._paths(session_id, kind)
+        try:
+            with open(manifest_path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+            return {
+                "key": f"recordings/session_{session_id}/{kind}_{timestamp}.webm",
+                "upload_id": None,
+                "parts": [],
+                "next_chunk": 0,
+                "bytes_received": 0,
+                "spool_bytes": 0,
+                "url": None,
+            }
+
+        # Drop a chunk that was half-written when the process died
+        if os.path.exists(spool_path) and os.path.getsize(spool_path) > state["spool_bytes"]:
+            with open(spool_path, "r+b") as f:
+                f.truncate(state["spool_bytes"])
+        index_path = self._index_path(session_id, kind)
+        if os.path.exists(index_path) and os.path.getsize(index_path) > state["next_chunk"] * INDEX_RECORD.size:
+            with open(index_path, "r+b") as f:
+                f.truncate(state["next_chunk"] * INDEX_RECORD.size)
+        return state
+
+    def _save(self, session_id: int, kind: str, state: Dict[str, Any]):
+        manifest_path, _ = self._paths(session_id, kind)
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    @staticmethod
+    def _public(state: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "next_chunk": state["next_chunk"],
+            "bytes_received": state["bytes_received"],
+            "finalized": state["url"] is not None,
+            "url": state["url"],
+        }
+
+    # ---------- API ----------
+
+    def status(self, session_id: int, kind: str) -> Dict[str, Any]:
+        """Where a client should resume uploading"""
+        with self._upload_lock(session_id, kind):
+            return self._public(self._load(session_id, kind))
+
+    def append_chunk(self, session_id: int, kind: str, chunk_number: int, data: Union[bytes, bytearray],
+                     recorded_at: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Append the next chunk of a recording; idempotent for chunks already received.
+        recorded_at is when the client started recording the chunk (epoch seconds).
+        """
+        with self._upload_lock(session_id, kind):
+            state = self._load(session_id, kind)
+            if state["url"] is not None:
+                raise RecordingConflict("Recording already finalized", state["next_chunk"])
+            if chunk_number < state["next_chunk"]:
+                return self._public(state)  # Re-sent after a reconnect; already stored
+            if chunk_number > state["next_chunk"]:
+                raise RecordingConflict(f"Expected chunk {state['next_chunk']}", state["next_chunk"])
+            if chunk_number > 0 and bytes(data[:4]) == EBML_MAGIC:
+                # A second MediaRecorder stream (e.g. after a page reload) would put a new
+                # header mid-file, and players stop at it; the recording keeps the first stream
+                raise RecordingConflict("Recording already has a stream; a new one cannot be appended",
+                                        state["next_chunk"])
+
+            _, spool_path = self._paths(session_id, kind)
+            os.makedirs(os.path.dirname(spool_path), exist_ok=True)
+            with open(spool_path, "ab") as f:
+                f.write(data)
+            self._index_chunk(session_id, kind, state, data, recorded_at)
+
+            state["next_chunk"] += 1
+            state["bytes_received"] += len(data)
+            state["spool_bytes"] += len(data)
+            self._save(session_id, kind, state)
+
+            if state["spool_bytes"] >= self.part_size:
+                try:
+                    self._upload_spool(session_id, kind, state)
+                except StorageError as e:
+                    # The chunk is safe in the spool; the next chunk or finalize retries the part
+                    logger.warning("Recording part upload failed: %s", e, extra={"session_id": session_id, "kind": kind})
+            return self._public(state)
+
+    def finalize(self, session_id: int, kind: str) -> Optional[str]:
+        """Complete the recording and return its URL (None if nothing was recorded)"""
+        with self._upload_lock(session_id, kind):
+            manifest_path, spool_path = self._paths(session_id, kind)
+            if not os.path.exists(manifest_path):
+                return None
+            state = self._load(session_id, kind)
+            if state["url"] is not None:
+                return state["url"]
+            if state["bytes_received"] == 0:
+                return None
+
+            if state["spool_bytes"] > 0:
+                self._upload_spool(session_id, kind, state)  # The last part may be small
+            state["url"] = self.storage.complete_multipart_upload(state["key"], state["upload_id"], state["parts"])
+            os.remove(spool_path)
+            self._save(session_id, kind, state)
+
+        logger.info("Recording finalized", extra={
+            "session_id": session_id, "kind": kind, "bytes": state["bytes_received"], "chunks": state["next_chunk"]
+        })
+        return state["url"]
+
+    # ---------- time index ----------
+
+    def _index_chunk(self, session_id: int, kind: str, state: Dict[str, Any], data: Union[bytes, bytearray],
+                     recorded_at: Optional[float]):
+        """Append the chunk's index record (before the manifest is saved; _load truncates leftovers)"""
+        index_path = self._index_path(session_id, kind)
+        now = time.time()
+        # A client clock cannot place a chunk in the future, and start times must not go backwards
+        start = min(recorded_at, now) if recorded_at else now
+        if state["next_chunk"] > 0:
+            with open(index_path, "rb") as f:
+                start = max(start, self._record(f, state["next_chunk"] - 1)[0])
+        with open(index_path, "ab") as f:
+            f.write(INDEX_RECORD.pack(start, state["bytes_received"], len(data)))
+
+        if state["next_chunk"] == 0:
+            # The WebM header (EBML, Segment info, Tracks) makes later chunks playable on their own
+            cluster = bytes(data[:64 * 1024]).find(WEBM_CLUSTER_ID)
+            with open(self._header_path(session_id, kind), "wb") as f:
+                f.write(data[:cluster] if cluster > 0 else b"")
+
+    @staticmethod
+    def _record(f, number: int) -> Tuple[float, int, int]:
+        f.seek(number * INDEX_RECORD.size)
+        return INDEX_RECORD.unpack(f.read(INDEX_RECORD.size))
+
+    def _chunks_started_by(self, f, count: int, moment: float) -> int:
+        """Number of chunks that started at or before `moment` (binary search over the index)"""
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if self._record(f, middle)[0] <= moment:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def clip(self, session_id: int, kind: str, moment: float, before: float, after: float) -> Optional[bytes]:
+        """
+        WebM bytes covering [moment - before, moment + after] (epoch seconds),
+        read from the chunks in that window only. None if nothing was recorded
+        then. Raises RecordingConflict if the window sits in a part that is
+        already uploaded but not yet readable because the recording is still
+        open on S3.
+        """
+        with self._upload_lock(session_id, kind):
+            manifest_path, spool_path = self._paths(session_id, kind)
+            if not os.path.exists(manifest_path):
+                return None
+            state = self._load(session_id, kind)
+            count = state["next_chunk"]
+            if count == 0:
+                return None
+
+            with open(self._index_path(session_id, kind), "rb") as f:
+                started = self._chunks_started_by(f, count, moment + after)
+                if started == 0:
+                    return None  # The window ends before the recording began
+                # The chunk in progress at the window start, through the last one starting inside it
+                first = max(0, self._chunks_started_by(f, count, moment - before) - 1)
+                _, offset, _ = self._record(f, first)
+                _, last_offset, last_length = self._record(f, started - 1)
+            length = last_offset + last_length - offset
+
+            header = b""
+            if first > 0:
+                with open(self._header_path(session_id, kind), "rb") as f:
+                    header = f.read()
+
+            if state["url"] is None:
+                spool_start = state["bytes_received"] - state["spool_bytes"]
+                if offset < spool_start:
+                    raise RecordingConflict("Clip is available once the recording is finalized", state["next_chunk"])
+                with open(spool_path, "rb") as f:
+                    f.seek(offset - spool_start)
+                    return header + f.read(length)
+            url = state["url"]
+
+        return header + self.storage.backend.read_range(url, offset, length)
+
+    def _upload_spool(self, session_id: int, kind: str, state: Dict[str, Any]):
+        """Stream the spool to S3 as the next multipart part, then empty it"""
+        _, spool_path = self._paths(session_id, kind)
+        if state["upload_id"] is None:
+            state["upload_id"] = self.storage.create_multipart_upload(state["key"], "video/webm")
+            self._save(session_id, kind, state)
+
+        part_number = len(state["parts"]) + 1
+        start_time = time.time()
+        with open(spool_path, "rb") as f:
+            etag = self.storage.upload_part(state["key"], state["upload_id"], part_number, f, state["spool_bytes"])
+
+        state["parts"].append({"PartNumber": part_number, "ETag": etag})
+        state["spool_bytes"] = 0
+        self._save(session_id, kind, state)
+        with open(spool_path, "wb"):
+            pass  # Truncate only after the manifest records the part
+        logger.debug("Uploaded recording part", extra={
+            "session_id": session_id, "kind": kind, "part": part_number, "seconds": round(time.time() - start_time, 3)
+        })
+
+class RecordingAssembler:
+    """
+    Joins the recordings/session_{id}/chunk_NNNN.webm fragments written by
+    StorageService.upload_video_chunk into one recording.
+
+    Fragments become parts of a multipart upload: on S3 each fragment of at
+    least 5 MiB is copied server-side, and smaller ones are streamed through
+    a spool file until they add up to a valid part. On the local backend
+    every fragment is streamed straight into the upload. Memory use does
+    not depend on the recording length. Fragments are deleted only after the
+    assembled object's size matches their total.
+    """
+
+    CHUNK_PATTERN = re.compile(r"chunk_(\d+)\.webm$")
+
+    def __init__(self, storage: StorageService):
+        self.storage = storage
+        self.root = os.getenv("RECORDING_SPOOL_DIR", "recording_spool")
+        self.part_size = max(self.storage.backend.min_part_size,
+                             int(float(os.getenv("RECORDING_PART_SIZE_MB", "8")) * 1024 * 1024))
+
+        self._lock = threading.Lock()
+        self._session_locks: Dict[int, threading.Lock] = {}
+
+    def _session_lock(self, session_id: int) -> threading.Lock:
+        with self._lock:
+            return self._session_locks.setdefault(session_id, threading.Lock())
+
+    def fragments(self, session_id: int) -> List[Tuple[str, int]]:
+        """(key, size) of a session's chunk fragments in chunk order"""
+        numbered = []
+        for key, size in self.storage.list_objects(f"recordings/session_{session_id}/chunk_"):
+            match = self.CHUNK_PATTERN.search(key)
+            if match:
+                numbered.append((int(match.group(1)), key, size))
+        return [(key, size) for _, key, size in sorted(numbered)]
+
+    def assemble(self, session_id: int, kind: str = "webcam") -> Optional[str]:
+        """
+        Concatenate the fragments and return the recording's reference (None
+        if there are none). One assembly per session at a time: a second
+        caller waits, then finds the fragments already consumed.
+        """
+        with self._session_lock(session_id):
+            fragments = self.fragments(session_id)
+            if not fragments:
+                return None
+
+            start_time = time.time()
+            timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+            key = f"recordings/session_{session_id}/{kind}_{timestamp}.webm"
+            upload_id = self.storage.create_multipart_upload(key, "video/webm")
+            try:
+                parts = self._upload_parts(key, upload_id, fragments)
+                reference = self.storage.complete_multipart_upload(key, upload_id, parts)
+            except Exception:
+                self.storage.abort_multipart_upload(key, upload_id)
+                raise
+
+            expected = sum(size for _, size in fragments)
+            actual = self.storage.object_size(reference)
+            if actual != expected:
+                raise StorageError(f"Assembled recording is {actual} bytes, fragments total {expected}")
+
+            for fragment_key, _ in fragments:
+                try:
+                    self.storage.delete_object(fragment_key)
+                except StorageError as e:
+                    logger.warning("Could not delete recording fragment: %s", e, extra={"key": fragment_key})
+
+            logger.info("Recording assembled from fragments", extra={
+                "session_id": session_id, "kind": kind, "fragments": len(fragments), "bytes": expected,
+                "parts": len(parts), "seconds": round(time.time() - start_time, 3)
+            })
+            return reference
+
+    def _upload_parts(self, key: str, upload_id: str, fragments: List[Tuple[str, int]]) -> List[Dict[str, Any]]:
+        parts: List[Dict[str, Any]] = []
+        min_part = self.storage.backend.min_part_size
+
+        def add_part(etag: str):
+            parts.append({"PartNumber": len(parts) + 1, "ETag": etag})
+
+        os.makedirs(self.root, exist_ok=True)
+        with tempfile.TemporaryFile(dir=self.root) as spool:
+            spooled = 0
+            for fragment_key, size in fragments:
+                if spooled == 0 and size >= min_part:
+                    add_part(self.storage.copy_part(key, upload_id, len(parts) + 1, fragment_key, size))
+                    continue
+
+                # Too small to stand alone as a part: stream it into the spool
+                with closing(self.storage.open_object(fragment_key)) as body:
+                    shutil.copyfileobj(body, spool, 1024 * 1024)
+                spooled += size
+                if spooled >= self.part_size:
+                    add_part(self._upload_spool(key, upload_id, len(parts) + 1, spool, spooled))
+                    spooled = 0
+
+            if spooled:
+                add_part(self._upload_spool(key, upload_id, len(parts) + 1, spool, spooled))
+        return parts
+
+    def _upload_spool(self, key: str, upload_id: str, part_number: int, spool, length: int) -> str:
+        spool.seek(0)
+        etag = self.storage.upload_part(key, upload_id, part_number, spool, length)
+        spool.seek(0)
+        spool.truncate()
+        return etag
@@ -0,0 +1,72 @@
+import os
+import time
+from typing import Dict, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class SamplingPolicy:
+    """
+    Server-controlled per-session frame sampling interval. Long good-behaviour
+    streaks back the interval off towards `max_interval`; a warning or tab
+    switch drops it straight to `alert_interval` for a while. The client is
+    told the current interval so skipped frames are never uploaded.
+    """
+
+    def __init__(self):
+        self.base_interval = float(os.getenv("SAMPLING_BASE_INTERVAL", "2.0"))
+        self.max_interval = float(os.getenv("SAMPLING_MAX_INTERVAL", "15.0"))
+        self.alert_interval = float(os.getenv("SAMPLING_ALERT_INTERVAL", "1.0"))
+        # How long to stay at alert_interval after a warning
+        self.alert_hold_seconds = float(os.getenv("SAMPLING_ALERT_HOLD_SECONDS", "60"))
+        # The interval doubles after every this many consecutive good checks
+        self.backoff_streak = int(os.getenv("SAMPLING_BACKOFF_STREAK", "10"))
+        # Accept frames that arrive slightly early (client timers drift)
+        self.tolerance = 0.9
+
+        self._intervals: Dict[int, float] = {}      # {session_id: seconds}
+        self._alert_until: Dict[int, float] = {}    # {session_id: timestamp}
+        self._last_sampled: Dict[int, float] = {}   # {session_id: timestamp}
+
+    def interval_for(self, session_id: int) -> float:
+        return self._intervals.get(session_id, self.base_interval)
+
+    def should_sample(self, session_id: int, now: Optional[float] = None) -> bool:
+        """Return True (and record it) if a frame for this session is due"""
+        now = now or time.time()
+        last = self._last_sampled.get(session_id)
+        if last is not None and now - last < self.interval_for(session_id) * self.tolerance:
+            return False
+        self._last_sampled[session_id] = now
+        return True
+
+    def on_good_behavior(self, session_id: int, streak: int) -> Optional[float]:
+        """
+        Record a clean check. Returns the new interval if it changed.
+        """
+        if time.time() < self._alert_until.get(session_id, 0):
+            return None
+
+        steps = streak // self.backoff_streak if self.backoff_streak > 0 else 0
+        interval = min(self.max_interval, self.base_interval * (2 ** min(steps, 16)))
+        return self._set(session_id, interval)
+
+    def on_alert(self, session_id: int) -> Optional[float]:
+        """
+        Record a warning or tab switch. Returns the new interval if it changed.
+        """
+        self._alert_until[session_id] = time.time() + self.alert_hold_seconds
+        # The next frame after an alert is due immediately
+        self._last_sampled.pop(session_id, None)
+        return self._set(session_id, self.alert_interval)
+
+    def forget(self, session_id: int):
+        self._intervals.pop(session_id, None)
+        self._alert_until.pop(session_id, None)
+        self._last_sampled.pop(session_id, None)
+
+    def _set(self, session_id: int, interval: float) -> Optional[float]:
+        if self._intervals.get(session_id) == interval:
+            return None
+        self._intervals[session_id] = interval
+        return interval
@@ -0,0 +1,25 @@
+import os
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Placeholders shipped in .env.example and older versions of auth.py
+_PLACEHOLDERS = {"your-secret-key-change-this", "your-secret-key-change-this-in-production"}
+
+def load_secret_key() -> str:
+    """
+    SECRET_KEY signs the JWTs (auth.py) and the URLs the API serves itself
+    (storage_backends.py); both read it from here so they follow one policy.
+    There is no default - a public one would make tokens and URLs forgeable -
+    so an unset key refuses to start. The example placeholder still works,
+    with a warning, so a copied .env.example runs in development.
+    """
+    key = os.getenv("SECRET_KEY", "")
+    if not key:
+        raise ValueError("SECRET_KEY is not set; it signs login tokens and storage URLs (see .env.example)")
+    if key in _PLACEHOLDERS:
+        logger.warning("SECRET_KEY is the example placeholder; set a random value outside development")
+    return key
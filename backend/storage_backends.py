@@ -0,0 +1,510 @@
+import os
+import abc
+import hmac
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager, closing
+from typing import Dict, Any, Optional, List, Tuple, BinaryIO
+from urllib.parse import urlencode
+import boto3
+from botocore.exceptions import ClientError, BotoCoreError
+from dotenv import load_dotenv
+from secret_key import load_secret_key
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Same key the JWTs are signed with (see auth.py)
+_SIGNING_KEY = load_secret_key().encode()
+
+class StorageError(Exception):
+    """A storage operation failed; callers may retry"""
+
+def sign(value: str, expires: int) -> str:
+    """HMAC for URLs the API serves itself (local objects, evidence segments)"""
+    return hmac.new(_SIGNING_KEY, f"{value}:{expires}".encode(), hashlib.sha256).hexdigest()
+
+def signed_query(value: str, expiration: int) -> Dict[str, Any]:
+    expires = int(time.time()) + expiration
+    return {"expires": expires, "signature": sign(value, expires)}
+
+def verify_signature(value: str, expires: int, signature: str) -> bool:
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(sign(value, expires), signature)
+
+class StorageBackend(abc.ABC):
+    """
+    Where evidence and recordings are kept. put() and complete_multipart()
+    return a reference that is stored in the database (MonitoringEvent.evidence_url,
+    ExamSession.*_recording_url); url_for() turns it into a URL a browser can open.
+    """
+
+    name = "none"
+    # Smallest multipart part the backend accepts (except the last part)
+    min_part_size = 0
+
+    @abc.abstractmethod
+    def put(self, key: str, body: bytes, content_type: str) -> str:
+        """Store an object and return its reference"""
+
+    @abc.abstractmethod
+    def create_multipart(self, key: str, content_type: str) -> str:
+        """Start a multipart upload and return its upload id"""
+
+    @abc.abstractmethod
+    def upload_part(self, key: str, upload_id: str, part_number: int, body: BinaryIO, length: int) -> str:
+        """Upload one part, streamed from a file object; returns its ETag"""
+
+    @abc.abstractmethod
+    def complete_multipart(self, key: str, upload_id: str, parts: List[Dict[str, Any]]) -> str:
+        """Finish a multipart upload and return the object's reference"""
+
+    @abc.abstractmethod
+    def abort_multipart(self, key: str, upload_id: str):
+        """Discard a multipart upload and the parts uploaded so far"""
+
+    def copy_part(self, key: str, upload_id: str, part_number: int, source_key: str, length: int) -> str:
+        """Use an existing object as one part of a multipart upload; streamed unless overridden"""
+        with closing(self.open_object(source_key)) as body:
+            return self.upload_part(key, upload_id, part_number, body, length)
+
+    @abc.abstractmethod
+    def list_objects(self, prefix: str) -> List[Tuple[str, int]]:
+        """(key, size) of every object whose key starts with `prefix`"""
+
+    @abc.abstractmethod
+    def open_object(self, key: str) -> BinaryIO:
+        """Readable stream of an object's bytes, by key"""
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        """Remove an object by key"""
+
+    @abc.abstractmethod
+    def size(self, reference: str) -> int:
+        """Size in bytes of a stored object"""
+
+    @abc.abstractmethod
+    def read_range(self, reference: str, offset: int, length: int) -> bytes:
+        """Read `length` bytes at `offset` of a stored object without fetching the rest"""
+
+    @abc.abstractmethod
+    def url_for(self, reference: str, expiration: int = 3600) -> Optional[str]:
+        """Time-limited URL a browser can open, or None if it cannot be signed"""
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+@contextmanager
+def _s3_errors():
+    try:
+        yield
+    except (ClientError, BotoCoreError) as e:
+        raise StorageError(str(e)) from e
+
+class S3Backend(StorageBackend):
+    """Private S3 bucket; references are the objects' https URLs"""
+
+    name = "s3"
+    # S3 rejects multipart parts smaller than 5 MiB (except the last one)
+    min_part_size = 5 * 1024 * 1024
+
+    def __init__(self, access_key: str, secret_key: str, region: str, bucket_name: str):
+        self.region = region
+        self.bucket_name = bucket_name
+        self.s3_client = boto3.client(
+            's3',
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            region_name=region
+        )
+
+    def object_url(self, key: str) -> str:
+        return f"https://{self.bucket_name}.s3.{self.region}.amazonaws.com/{key}"
+
+    def key_for(self, reference: str) -> str:
+        """Object key of a stored reference (accepts bare keys too)"""
+        prefix = self.object_url("")
+        return reference[len(prefix):] if reference.startswith(prefix) else reference
+
+    def put(self, key: str, body: bytes, content_type: str) -> str:
+        with _s3_errors():
+            self.s3_client.put_object(
+                Bucket=self.bucket_name,
+                Key=key,
+                Body=body,
+                ContentType=content_type,
+                ACL='private'
+            )
+        return self.object_url(key)
+
+    def create_multipart(self, key: str, content_type: str) -> str:
+        with _s3_errors():
+            response = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket_name, Key=key, ContentType=content_type, ACL='private'
+            )
+        return response["UploadId"]
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, body: BinaryIO, length: int) -> str:
+        with _s3_errors():
+            response = self.s3_client.upload_part(
+                Bucket=self.bucket_name, Key=key, UploadId=upload_id,
+                PartNumber=part_number, Body=body, ContentLength=length
+            )
+        return response["ETag"]
+
+    def complete_multipart(self, key: str, upload_id: str, parts: List[Dict[str, Any]]) -> str:
+        with _s3_errors():
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket_name, Key=key, UploadId=upload_id,
+                MultipartUpload={"Parts": parts}
+            )
+        return self.object_url(key)
+
+    def abort_multipart(self, key: str, upload_id: str):
+        with _s3_errors():
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id)
+
+    def copy_part(self, key: str, upload_id: str, part_number: int, source_key: str, length: int) -> str:
+        # Server-side copy: the bytes never pass through this process
+        with _s3_errors():
+            response = self.s3_client.upload_part_copy(
+                Bucket=self.bucket_name, Key=key, UploadId=upload_id, PartNumber=part_number,
+                CopySource={"Bucket": self.bucket_name, "Key": source_key}
+            )
+        return response["CopyPartResult"]["ETag"]
+
+    def list_objects(self, prefix: str) -> List[Tuple[str, int]]:
+        objects = []
+        with _s3_errors():
+            for page in self.s3_client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket_name, Prefix=prefix):
+                objects.extend((item["Key"], item["Size"]) for item in page.get("Contents", []))
+        return objects
+
+    def open_object(self, key: str) -> BinaryIO:
+        with _s3_errors():
+            return self.s3_client.get_object(Bucket=self.bucket_name, Key=key)["Body"]
+
+    def delete(self, key: str):
+        with _s3_errors():
+            self.s3_client.delete_object(Bucket=self.bucket_name, Key=key)
+
+    def size(self, reference: str) -> int:
+        with _s3_errors():
+            return self.s3_client.head_object(Bucket=self.bucket_name, Key=self.key_for(reference))["ContentLength"]
+
+    def read_range(self, reference: str, offset: int, length: int) -> bytes:
+        with _s3_errors():
+            response = self.s3_client.get_object(
+                Bucket=self.bucket_name, Key=self.key_for(reference),
+                Range=f"bytes={offset}-{offset + length - 1}"
+            )
+            return response["Body"].read()
+
+    def url_for(self, reference: str, expiration: int = 3600) -> Optional[str]:
+        try:
+            return self.s3_client.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': self.bucket_name, 'Key': self.key_for(reference)},
+                ExpiresIn=expiration
+            )
+        except ClientError as e:
+            logger.error("Error generating presigned URL: %s", e)
+            return None
+
+class LocalBackend(StorageBackend):
+    """
+    Content-addressed local filesystem store. Objects are named by the
+    SHA-256 of their bytes, so identical evidence frames are stored once.
+    References look like local://<sha256>; url_for() signs a time-limited
+    URL for the /api/storage route with SECRET_KEY.
+
+    Keys map to digests through small files under keys/, and each object
+    counts the keys linked to it, so deleting a key frees the object once
+    nothing else refers to it.
+    """
+
+    name = "local"
+    PREFIX = "local://"
+
+    def __init__(self, root: str, public_base_url: str = ""):
+        # Resolved once, so key_path() compares like with like for relative or symlinked roots
+        self.root = os.path.realpath(root)
+        self.keys_root = os.path.join(self.root, "keys")
+        self.public_base_url = public_base_url.rstrip("/")
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "uploads"), exist_ok=True)
+        os.makedirs(self.keys_root, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._written = 0
+        self._deduplicated = 0
+
+    # ---------- layout ----------
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def digest_for(self, reference: str) -> Optional[str]:
+        if not reference or not reference.startswith(self.PREFIX):
+            return None
+        digest = reference[len(self.PREFIX):]
+        # Digests come back from URLs and the database - never let them escape the store
+        if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+            return None
+        return digest
+
+    def key_path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.keys_root, key))
+        if not path.startswith(self.keys_root + os.sep):
+            raise StorageError(f"Invalid key: {key}")
+        return path
+
+    def content_type(self, digest: str) -> str:
+        try:
+            with open(self.path(digest) + ".json") as f:
+                return json.load(f)["content_type"]
+        except (OSError, ValueError, KeyError):
+            return "application/octet-stream"
+
+    def _digest_of_key(self, key: str) -> Optional[str]:
+        try:
+            with open(self.key_path(key)) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _adjust_links(self, digest: str, delta: int) -> int:
+        """Change an object's key count (caller holds _lock); -1 for objects stored before keys were tracked"""
+        sidecar = self.path(digest) + ".json"
+        with open(sidecar) as f:
+            meta = json.load(f)
+        if "links" not in meta:
+            return -1  # Never freed: older rows may reference it by digest alone
+        meta["links"] += delta
+        with open(sidecar + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(sidecar + ".tmp", sidecar)
+        return meta["links"]
+
+    def _link(self, key: str, digest: str):
+        """Point a key at an object (caller holds _lock)"""
+        path = self.key_path(key)
+        previous = self._digest_of_key(key)
+        if previous == digest:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            f.write(digest)
+        os.replace(path + ".tmp", path)
+        self._adjust_links(digest, 1)
+        if previous is not None:
+            self._unlink_object(previous)
+
+    def _unlink_object(self, digest: str):
+        if self._adjust_links(digest, -1) == 0:
+            for path in (self.path(digest), self.path(digest) + ".json"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _store(self, key: str, digest: str, content_type: str, source: str) -> str:
+        """
+        Publish the finished file `source` under its digest (or discard it if
+        that object already exists) and point `key` at it. The check, the
+        publish and the link share one critical section, so concurrent puts
+        of the same bytes cannot reset each other's link count.
+        """
+        target = self.path(digest)
+        with self._lock:
+            if os.path.exists(target):
+                self._deduplicated += 1
+                os.remove(source)
+            else:
+                self._written += 1
+                with open(target + ".json.tmp", "w") as f:
+                    json.dump({"content_type": content_type, "links": 0}, f)
+                os.replace(target + ".json.tmp", target + ".json")
+                os.replace(source, target)
+            self._link(key, digest)
+        return self.PREFIX + digest
+
+    # ---------- objects ----------
+
+    def put(self, key: str, body: bytes, content_type: str) -> str:
+        digest = hashlib.sha256(body).hexdigest()
+        target = self.path(digest)
+        try:
+            # Written outside the lock; only publishing the finished file is serialized
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temp = f"{target}.{uuid.uuid4().hex}.tmp"
+            with open(temp, "wb") as f:
+                f.write(body)
+            return self._store(key, digest, content_type, temp)
+        except (OSError, ValueError) as e:
+            raise StorageError(str(e)) from e
+
+    # ---------- multipart: parts are appended to one file, hashed on completion ----------
+
+    def _upload_paths(self, upload_id: str):
+        base = os.path.join(self.root, "uploads", os.path.basename(upload_id))
+        return base + ".part", base + ".json"
+
+    def create_multipart(self, key: str, content_type: str) -> str:
+        upload_id = uuid.uuid4().hex
+        data_path, meta_path = self._upload_paths(upload_id)
+        try:
+            open(data_path, "wb").close()
+            with open(meta_path, "w") as f:
+                json.dump({"key": key, "content_type": content_type, "offsets": {}}, f)
+        except OSError as e:
+            raise StorageError(str(e)) from e
+        return upload_id
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, body: BinaryIO, length: int) -> str:
+        data_path, meta_path = self._upload_paths(upload_id)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            # Re-uploading a part (after a crash) overwrites it and everything after it
+            offset = meta["offsets"].get(str(part_number), os.path.getsize(data_path))
+            with open(data_path, "r+b") as f:
+                f.truncate(offset)
+                f.seek(offset)
+                shutil.copyfileobj(body, f, 1024 * 1024)
+            meta["offsets"] = {n: o for n, o in meta["offsets"].items() if int(n) < part_number}
+            meta["offsets"][str(part_number)] = offset
+            with open(meta_path, "w") as f:
+                json.dump(meta, f)
+        except (OSError, ValueError, KeyError) as e:
+            raise StorageError(str(e)) from e
+        return str(part_number)
+
+    def complete_multipart(self, key: str, upload_id: str, parts: List[Dict[str, Any]]) -> str:
+        data_path, meta_path = self._upload_paths(upload_id)
+        try:
+            with open(meta_path) as f:
+                content_type = json.load(f)["content_type"]
+
+            # Hash in 1 MiB blocks - recordings can be hundreds of MB
+            hasher = hashlib.sha256()
+            with open(data_path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    hasher.update(block)
+
+            digest = hasher.hexdigest()
+            os.makedirs(os.path.dirname(self.path(digest)), exist_ok=True)
+            reference = self._store(key, digest, content_type, data_path)
+            os.remove(meta_path)
+            return reference
+        except (OSError, ValueError, KeyError) as e:
+            raise StorageError(str(e)) from e
+
+    def abort_multipart(self, key: str, upload_id: str):
+        for path in self._upload_paths(upload_id):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # ---------- keys ----------
+
+    def list_objects(self, prefix: str) -> List[Tuple[str, int]]:
+        # Only walk the directory the prefix points into
+        directory = os.path.dirname(self.key_path(prefix + "_"))
+        objects = []
+        for current, _, files in os.walk(directory):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                key = os.path.relpath(os.path.join(current, name), self.keys_root).replace(os.sep, "/")
+                digest = self._digest_of_key(key) if key.startswith(prefix) else None
+                if digest and os.path.exists(self.path(digest)):
+                    objects.append((key, os.path.getsize(self.path(digest))))
+        return sorted(objects)
+
+    def open_object(self, key: str) -> BinaryIO:
+        digest = self._digest_of_key(key)
+        if digest is None:
+            raise StorageError(f"No such key: {key}")
+        try:
+            return open(self.path(digest), "rb")
+        except OSError as e:
+            raise StorageError(str(e)) from e
+
+    def delete(self, key: str):
+        path = self.key_path(key)
+        try:
+            with self._lock:
+                digest = self._digest_of_key(key)
+                if digest is None:
+                    return
+                os.remove(path)
+                self._unlink_object(digest)
+        except (OSError, ValueError) as e:
+            raise StorageError(str(e)) from e
+
+    def size(self, reference: str) -> int:
+        digest = self.digest_for(reference)
+        if digest is None:
+            raise StorageError(f"Not a local reference: {reference}")
+        try:
+            return os.path.getsize(self.path(digest))
+        except OSError as e:
+            raise StorageError(str(e)) from e
+
+    def read_range(self, reference: str, offset: int, length: int) -> bytes:
+        digest = self.digest_for(reference)
+        if digest is None:
+            raise StorageError(f"Not a local reference: {reference}")
+        try:
+            with open(self.path(digest), "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+        except OSError as e:
+            raise StorageError(str(e)) from e
+
+    # ---------- signed URLs ----------
+
+    def url_for(self, reference: str, expiration: int = 3600) -> Optional[str]:
+        digest = self.digest_for(reference)
+        if digest is None:
+            return None
+        return f"{self.public_base_url}/api/storage/{digest}?{urlencode(signed_query(digest, expiration))}"
+
+    def verify(self, digest: str, expires: int, signature: str) -> bool:
+        return verify_signature(digest, expires, signature)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": self.name,
+                "objects_written": self._written,
+                "deduplicated": self._deduplicated,
+            }
+
+def create_backend() -> StorageBackend:
+    """
+    STORAGE_BACKEND=s3 | local | auto (default). "auto" uses S3 when its
+    credentials are configured and the local store otherwise, so evidence
+    is never silently dropped.
+    """
+    choice = os.getenv("STORAGE_BACKEND", "auto").lower()
+    access_key = os.getenv("AWS_ACCESS_KEY_ID")
+    secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
+    bucket_name = os.getenv("S3_BUCKET_NAME")
+    s3_configured = bool(access_key and secret_key and bucket_name)
+
+    if choice == "s3" or (choice == "auto" and s3_configured):
+        if not s3_configured:
+            raise ValueError("STORAGE_BACKEND=s3 requires AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY and S3_BUCKET_NAME")
+        return S3Backend(access_key, secret_key, os.getenv("AWS_REGION", "us-east-1"), bucket_name)
+
+    root = os.getenv("LOCAL_STORAGE_DIR", "storage")
+    if choice == "auto":
+        logger.warning("S3 credentials not configured. Storing evidence and recordings locally in %s", root)
+    return LocalBackend(root, os.getenv("STORAGE_PUBLIC_BASE_URL", ""))
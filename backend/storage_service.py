@@ -1,120 +1,413 @@
 import os
-import boto3
-from botocore.exceptions import ClientError
+import json
+import time
+import uuid
+import queue
+import random
+import logging
+import threading
+from collections import OrderedDict
 from datetime import datetime
-import base64
-from typing import Optional
+from typing import Dict, Any, Optional, Callable, List, Tuple
+from urllib.parse import urlencode
 from dotenv import load_dotenv
 
+from image_utils import Frame, frame_bytes
+from metrics import STORAGE_UPLOAD_LATENCY
+from storage_backends import StorageBackend, StorageError, create_backend, signed_query
+
 load_dotenv()
 
-class StorageService:
-    def __init__(self):
-        self.aws_access_key = os.getenv("AWS_ACCESS_KEY_ID")
-        self.aws_secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
-        self.region = os.getenv("AWS_REGION", "us-east-1")
-        self.bucket_name = os.getenv("S3_BUCKET_NAME")
-
-        if self.aws_access_key and self.aws_secret_key and self.bucket_name:
-            self.s3_client = boto3.client(
-                's3',
-                aws_access_key_id=self.aws_access_key,
-                aws_secret_access_key=self.aws_secret_key,
-                region_name=self.region
-            )
-        else:
-            self.s3_client = None
-            print("Warning: S3 credentials not configured. File uploads will be disabled.")
-
-    def upload_screenshot(self, image_base64: str, session_id: int, event_type: str) -> Optional[str]:
-        """Upload a screenshot to S3 and return the URL"""
-        if not self.s3_client:
-            return None
+logger = logging.getLogger(__name__)
+
+# Evidence that is still uploading is referenced as "pending:<object key>"
+PENDING_PREFIX = "pending:"
+
+def pending_reference(key: str) -> str:
+    return PENDING_PREFIX + key
+
+def is_pending(url: Optional[str]) -> bool:
+    return bool(url) and url.startswith(PENDING_PREFIX)
+
+# A frame archived inside an evidence segment is "segment:<object key>#<offset>+<length>"
+SEGMENT_PREFIX = "segment:"
+
+def segment_reference(key: str, offset: int, length: int) -> str:
+    return f"{SEGMENT_PREFIX}{key}#{offset}+{length}"
+
+def parse_segment_reference(reference: Optional[str]) -> Optional[Tuple[str, int, int]]:
+    """(key, offset, length) of a segment reference, or None if it is not one"""
+    if not reference or not reference.startswith(SEGMENT_PREFIX):
+        return None
+    key, _, span = reference[len(SEGMENT_PREFIX):].rpartition("#")
+    offset, _, length = span.partition("+")
+    if not key or not offset.isdigit() or not length.isdigit():
+        return None
+    return key, int(offset), int(length)
+
+class UploadJob:
+    """One object waiting to be written to storage"""
+
+    def __init__(self, key: str, body: bytes, content_type: str, kind: str,
+                 context: Optional[Dict[str, Any]] = None, attempts: int = 0):
+        self.key = key
+        self.body = body
+        self.content_type = content_type
+        self.kind = kind
+        self.context = context or {}
+        self.attempts = attempts
+
+    @property
+    def pending_url(self) -> str:
+        return pending_reference(self.key)
+
+class UploadQueue:
+    """
+    Uploads evidence on background threads so the Socket.IO handlers never
+    wait on storage. Failed uploads are retried with exponential backoff.
+    Jobs that still fail, whose completion handler fails, or that arrive
+    while the queue is full, are spooled to local disk and replayed later,
+    so evidence survives S3 and database outages and restarts.
+    """
+
+    def __init__(self, storage: "StorageService"):
+        self.storage = storage
+        self.workers = int(os.getenv("UPLOAD_WORKERS", "4"))
+        self.max_retries = int(os.getenv("UPLOAD_MAX_RETRIES", "5"))
+        self.retry_base = float(os.getenv("UPLOAD_RETRY_BASE_SECONDS", "0.5"))
+        self.spool_dir = os.getenv("UPLOAD_SPOOL_DIR", "upload_spool")
+        self.replay_interval = float(os.getenv("UPLOAD_SPOOL_REPLAY_SECONDS", "30"))
+
+        self._queue: queue.Queue = queue.Queue(maxsize=int(os.getenv("UPLOAD_QUEUE_SIZE", "1000")))
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._replay_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._counts = {"queued": 0, "uploaded": 0, "retries": 0, "spooled": 0, "replayed": 0}
+
+    def start(self):
+        if self._threads:
+            return
+        os.makedirs(self.spool_dir, exist_ok=True)
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"s3-upload-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        # Pick up evidence spooled before the last shutdown
+        self._replay_spool()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the workers and spool whatever has not been uploaded yet"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout / max(1, len(self._threads)))
+        self._threads = []
+        while True:
+            try:
+                self._spool(self._queue.get_nowait())
+            except queue.Empty:
+                break
 
+    def submit(self, job: UploadJob):
+        """Queue a job; never blocks - a full queue overflows to the disk spool"""
         try:
-            # Decode base64 image
-            image_data = base64.b64decode(image_base64)
-
-            # Generate unique filename
-            timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f")
-            filename = f"screenshots/session_{session_id}/{event_type}_{timestamp}.jpg"
-
-            # Upload to S3
-            self.s3_client.put_object(
-                Bucket=self.bucket_name,
-                Key=filename,
-                Body=image_data,
-                ContentType='image/jpeg',
-                ACL='private'
-            )
-
-            # Generate URL
-            url = f"https://{self.bucket_name}.s3.{self.region}.amazonaws.com/{filename}"
-            return url
-
-        except ClientError as e:
-            print(f"Error uploading screenshot to S3: {e}")
+            self._queue.put_nowait(job)
+            self._count("queued")
+        except queue.Full:
+            self._spool(job)
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                job = self._queue.get(timeout=self.replay_interval)
+            except queue.Empty:
+                self._replay_spool()
+                continue
+            self._process(job)
+
+    def _process(self, job: UploadJob):
+        while True:
+            try:
+                url = self.storage.put_object(job.key, job.body, job.content_type, job.kind)
+                break
+            except StorageError as e:
+                job.attempts += 1
+                if job.attempts > self.max_retries or self._stop.is_set():
+                    logger.warning("Upload failed after %d attempts, spooling to disk: %s", job.attempts, e,
+                                   extra={"key": job.key})
+                    self._spool(job)
+                    return
+                self._count("retries")
+                # Exponential backoff with jitter; wakes early on shutdown
+                delay = self.retry_base * (2 ** (job.attempts - 1)) * random.uniform(0.5, 1.5)
+                self._stop.wait(delay)
+
+        self._count("uploaded")
+        callback = self.storage.completion_handlers.get(job.kind)
+        if callback is not None:
+            try:
+                callback(job, url)
+            except Exception:
+                # The object is stored but nothing records it yet; uploads are idempotent per key,
+                # so the replayed job is uploaded again and the callback gets another chance
+                logger.exception("Upload completion callback failed, spooling to disk", extra={"key": job.key})
+                self._spool(job)
+
+    def _spool(self, job: UploadJob):
+        """Write a job to disk; the .json file is written last so a partial spool is never replayed"""
+        name = os.path.join(self.spool_dir, uuid.uuid4().hex)
+        try:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            with open(name + ".bin", "wb") as f:
+                f.write(job.body)
+            meta = {"key": job.key, "content_type": job.content_type, "kind": job.kind,
+                    "context": job.context, "attempts": job.attempts}
+            with open(name + ".tmp", "w") as f:
+                json.dump(meta, f)
+            os.replace(name + ".tmp", name + ".json")
+            self._count("spooled")
+        except OSError:
+            logger.exception("Could not spool upload, evidence lost", extra={"key": job.key})
+
+    def _replay_spool(self):
+        """Move spooled jobs back onto the queue while there is room"""
+        if not self._replay_lock.acquire(blocking=False):
+            return
+        try:
+            for entry in sorted(os.listdir(self.spool_dir)):
+                if not entry.endswith(".json") or self._queue.full() or self._stop.is_set():
+                    continue
+                name = os.path.join(self.spool_dir, entry[:-len(".json")])
+                try:
+                    with open(name + ".json") as f:
+                        meta = json.load(f)
+                    with open(name + ".bin", "rb") as f:
+                        body = f.read()
+                    os.remove(name + ".json")
+                    os.remove(name + ".bin")
+                except (OSError, ValueError):
+                    logger.exception("Skipping unreadable spool entry", extra={"entry": entry})
+                    continue
+                # A replayed job gets a fresh set of retries
+                self.submit(UploadJob(meta["key"], body, meta["content_type"], meta["kind"], meta.get("context")))
+                self._count("replayed")
+        except OSError:
+            logger.exception("Could not read upload spool")
+        finally:
+            self._replay_lock.release()
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self._counts[name] += 1
+
+    def spooled_count(self) -> int:
+        try:
+            return sum(1 for entry in os.listdir(self.spool_dir) if entry.endswith(".json"))
+        except OSError:
+            return 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            counts = dict(self._counts)
+        return {
+            "workers": len(self._threads),
+            "depth": self.depth(),
+            "on_disk": self.spooled_count(),
+            **counts,
+        }
+
+class PresignedUrlCache:
+    """
+    Reuses signed URLs per stored reference until shortly before they
+    expire, so listing thousands of events does not re-sign every one on
+    each dashboard refresh. Entries past their refresh point are evicted
+    first when the cache is full, then the least recently used.
+    """
+
+    def __init__(self, sign: Callable[[str, int], Optional[str]]):
+        self.sign = sign
+        self.ttl = int(os.getenv("PRESIGNED_URL_TTL_SECONDS", "3600"))
+        # Hand out a URL only if it stays valid at least this long
+        self.refresh_margin = min(self.ttl // 2, int(os.getenv("PRESIGNED_URL_REFRESH_MARGIN_SECONDS", "300")))
+        self.max_entries = int(os.getenv("PRESIGNED_URL_CACHE_SIZE", "20000"))
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # {reference: (url, refresh_at)}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, reference: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(reference)
+            if entry is not None and now < entry[1]:
+                self._entries.move_to_end(reference)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Sign outside the lock - S3 signing is local but not free
+        url = self.sign(reference, self.ttl)
+        if url is None:
             return None
 
-    def upload_video_chunk(self, video_data: bytes, session_id: int, chunk_number: int) -> Optional[str]:
-        """Upload a video chunk to S3"""
-        if not self.s3_client:
+        with self._lock:
+            self._entries[reference] = (url, now + self.ttl - self.refresh_margin)
+            self._entries.move_to_end(reference)
+            if len(self._entries) > self.max_entries:
+                self._evict(now)
+        return url
+
+    def _evict(self, now: float):
+        stale = [reference for reference, (_, refresh_at) in self._entries.items() if refresh_at <= now]
+        for reference in stale:
+            del self._entries[reference]
+        self.evictions += len(stale)
+        # Shrink to 90% so the scan above is amortized over many inserts
+        while len(self._entries) > self.max_entries * 0.9:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+class StorageService:
+    def __init__(self, backend: Optional[StorageBackend] = None):
+        self.backend = backend or create_backend()
+
+        # Background uploads for evidence. completion_handlers[job.kind](job, url) runs on
+        # the upload thread; handlers are looked up by kind so spooled jobs find theirs too.
+        # A handler that raises has its job spooled and replayed, so it must be idempotent
+        self.upload_queue = UploadQueue(self)
+        self.completion_handlers: Dict[str, Callable[[UploadJob, str], None]] = {}
+        # Segment frames are served by the API itself (/api/evidence/segment)
+        self.public_base_url = os.getenv("STORAGE_PUBLIC_BASE_URL", "").rstrip("/")
+        self.url_cache = PresignedUrlCache(self.generate_presigned_url)
+
+    def start(self):
+        self.upload_queue.start()
+
+    def stop(self):
+        self.upload_queue.stop()
+
+    def put_object(self, key: str, body: bytes, content_type: str, kind: str) -> str:
+        """Store an object with upload latency recorded per kind; returns its reference"""
+        start_time = time.time()
+        reference = self.backend.put(key, body, content_type)
+        STORAGE_UPLOAD_LATENCY.observe(time.time() - start_time, kind=kind)
+        return reference
+
+    def screenshot_key(self, session_id: int, event_type: str) -> str:
+        timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f")
+        return f"screenshots/session_{session_id}/{event_type}_{timestamp}.jpg"
+
+    def queue_screenshot(self, key: str, image: Frame, context: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Upload a screenshot in the background under a key from screenshot_key().
+        Returns the pending reference to store until the "screenshot" completion handler fires.
+        """
+        job = UploadJob(key, frame_bytes(image).tobytes(), 'image/jpeg', kind="screenshot", context=context)
+        self.upload_queue.submit(job)
+        return job.pending_url
+
+    def upload_screenshot(self, image: Frame, session_id: int, event_type: str) -> Optional[str]:
+        """Store a screenshot (JPEG bytes, or base64 from older callers) and return its reference"""
+        try:
+            # Backends take bytes, not memoryviews - this is the only copy of the evidence frame
+            image_data = frame_bytes(image).tobytes()
+            return self.put_object(self.screenshot_key(session_id, event_type), image_data, 'image/jpeg', kind="screenshot")
+
+        except StorageError as e:
+            logger.error("Error uploading screenshot: %s", e)
             return None
 
+    def upload_video_chunk(self, video_data: bytes, session_id: int, chunk_number: int) -> Optional[str]:
+        """Store a video chunk"""
         try:
             filename = f"recordings/session_{session_id}/chunk_{chunk_number:04d}.webm"
 
-            self.s3_client.put_object(
-                Bucket=self.bucket_name,
-                Key=filename,
-                Body=video_data,
-                ContentType='video/webm',
-                ACL='private'
-            )
+            return self.put_object(filename, video_data, 'video/webm', kind="video_chunk")
 
-            url = f"https://{self.bucket_name}.s3.{self.region}.amazonaws.com/{filename}"
-            return url
-
-        except ClientError as e:
-            print(f"Error uploading video chunk to S3: {e}")
+        except StorageError as e:
+            logger.error("Error uploading video chunk: %s", e)
             return None
 
     def upload_complete_video(self, video_data: bytes, session_id: int, video_type: str = "webcam") -> Optional[str]:
-        """Upload complete video recording to S3"""
-        if not self.s3_client:
-            return None
-
+        """Store a complete video recording"""
         try:
             timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
             filename = f"recordings/session_{session_id}/{video_type}_{timestamp}.webm"
 
-            self.s3_client.put_object(
-                Bucket=self.bucket_name,
-                Key=filename,
-                Body=video_data,
-                ContentType='video/webm',
-                ACL='private'
-            )
-
-            url = f"https://{self.bucket_name}.s3.{self.region}.amazonaws.com/{filename}"
-            return url
+            return self.put_object(filename, video_data, 'video/webm', kind="video")
 
-        except ClientError as e:
-            print(f"Error uploading video to S3: {e}")
+        except StorageError as e:
+            logger.error("Error uploading video: %s", e)
             return None
 
+    def create_multipart_upload(self, key: str, content_type: str) -> str:
+        """Start a multipart upload and return its upload id"""
+        return self.backend.create_multipart(key, content_type)
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, body, length: int) -> str:
+        """Upload one part from a file object (streamed, not loaded into memory); returns its ETag"""
+        start_time = time.time()
+        etag = self.backend.upload_part(key, upload_id, part_number, body, length)
+        STORAGE_UPLOAD_LATENCY.observe(time.time() - start_time, kind="recording_part")
+        return etag
+
+    def copy_part(self, key: str, upload_id: str, part_number: int, source_key: str, length: int) -> str:
+        """Use an existing object as the next part (server-side copy where the backend supports it)"""
+        start_time = time.time()
+        etag = self.backend.copy_part(key, upload_id, part_number, source_key, length)
+        STORAGE_UPLOAD_LATENCY.observe(time.time() - start_time, kind="recording_copy")
+        return etag
+
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: List[Dict[str, Any]]) -> str:
+        return self.backend.complete_multipart(key, upload_id, parts)
+
+    def abort_multipart_upload(self, key: str, upload_id: str):
+        self.backend.abort_multipart(key, upload_id)
+
+    def list_objects(self, prefix: str) -> List[Tuple[str, int]]:
+        return self.backend.list_objects(prefix)
+
+    def open_object(self, key: str):
+        return self.backend.open_object(key)
+
+    def object_size(self, reference: str) -> int:
+        return self.backend.size(reference)
+
+    def delete_object(self, key: str):
+        self.backend.delete(key)
+
     def generate_presigned_url(self, file_key: str, expiration: int = 3600) -> Optional[str]:
-        """Generate a presigned URL for accessing a private file"""
-        if not self.s3_client:
-            return None
+        """Time-limited URL for a private object, from its stored reference"""
+        if file_key.startswith(SEGMENT_PREFIX):
+            if parse_segment_reference(file_key) is None:
+                return None
+            query = urlencode({"ref": file_key, **signed_query(file_key, expiration)})
+            return f"{self.public_base_url}/api/evidence/segment?{query}"
+        return self.backend.url_for(file_key, expiration)
 
-        try:
-            url = self.s3_client.generate_presigned_url(
-                'get_object',
-                Params={'Bucket': self.bucket_name, 'Key': file_key},
-                ExpiresIn=expiration
-            )
-            return url
-        except ClientError as e:
-            print(f"Error generating presigned URL: {e}")
+    def presigned_url(self, reference: Optional[str]) -> Optional[str]:
+        """Cached, browser-openable URL for a stored reference (None while still uploading)"""
+        if not reference or is_pending(reference):
             return None
+        return self.url_cache.get(reference)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.backend.get_stats(),
+            "uploads": self.upload_queue.get_stats(),
+            "presigned_urls": self.url_cache.get_stats(),
+        }
@@ -75,6 +75,19 @@ export const sessionAPI = {
     api.get(`/sessions/${sessionId}/behavior-report`),
 };
 
+// Recording API
+export const recordingAPI = {
+  getStatus: (sessionId: number, kind: 'webcam' | 'screen') =>
+    api.get<{ next_chunk: number; bytes_received: number; finalized: boolean }>(
+      `/sessions/${sessionId}/recordings/${kind}`
+    ),
+
+  uploadChunk: (sessionId: number, kind: 'webcam' | 'screen', chunkNumber: number, chunk: Blob, recordedAt: number) =>
+    api.put(`/sessions/${sessionId}/recordings/${kind}/chunks/${chunkNumber}`, chunk, {
+      headers: { 'Content-Type': 'application/octet-stream', 'X-Recorded-At': String(recordedAt) },
+    }),
+};
+
 // Submission API
 export const submissionAPI = {
   submit: (sessionId: number, answers: Array<{ question_id: number; answer_text: string }>) =>
@@ -0,0 +1,104 @@
+import { recordingAPI } from './api';
+
+type RecordingKind = 'webcam' | 'screen';
+
+const CHUNK_INTERVAL_MS = 5000;
+const MAX_RETRY_DELAY_MS = 30000;
+
+/**
+ * Records a media stream with MediaRecorder and uploads it chunk by chunk.
+ * Chunks are sent in order; after a network error the uploader asks the
+ * server which chunk it expects next and resumes from there. A recording is
+ * one MediaRecorder stream, so it is not resumed after a page reload.
+ */
+export class RecordingUploader {
+  private recorder: MediaRecorder | null = null;
+  private queue: { number: number; blob: Blob; recordedAt: number }[] = [];
+  private chunkStartedAt = 0;
+  private nextChunk = 0;
+  private uploading = false;
+  private retryDelay = 1000;
+
+  constructor(private sessionId: number, private kind: RecordingKind) {}
+
+  async start(stream: MediaStream) {
+    if (this.recorder || typeof MediaRecorder === 'undefined') return;
+
+    try {
+      const { data } = await recordingAPI.getStatus(this.sessionId, this.kind);
+      if (data.finalized) return;
+      if (data.next_chunk > 0) {
+        // A previous page load already recorded a stream. A new MediaRecorder starts its own
+        // WebM header, which cannot be appended mid-file, so keep the first recording as it is
+        console.warn(`Recording already has ${data.next_chunk} chunks from an earlier page load; not recording again`);
+        return;
+      }
+    } catch (error) {
+      console.warn('Could not read recording status, starting at chunk 0', error);
+    }
+
+    this.recorder = new MediaRecorder(stream, { mimeType: 'video/webm' });
+    this.recorder.ondataavailable = (event) => {
+      // Start time of each chunk feeds the server's time index for evidence clips
+      const recordedAt = this.chunkStartedAt;
+      this.chunkStartedAt = Date.now();
+      if (event.data.size > 0) {
+        this.queue.push({ number: this.nextChunk++, blob: event.data, recordedAt });
+        this.flush();
+      }
+    };
+    this.chunkStartedAt = Date.now();
+    this.recorder.start(CHUNK_INTERVAL_MS);
+  }
+
+  /** Stop recording and wait until every chunk has been uploaded */
+  async stop(): Promise<void> {
+    if (this.recorder && this.recorder.state !== 'inactive') {
+      const stopped = new Promise((resolve) => this.recorder!.addEventListener('stop', resolve, { once: true }));
+      this.recorder.stop();
+      await stopped;
+    }
+    this.recorder = null;
+    while (this.queue.length > 0 || this.uploading) {
+      await this.flush();
+      await new Promise((resolve) => setTimeout(resolve, 200));
+    }
+  }
+
+  private async flush() {
+    if (this.uploading) return;
+    this.uploading = true;
+
+    try {
+      while (this.queue.length > 0) {
+        const chunk = this.queue[0];
+        try {
+          await recordingAPI.uploadChunk(this.sessionId, this.kind, chunk.number, chunk.blob, chunk.recordedAt);
+          this.queue.shift();
+          this.retryDelay = 1000;
+        } catch (error: any) {
+          const expected = error.response?.data?.detail?.next_chunk;
+          if (error.response?.status === 409 && typeof expected === 'number') {
+            if (chunk.number === expected) {
+              // Rejected although it is the expected chunk: the recording was finalized
+              this.queue = [];
+              return;
+            }
+            // The server already has everything before `expected`; drop those
+            this.queue = this.queue.filter((c) => c.number >= expected);
+            if (this.queue.length === 0 || this.queue[0].number === expected) continue;
+            // The chunk the server needs is gone - nothing more can be appended
+            console.error(`Recording gap: server expects chunk ${expected}`);
+            this.queue = [];
+            return;
+          }
+          // Network error or server hiccup: back off and retry the same chunk
+          await new Promise((resolve) => setTimeout(resolve, this.retryDelay));
+          this.retryDelay = Math.min(this.retryDelay * 2, MAX_RETRY_DELAY_MS);
+        }
+      }
+    } finally {
+      this.uploading = false;
+    }
+  }
+}
@@ -64,6 +64,33 @@ export function captureFrame(videoElement: HTMLVideoElement): string {
   return canvas.toDataURL('image/jpeg', 0.8).split(',')[1];
 }
 
+// Raw JPEG bytes of the current video frame. Socket.IO sends ArrayBuffers as
+// binary attachments, avoiding the ~33% size overhead of base64 text.
+export function captureFrameBinary(videoElement: HTMLVideoElement): Promise<ArrayBuffer | null> {
+  const canvas = document.createElement('canvas');
+  canvas.width = videoElement.videoWidth;
+  canvas.height = videoElement.videoHeight;
+
+  const ctx = canvas.getContext('2d');
+  if (!ctx) return Promise.resolve(null);
+
+  ctx.drawImage(videoElement, 0, 0);
+
+  return new Promise((resolve) => {
+    canvas.toBlob(
+      (blob) => {
+        if (!blob) {
+          resolve(null);
+          return;
+        }
+        blob.arrayBuffer().then(resolve, () => resolve(null));
+      },
+      'image/jpeg',
+      0.8
+    );
+  });
+}
+
 export async function captureScreen(): Promise<string | null> {
   try {
     const stream = await navigator.mediaDevices.getDisplayMedia({
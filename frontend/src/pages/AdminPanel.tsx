@@ -75,8 +75,18 @@ export function AdminPanel() {
       );
     });
 
+    // Evidence screenshots upload in the background; swap in the real URL when ready
+    socket.on('evidence_ready', (data: { pending_url: string; evidence_url: string }) => {
+      setAlerts((prev) =>
+        prev.map((alert) =>
+          alert.evidence_url === data.pending_url ? { ...alert, evidence_url: data.evidence_url } : alert
+        )
+      );
+    });
+
     return () => {
       socket.off('cheating_alert');
+      socket.off('evidence_ready');
     };
   }, [examId]);
 
@@ -299,7 +309,7 @@ export function AdminPanel() {
                               Severity: {alert.severity}/5
                             </span>
                           </div>
-                          {alert.evidence_url && (
+                          {alert.evidence_url && !alert.evidence_url.startsWith('pending:') && (
                             <button
                               className="text-xs text-primary-600 hover:underline mt-2 font-medium"
                               onClick={() => window.open(alert.evidence_url, '_blank')}
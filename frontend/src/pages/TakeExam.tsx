@@ -7,7 +7,8 @@ import { examAPI, sessionAPI, submissionAPI } from '@/lib/api';
 import { getSocket, connectSocket } from '@/lib/socket';
 import { useAuthStore } from '@/store/authStore';
 import { Exam, Question, QuestionType } from '@/types';
-import { getTimeRemaining, captureFrame } from '@/lib/utils';
+import { getTimeRemaining, captureFrameBinary } from '@/lib/utils';
+import { RecordingUploader } from '@/lib/recording';
 import toast from 'react-hot-toast';
 import { AlertTriangle, Camera, Monitor, Clock } from 'lucide-react';
 
@@ -41,8 +42,10 @@ export function TakeExam() {
 
   const webcamRef = useRef<Webcam>(null);
   const monitoringInterval = useRef<NodeJS.Timeout | null>(null);
+  const samplingIntervalMs = useRef(2000); // Updated by the server via 'sampling_interval'
   const timerInterval = useRef<NodeJS.Timeout | null>(null);
   const socket = useRef(getSocket());
+  const webcamRecorder = useRef<RecordingUploader | null>(null);
 
   // Secure browser mode: prevent tab switching, copy/paste, etc.
   useEffect(() => {
@@ -267,9 +270,24 @@ export function TakeExam() {
         });
       });
 
+      // The server adapts how often it wants frames; restart capture at the new rate
+      socket.current.on('sampling_interval', (data: { interval_ms: number }) => {
+        if (data.interval_ms && data.interval_ms !== samplingIntervalMs.current) {
+          samplingIntervalMs.current = data.interval_ms;
+          startMonitoring();
+        }
+      });
+
       // Start monitoring
       startMonitoring();
 
+      // Record the webcam and stream it to the server in chunks
+      const webcamStream = webcamRef.current?.stream;
+      if (webcamStream) {
+        webcamRecorder.current = new RecordingUploader(session.id, 'webcam');
+        webcamRecorder.current.start(webcamStream);
+      }
+
       // Start timer
       startTimer();
 
@@ -282,16 +300,19 @@ export function TakeExam() {
   };
 
   // Start AI monitoring
+  const frameCount = useRef(0);
   const startMonitoring = () => {
-    let frameCount = 0;
-    monitoringInterval.current = setInterval(() => {
+    if (monitoringInterval.current) {
+      clearInterval(monitoringInterval.current);
+    }
+    monitoringInterval.current = setInterval(async () => {
       if (webcamRef.current?.video) {
-        const frame = captureFrame(webcamRef.current.video);
+        const frame = await captureFrameBinary(webcamRef.current.video);
 
         if (frame) {
-          frameCount++;
-          if (frameCount % 10 === 0) {
-            console.log(`📸 Real-time monitoring: ${frameCount} frames analyzed`);
+          frameCount.current++;
+          if (frameCount.current % 10 === 0) {
+            console.log(`📸 Real-time monitoring: ${frameCount.current} frames analyzed`);
           }
           socket.current.emit('analyze_frame', {
             session_id: session.id,
@@ -299,7 +320,7 @@ export function TakeExam() {
           });
         }
       }
-    }, 500); // Analyze every 0.5 seconds for real-time detection
+    }, samplingIntervalMs.current); // Server-controlled sampling rate
   };
 
   // Start timer
@@ -363,6 +384,15 @@ export function TakeExam() {
         clearInterval(timerInterval.current);
       }
 
+      // Upload the rest of the recording before submitting (the server finalizes it on submit)
+      if (webcamRecorder.current) {
+        await Promise.race([
+          webcamRecorder.current.stop(),
+          new Promise((resolve) => setTimeout(resolve, 15000)),
+        ]);
+        webcamRecorder.current = null;
+      }
+
       // Prepare answers
       const submissionAnswers = exam!.questions!.map((q) => ({
         question_id: q.id,